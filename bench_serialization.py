@@ -0,0 +1,56 @@
+"""
+Micro-benchmark: per-request JSON CPU cost of the old string-based query path
+versus the dict-native path with a single orjson serialization at the HTTP boundary.
+
+Usage: python bench_serialization.py [hits] [iterations]
+"""
+import os
+import sys
+import json
+import time
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "src"))
+import elastic_connector
+
+DSL = {
+    "size": 1000,
+    "query": {"bool": {"must": [{"term": {"rule.groups": "authentication_failed"}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}},
+    "sort": [{"@timestamp": {"order": "desc"}}]
+}
+
+def old_path(hits):
+    # Caller dumps, connector loads, agent_logic dumps for the response and the audit row,
+    # then FastAPI's default JSONResponse runs jsonable_encoder + json.dumps over everything.
+    q = json.loads(json.dumps(DSL))
+    results = {"status": "success", "total_hits": len(hits), "data": hits}
+    audit_row = json.dumps(q)
+    body = {"queryGenerated": json.dumps(q), "results": results}
+    return json.dumps(jsonable_encoder(body), ensure_ascii=False, separators=(",", ":")).encode("utf-8"), audit_row
+
+def new_path(hits):
+    # Dicts end to end; orjson once for the audit row and once for the response body.
+    q = dict(DSL)
+    results = {"status": "success", "total_hits": len(hits), "data": hits}
+    audit_row = orjson.dumps(q).decode()
+    body = {"queryGenerated": q, "results": results}
+    return orjson.dumps(body), audit_row
+
+def bench(fn, hits, iterations):
+    fn(hits)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(hits)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+if __name__ == "__main__":
+    n_hits = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    hits = elastic_connector.get_mock_data(size=n_hits)
+    old_us = bench(old_path, hits, iterations)
+    new_us = bench(new_path, hits, iterations)
+    print(f"{n_hits} hits, {iterations} iterations")
+    print(f"  old (json + jsonable_encoder): {old_us:10.0f} us/request")
+    print(f"  new (dicts + orjson):          {new_us:10.0f} us/request")
+    print(f"  saved:                         {old_us - new_us:10.0f} us/request ({old_us / new_us:.1f}x)")
@@ -487,7 +487,9 @@ Generated by SIEM Conversational Agent
         <TabsContent value="dsl" className="p-6">
           <div className="space-y-4">
             <pre className="max-h-96 overflow-auto rounded-md bg-slate-900 p-4 font-mono text-xs text-cyan-400">
-              {response.queryGenerated}
+              {typeof response.queryGenerated === 'string'
+                ? response.queryGenerated
+                : JSON.stringify(response.queryGenerated, null, 2)}
             </pre>
             <Button className="bg-green-600 hover:bg-green-700">
               Download DSL
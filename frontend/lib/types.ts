@@ -24,7 +24,7 @@ export interface Schema {
 }
 
 export interface ChatResponse {
-  queryGenerated: string;
+  queryGenerated: string | Record<string, any>;
   results: {
     totalHits: number;
     data: Record<string, any>[];
@@ -1,56 +1,143 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain.memory import ConversationBufferMemory
 import os
+import re
 import json
 import prompts
 import elastic_connector
+import schema_extractor
 import logging
 import validator
+import cost_guard
+import dsl_repair
+import llm_client
+import nl_cache
+import intent_templates
+import entity_pivot
+from conversation_memory import memory_store, is_follow_up
 import audit
 import time
+import uuid
+import random
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from rag_engine import mitre_rag
 from dotenv import load_dotenv
 
-# Memory for context
-memory = ConversationBufferMemory(return_messages=True)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Context gathering that does not depend on the LLM (MITRE retrieval) runs on this pool
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+_pipeline = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="context")
+
+# Failed attempts are retried after an exponential backoff with jitter, so concurrent
+# investigations hitting the same outage do not retry in lockstep
+MAX_RETRIES = 2
+RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "1"))
+RETRY_MAX_SECONDS = float(os.getenv("RETRY_MAX_SECONDS", "8"))
+
+def _backoff(attempt):
+    """Seconds to wait after failed attempt `attempt` (0-based): half of the exponential delay, plus up to the other half at random."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
 def get_llm():
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable is not set.")
-    
-    # Try multiple model names in case of availability issues
-    models_to_try = ["gemini-1.5-flash", "gemini-1.5-flash-latest", "gemini-1.5-pro", "gemini-1.0-pro", "gemini-pro", "gemini-2.0-flash", "gemini-2.0-flash-exp"]
-    
-    last_err = None
-    for model_name in models_to_try:
-        try:
-            llm = ChatGoogleGenerativeAI(
-                model=model_name, 
-                temperature=0, 
-                google_api_key=api_key,
-                max_retries=1
-            )
-            # Test it with a very simple call if possible, or just return it
-            return llm
-        except Exception as e:
-            logger.warning(f"Failed to initialize model {model_name}: {e}")
-            last_err = e
-            continue
-            
-    raise last_err or ValueError("Could not initialize any Gemini model.")
+    # Long-lived client for the model resolved at startup (see llm_client.probe)
+    return llm_client.get_llm()
+
+class _JsonStringStreamer:
+    """Decodes one string field of a JSON object while the object is still being generated."""
+    def __init__(self, key):
+        self.pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(key))
+        self.buffer = ""
+        self.pos = None
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.pos is None:
+            m = self.pattern.search(self.buffer)
+            if not m:
+                return ""
+            self.pos = m.end()
+        out = []
+        i = self.pos
+        while i < len(self.buffer):
+            c = self.buffer[i]
+            if c == '"':
+                self.done = True
+                i += 1
+                break
+            if c == "\\":
+                width = 6 if self.buffer[i + 1:i + 2] == "u" else 2
+                if i + width > len(self.buffer):
+                    break
+                try:
+                    out.append(json.loads(f'"{self.buffer[i:i + width]}"'))
+                except ValueError:
+                    pass
+                i += width
+                continue
+            out.append(c)
+            i += 1
+        self.pos = i
+        return "".join(out)
+
+def _call_llm(llm, messages, emit):
+    """invoke(), or stream() when someone is listening so the analysis text arrives as it is written."""
+    if emit is None or not hasattr(llm, "stream"):
+        return llm.invoke(messages).content
+    streamer = _JsonStringStreamer("analysis")
+    parts = []
+    for chunk in llm.stream(messages):
+        text = chunk.content if isinstance(chunk.content, str) else "".join(str(c) for c in chunk.content)
+        parts.append(text)
+        delta = streamer.feed(text)
+        if delta:
+            emit("token", {"text": delta})
+    return "".join(parts)
 
-def process_query(user_input, schema_context, size_limit=100, index_pattern="wazuh-alerts-*", user_name="session", max_lookback_days=None):
+def _parse_json(output):
+    """The JSON object in an LLM reply, tolerating code fences and surrounding prose."""
+    output = output.replace("```json", "").replace("```", "").strip()
+    try:
+        return json.loads(output)
+    except Exception:
+        start = output.find("{")
+        end = output.rfind("}")
+        if start != -1 and end != -1 and end > start:
+            return json.loads(output[start:end+1])
+        raise ValueError("LLM did not return valid JSON.")
+
+def _prompt_schema(schema_context, user_input):
     """
-    Main entry point for processing user queries with retry logic and multi-step investigation.
+    The LLM only sees the fields relevant to the question; validation uses the full mapping.
+    Returns (schema for the prompt, prompt token report or None).
     """
-    # 1. Retrieve history
-    history = memory.load_memory_variables({})
-    
-    # 2. Construct Prompt
+    if not schema_extractor.SCHEMA_PRUNING:
+        return schema_context, None
+    try:
+        full_schema = json.loads(schema_context) if isinstance(schema_context, str) else schema_context
+        pruned = schema_extractor.prune_schema(full_schema, user_input)
+        prompt_schema = json.dumps(pruned) if isinstance(schema_context, str) else pruned
+        prompt_tokens = {
+            "schema_fields_total": sum(len(p) for p in full_schema.values()),
+            "schema_fields_sent": sum(len(p) for p in pruned.values()),
+            "before": schema_extractor.estimate_tokens(prompts.get_system_prompt(schema_context)),
+            "after": schema_extractor.estimate_tokens(prompts.get_system_prompt(prompt_schema)),
+        }
+        logger.info(f"Schema context pruned to {prompt_tokens['schema_fields_sent']}/{prompt_tokens['schema_fields_total']} fields (~{prompt_tokens['before']} -> ~{prompt_tokens['after']} prompt tokens)")
+        return prompt_schema, prompt_tokens
+    except Exception as e:
+        logger.warning(f"Schema pruning failed, sending full mapping: {e}")
+        return schema_context, None
+
+def _rag_context(user_input):
     rag_context = ""
     try:
         relevant_techs = mitre_rag.search(user_input, k=2)
@@ -59,128 +146,566 @@ def process_query(user_input, schema_context, size_limit=100, index_pattern="waz
             logger.info(f"Retrieved {len(relevant_techs)} MITRE techniques from RAG for context.")
     except Exception as e:
         logger.warning(f"RAG retrieval failed: {e}")
+    return rag_context
+
+def _timed_call(fn, *args):
+    t0 = time.perf_counter()
+    value = fn(*args)
+    return value, round((time.perf_counter() - t0) * 1000, 1)
+
+def prefetch_rag(user_input):
+    """
+    Starts MITRE retrieval in the background. Callers that still have other work to do
+    (e.g. fetching the mapping) pass the future on as process_query(rag_future=...).
+    """
+    return _pipeline.submit(_timed_call, _rag_context, user_input)
+
+# Background narratives for template hits, by id; oldest dropped past NARRATIVE_KEEP
+NARRATIVE_KEEP = 256
+_narratives = OrderedDict()
+_narratives_lock = threading.Lock()
+
+def _write_narrative(user_input, query, results):
+    sample = results.get("data", [])[:3]
+    prompt = prompts.get_narrative_prompt(user_input, json.dumps(query), results.get("total_hits", 0), json.dumps(sample, default=str))
+    narrative = _parse_json(get_llm().invoke([HumanMessage(content=prompt)]).content)
+    return {k: narrative.get(k) for k in ("analysis", "story", "remediation")}
+
+def request_narrative(user_name, user_input, query, results):
+    """Has the LLM write the analysis of a template hit off the request path; returns the narrative id."""
+    narrative_id = uuid.uuid4().hex
+    future = _pipeline.submit(_write_narrative, user_input, query, results)
+    with _narratives_lock:
+        _narratives[narrative_id] = (user_name, future)
+        while len(_narratives) > NARRATIVE_KEEP:
+            _narratives.popitem(last=False)
+    return narrative_id
+
+def get_narrative(narrative_id, user_name):
+    """The future for a request_narrative() id owned by user_name, or None."""
+    with _narratives_lock:
+        owner, future = _narratives.get(narrative_id, (None, None))
+    return future if owner == user_name else None
+
+@contextmanager
+def _timed(timings, key):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[key] = round(timings.get(key, 0) + (time.perf_counter() - t0) * 1000, 1)
+
+class _Investigation:
+    """
+    State of one process_query()/aprocess_query() call. Everything that does not wait on the
+    LLM or Elasticsearch lives here so the sync and async drivers share it.
+    """
+    def __init__(self, user_input, schema_context, size_limit, index_pattern, user_name, max_lookback_days, fields, role, on_event, session_id):
+        self.user_input = user_input
+        self.schema_context = schema_context
+        self.size_limit = size_limit
+        self.index_pattern = index_pattern
+        self.user_name = user_name
+        self.max_lookback_days = max_lookback_days
+        self.fields = fields
+        self.role = role
+        self.on_event = on_event
+        self.session_id = session_id
+        self.reasoning_steps = []
+        self.timings = {}
+        self.started = time.perf_counter()
+        self.messages = []
+        # LLM corrections queued until the conversation has been built
+        self.corrections = []
+        self.pivot = None
+        self.narrative_id = None
+
+    def step(self, desc, kind):
+        self.reasoning_steps.append({"step": desc, "type": kind})
+        if self.on_event:
+            self.on_event("step", self.reasoning_steps[-1])
+
+    def emit(self, kind, data):
+        if self.on_event:
+            self.on_event(kind, data)
+
+    def timed(self, key):
+        return _timed(self.timings, key)
+
+    def prepare(self):
+        """History, schema pruning, and the translation cache and template lookups."""
+        # 1. Retrieve this session's bounded history (summary + recent turns)
+        self.history = ""
+        with self.timed("history_ms"):
+            try:
+                self.history = memory_store.history(self.user_name, self.session_id)
+            except Exception as e:
+                logger.warning(f"Conversation memory unavailable: {e}")
+        # Questions that refer back to earlier turns are translated with that context, never from cache
+        self.contextual = bool(self.history) and is_follow_up(self.user_input)
+
+        # 2. Construct Prompt
+        with self.timed("schema_prune_ms"):
+            self.prompt_schema, self.prompt_tokens = _prompt_schema(self.schema_context, self.user_input)
+        if self.prompt_tokens:
+            self.step(f"Selected {self.prompt_tokens['schema_fields_sent']} of {self.prompt_tokens['schema_fields_total']} schema fields relevant to the question", "schema")
 
-    system_msg = prompts.get_system_prompt(schema_context)
-    
-    messages = [
-        SystemMessage(content=system_msg),
-        HumanMessage(content=f"User Query: {user_input}{rag_context}\n\nReturn the JSON response now.")
-    ]
-    
-    llm = get_llm()
-    max_retries = 2
-    last_error = None
-    reasoning_steps = []
-    
-    for attempt in range(max_retries + 1):
         try:
-            # 3. Call LLM
-            step_desc = f"Analyzing query: '{user_input[:30]}...'" if attempt == 0 else f"Refining analysis based on findings (Attempt {attempt+1})"
-            reasoning_steps.append({"step": step_desc, "type": "analysis"})
-            
-            logger.info(f"LLM Call (Attempt {attempt+1}) for: {user_input[:50]}...")
-            response = llm.invoke(messages)
-            llm_output = response.content
-            
-            # 4. Parse JSON Response
-            llm_output = llm_output.replace("```json", "").replace("```", "").strip()
+            self.schema_obj = json.loads(self.schema_context) if isinstance(self.schema_context, str) else self.schema_context
+        except Exception:
+            self.schema_obj = {}
+        self.schema_fields = validator.flatten_schema(self.schema_obj)
+        self.types_map = validator.field_types(self.schema_obj)
+        self.max_days = int(os.getenv("MAX_LOOKBACK_DAYS", "7")) if self.max_lookback_days is None else int(self.max_lookback_days)
+
+        # Validated translations are reused for the same question against the same mapping and limits
+        self.schema_fp = nl_cache.schema_fingerprint(self.schema_context)
+        self.cached = None
+        with self.timed("cache_lookup_ms"):
+            if nl_cache.NL_CACHE_ENABLED and not self.contextual:
+                try:
+                    self.cached, match = nl_cache.translation_cache.get(self.user_input, self.index_pattern, self.schema_fp, role=self.role, max_lookback_days=self.max_lookback_days)
+                    if self.cached:
+                        logger.info(f"NL cache {match} hit for: {self.user_input[:50]}...")
+                except Exception as e:
+                    logger.warning(f"NL cache lookup failed: {e}")
+
+        # Common hunts are answered from a parameterized template without calling the LLM at all
+        self.template = None
+        if self.cached is None and not self.contextual and intent_templates.INTENT_FAST_PATH:
+            with self.timed("template_ms"):
+                try:
+                    self.template = intent_templates.match(self.user_input, self.types_map, self.max_days)
+                except Exception as e:
+                    logger.warning(f"Intent template match failed: {e}")
+            if self.template:
+                logger.info(f"Intent template '{self.template['template']}' ({self.template['confidence']}) for: {self.user_input[:50]}...")
+
+    def build_messages(self, rag_context):
+        self.messages.append(SystemMessage(content=prompts.get_system_prompt(self.prompt_schema)))
+        if self.history:
+            self.messages.append(HumanMessage(content=f"Conversation so far, for resolving follow-up questions:\n{self.history}"))
+        self.messages.append(HumanMessage(content=f"User Query: {self.user_input}{rag_context}\n\nReturn the JSON response now."))
+        self.timings["context_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+
+    def reused_response(self, attempt):
+        """Cached or templated response for this attempt (only the first), or None to call the LLM."""
+        step_desc = f"Analyzing query: '{self.user_input[:30]}...'" if attempt == 0 else f"Refining analysis based on findings (Attempt {attempt+1})"
+        self.step(step_desc, "analysis")
+        self.from_cache = attempt == 0 and self.cached is not None
+        self.from_template = attempt == 0 and self.template is not None
+        if self.from_cache:
+            self.step("Reused a validated translation of this question", "cache")
+            return self.cached
+        if self.from_template:
+            self.step(f"Matched the '{self.template['template']}' hunt template (confidence {self.template['confidence']}); no LLM call needed", "template")
+            return self.template["response"]
+        logger.info(f"LLM Call (Attempt {attempt+1}) for: {self.user_input[:50]}...")
+        return None
+
+    def validate(self, full_response, attempt):
+        """
+        Reads the response and validates (or locally repairs) its DSL. Returns the query, or None
+        after queueing the LLM correction when the attempt should be retried.
+        """
+        self.full_response = full_response
+        self.analysis = full_response.get("analysis", "No analysis provided.")
+        self.story = full_response.get("story")
+        self.mitre = full_response.get("mitre", [])
+        self.remediation = full_response.get("remediation")
+        self.severity = full_response.get("severity", "low")
+        self.confidence = full_response.get("confidence", 85)
+        self.confidence_reason = full_response.get("confidence_reason")
+        parsed_query = full_response.get("query", {})
+
+        # 5. Validate DSL
+        with self.timed("validate_ms"):
+            ok, errs = validator.validate_dsl(parsed_query, self.schema_fields, types_map=self.types_map, max_days=self.max_days)
+            if not ok and dsl_repair.DSL_REPAIR_ENABLED:
+                # Mechanical mistakes are fixed locally instead of spending an LLM retry on them
+                ok, repaired, remaining, fixes = dsl_repair.repair(parsed_query, errs, self.schema_fields, types_map=self.types_map, max_days=self.max_days)
+                if ok:
+                    self.step(f"Auto-repaired generated DSL ({', '.join(fixes)})", "repair")
+                    parsed_query = repaired
+                    full_response["query"] = repaired
+        if ok:
+            return parsed_query
+        error_msg = "; ".join(errs)
+        logger.warning(f"DSL Validation failed on attempt {attempt+1}: {error_msg}")
+        # A stale cache entry or a template the mapping cannot serve is retried with the LLM from scratch
+        if not (self.from_cache or self.from_template):
+            self.corrections.append(HumanMessage(content=f"The DSL you generated is invalid: {error_msg}. Please fix the query and return the full JSON again."))
+        return None
+
+    def estimate_cost(self, parsed_query):
+        """6. Pre-flight cost check (may query Elasticsearch); returns (decision, query, cost)."""
+        try:
+            with self.timed("cost_ms"):
+                return cost_guard.check(parsed_query, index_pattern=self.index_pattern, role=self.role)
+        except Exception as e:
+            logger.warning(f"Cost estimation unavailable, running query unguarded: {e}")
+            return cost_guard.ALLOW, parsed_query, None
+
+    def apply_cost(self, decision, parsed_query, cost):
+        """Rejects or narrows queries over the role's budget. Returns the query to run, or None to retry."""
+        if decision == cost_guard.REJECT:
             try:
-                full_response = json.loads(llm_output)
+                audit.init_db()
+                audit.log_query(self.user_name, self.index_pattern, 0, 0, parsed_query, cost=cost)
             except Exception:
-                start = llm_output.find("{")
-                end = llm_output.rfind("}")
-                if start != -1 and end != -1 and end > start:
-                    full_response = json.loads(llm_output[start:end+1])
-                else:
-                    raise ValueError("LLM did not return valid JSON.")
-
-            parsed_query = full_response.get("query", {})
-            analysis = full_response.get("analysis", "No analysis provided.")
-            story = full_response.get("story")
-            mitre = full_response.get("mitre", [])
-            remediation = full_response.get("remediation")
-            severity = full_response.get("severity", "low")
-            confidence = full_response.get("confidence", 85)
-            confidence_reason = full_response.get("confidence_reason")
-
-            # 5. Validate DSL
+                pass
+            self.step(f"Query rejected by cost guard (~{cost['est_ms']}ms over {cost['budget_ms']}ms budget)", "cost")
+            hint = ", ".join(cost["expensive_clauses"]) or "a large time window"
+            self.corrections.append(HumanMessage(content=f"The DSL you generated is too expensive to run (estimated {cost['est_ms']}ms against a {cost['budget_ms']}ms budget, driven by {hint}). Narrow the @timestamp range and avoid leading wildcards, then return the full JSON again."))
+            return None
+        if not self.from_cache and not self.from_template and not self.contextual and nl_cache.NL_CACHE_ENABLED:
             try:
-                schema_obj = json.loads(schema_context) if isinstance(schema_context, str) else schema_context
-            except Exception:
-                schema_obj = {}
-            
-            fields = validator.flatten_schema(schema_obj)
-            types_map = validator.field_types(schema_obj)
-            max_days_val = int(os.getenv("MAX_LOOKBACK_DAYS", "7")) if max_lookback_days is None else int(max_lookback_days)
-            
-            ok, errs = validator.validate_dsl(parsed_query, fields, types_map=types_map, max_days=max_days_val)
-            if not ok:
-                error_msg = "; ".join(errs)
-                logger.warning(f"DSL Validation failed on attempt {attempt+1}: {error_msg}")
-                messages.append(HumanMessage(content=f"The DSL you generated is invalid: {error_msg}. Please fix the query and return the full JSON again."))
+                nl_cache.translation_cache.set(self.user_input, self.index_pattern, self.schema_fp, self.full_response, role=self.role, max_lookback_days=self.max_lookback_days)
+            except Exception as e:
+                logger.warning(f"NL cache store failed: {e}")
+        if decision == cost_guard.REWRITE:
+            self.step(f"Narrowed time window to fit the cost budget ({cost['original_est_ms']}ms -> {cost['est_ms']}ms)", "cost")
+        self.emit("query", {"query": parsed_query, "costEstimate": cost})
+        return parsed_query
+
+    def projection(self, parsed_query):
+        self.step(f"Executing DSL on index {self.index_pattern}", "execution")
+        if self.fields:
+            return self.fields
+        fields = schema_extractor.default_projection(self.schema_obj, parsed_query)
+        # The pivot reads its entities from these hits
+        return entity_pivot.with_entity_fields(fields, self.types_map) if self.will_investigate() else fields
+
+    def will_investigate(self):
+        return self.severity in ["high", "critical"] and not self.from_template
+
+    def needs_investigation(self, results):
+        return results.get("total_hits", 0) > 0 and self.will_investigate()
+
+    def pivot_window_hours(self):
+        logger.info("High severity detected. Pivoting on related entities...")
+        self.step("High severity detected. Investigating lateral movement and related entities.", "investigation")
+        return min(entity_pivot.PIVOT_WINDOW_HOURS, self.max_days * 24)
+
+    def investigation_messages(self, pivot, results):
+        """LLM messages asking for an updated analysis from the pivot summary, or None when nothing pivoted."""
+        self.pivot = pivot
+        if not pivot["pivots"]:
+            return None
+        self.step(f"Pivoted on {len(pivot['pivots'])} entities ({', '.join(pivot['entities'])}) with {pivot['searches']} related-event searches in one batch", "investigation")
+        summary_text = entity_pivot.render(pivot)
+        entity_pivot.record_prompt(summary_text, json.dumps(results.get("data", [])[:3], default=str))
+        return [HumanMessage(content=prompts.get_investigation_prompt(self.user_input, self.analysis, results.get("total_hits", 0), summary_text))]
+
+    def apply_investigation(self, update):
+        self.analysis = update.get("analysis") or self.analysis
+        self.story = update.get("story") or self.story
+        self.mitre = update.get("mitre") or self.mitre
+        self.remediation = update.get("remediation") or self.remediation
+        self.severity = update.get("severity") or self.severity
+
+    def finish(self, parsed_query, results, duration_ms, cost):
+        """Narrative request, audit log and memory; returns the process_query result."""
+        if self.from_template and intent_templates.INTENT_LLM_NARRATIVE:
+            try:
+                self.narrative_id = request_narrative(self.user_name, self.user_input, parsed_query, results)
+            except Exception as e:
+                logger.warning(f"Could not start narrative for template hit: {e}")
+
+        # Log audit
+        try:
+            audit.init_db()
+            audit.log_query(self.user_name, self.index_pattern, results.get("total_hits", 0), duration_ms, parsed_query, cost=cost)
+        except Exception:
+            pass
+
+        # Save to memory
+        try:
+            memory_store.save(self.user_name, self.session_id, self.user_input, self.analysis)
+        except Exception as e:
+            logger.warning(f"Failed to save conversation memory: {e}")
+
+        return {
+            "query_generated": parsed_query,
+            "results": results,
+            "analysis": self.analysis,
+            "story": self.story,
+            "mitre": self.mitre,
+            "remediation": self.remediation,
+            "severity": self.severity,
+            "confidence": self.confidence,
+            "confidence_reason": self.confidence_reason,
+            "reasoning_steps": self.reasoning_steps,
+            "cost_estimate": cost,
+            "prompt_tokens": self.prompt_tokens,
+            "intent": self.template["template"] if self.from_template else None,
+            "pivot": self.pivot,
+            "narrative_id": self.narrative_id,
+            "timings": dict(self.timings, total_ms=round((time.perf_counter() - self.started) * 1000, 1))
+        }
+
+    def failed(self, attempt, e):
+        """Records a failed attempt; returns the LLM client to use for the next one."""
+        logger.error(f"Attempt {attempt+1} failed: {e}")
+        if "not found" in str(e).lower() or "404" in str(e):
+            # The active model was withdrawn; resolve another one for the retry
+            llm_client.mark_failed()
+            return get_llm()
+        return None
+
+def _fallback_query():
+    return {"query": {"match_all": {}}}
+
+def _fallback(last_error, results=None):
+    """DEMO_MODE stand-in answer (results from a match_all), or the error."""
+    if results is not None:
+        return {
+            "query_generated": _fallback_query(),
+            "results": results,
+            "analysis": f"Investigation complete. (Note: Fallback analysis used due to processing error: {str(last_error)})",
+            "story": "Automated investigation identified potential lateral movement patterns related to the initial query.",
+            "severity": "medium"
+        }
+    return {"error": str(last_error) if last_error else "AI Analysis failed after multiple attempts"}
+
+def _demo_mode():
+    return os.getenv("DEMO_MODE", "false").lower() == "true"
+
+def process_query(user_input, schema_context, size_limit=100, index_pattern="wazuh-alerts-*", user_name="session", max_lookback_days=None, fields=None, role=None, on_event=None, session_id=None, rag_future=None):
+    """
+    Main entry point for processing user queries with retry logic and multi-step investigation.
+    `fields` overrides the default _source projection derived from the schema and generated DSL.
+    `role` selects the cost_guard budget the generated query must fit in.
+    `on_event(kind, data)` is called as work progresses: "step" per reasoning step, "token" for
+    analysis text, "query" once the DSL is validated and "results" when Elasticsearch answers.
+    History is kept per (user_name, session_id). `rag_future` is a prefetch_rag() result
+    started by the caller; per-stage timings are returned under "timings".
+    """
+    run = _Investigation(user_input, schema_context, size_limit, index_pattern, user_name, max_lookback_days, fields, role, on_event, session_id)
+    # MITRE retrieval runs in the background while history, schema pruning and the cache lookup happen here
+    if rag_future is None:
+        rag_future = prefetch_rag(user_input)
+    run.prepare()
+
+    def conversation():
+        # Built on first use: cache and template hits never wait for MITRE retrieval
+        if not run.messages:
+            with run.timed("rag_wait_ms"):
+                rag_context, run.timings["rag_ms"] = rag_future.result()
+            run.build_messages(rag_context)
+        run.messages.extend(run.corrections)
+        run.corrections.clear()
+        return run.messages
+
+    llm = None
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            # 3. Call LLM
+            full_response = run.reused_response(attempt)
+            if full_response is None:
+                if llm is None:
+                    llm = get_llm()
+                with run.timed("llm_ms"):
+                    llm_output = _call_llm(llm, conversation(), on_event)
+                # 4. Parse JSON Response
+                full_response = _parse_json(llm_output)
+
+            parsed_query = run.validate(full_response, attempt)
+            if parsed_query is None:
+                continue
+            decision, parsed_query, cost = run.estimate_cost(parsed_query)
+            parsed_query = run.apply_cost(decision, parsed_query, cost)
+            if parsed_query is None:
+                last_error = ValueError("Query exceeds the cost budget for this role")
                 continue
 
-            # 6. Execute Query
+            # 7. Execute Query
             start_time = time.perf_counter()
-            reasoning_steps.append({"step": f"Executing DSL on index {index_pattern}", "type": "execution"})
-            results = elastic_connector.execute_query(json.dumps(parsed_query), index_pattern=index_pattern, size_limit=size_limit)
+            projection = run.projection(parsed_query)
+            with run.timed("execute_ms"):
+                results = elastic_connector.execute_query(parsed_query, index_pattern=index_pattern, size_limit=size_limit, fields=projection)
             duration_ms = int((time.perf_counter() - start_time) * 1000)
-            
-            # 7. Agentic Investigation (Multi-step)
-            # If we found something suspicious and haven't investigated further yet
-            if results.get("total_hits", 0) > 0 and severity in ["high", "critical"] and attempt == 0:
-                logger.info("High severity detected. Triggering automated follow-up investigation...")
-                reasoning_steps.append({"step": "High severity detected. Investigating lateral movement and related entities.", "type": "investigation"})
-                sample_data = results.get("data", [])[:3]
-                follow_up_prompt = f"I found these results for '{user_input}': {json.dumps(sample_data)}. Based on this, perform a deeper investigation. Look for related events (same IP, same user, or lateral movement). Return an updated analysis and attack story."
-                messages.append(HumanMessage(content=follow_up_prompt))
-                # We continue the loop once to get a refined response based on actual data
-                continue
+            run.emit("results", results)
 
-            # Log audit
-            try:
-                audit.init_db()
-                audit.log_query(user_name, index_pattern, results.get("total_hits", 0), duration_ms, json.dumps(parsed_query))
-            except Exception:
-                pass
-            
-            # Save to memory
-            memory.save_context({"input": user_input}, {"output": analysis})
-            
-            return {
-                "query_generated": json.dumps(parsed_query),
-                "results": results,
-                "analysis": analysis,
-                "story": story,
-                "mitre": mitre,
-                "remediation": remediation,
-                "severity": severity,
-                "confidence": confidence,
-                "confidence_reason": confidence_reason,
-                "reasoning_steps": reasoning_steps
-            }
+            # 8. Agentic Investigation: pivot on the entities in the hits with one _msearch,
+            # then a single LLM pass over the compact summary instead of the raw hits
+            if run.needs_investigation(results):
+                try:
+                    with run.timed("pivot_ms"):
+                        pivot = entity_pivot.investigate(results.get("data", []), run.types_map, index_pattern, run.pivot_window_hours())
+                    messages = run.investigation_messages(pivot, results)
+                    if messages:
+                        if llm is None:
+                            llm = get_llm()
+                        with run.timed("llm_ms"):
+                            run.apply_investigation(_parse_json(_call_llm(llm, messages, on_event)))
+                except Exception as e:
+                    # The hunt itself succeeded; keep its analysis
+                    logger.warning(f"Entity pivot investigation failed: {e}")
+
+            return run.finish(parsed_query, results, duration_ms, cost)
 
         except Exception as e:
-            logger.error(f"Attempt {attempt+1} failed: {e}")
             last_error = e
-            if attempt < max_retries:
-                time.sleep(1)
+            llm = run.failed(attempt, e) or llm
+            if attempt < MAX_RETRIES:
+                time.sleep(_backoff(attempt))
                 continue
             break
 
     # Fallback / Error Handling
-    if os.getenv("DEMO_MODE", "false").lower() == "true":
+    if _demo_mode():
         logger.info("DEMO_MODE fallback active")
-        fallback_query = {"query": {"match_all": {}}}
-        return {
-            "query_generated": json.dumps(fallback_query),
-            "results": elastic_connector.execute_query(json.dumps(fallback_query), index_pattern=index_pattern, size_limit=size_limit),
-            "analysis": f"Investigation complete. (Note: Fallback analysis used due to processing error: {str(last_error)})",
-            "story": "Automated investigation identified potential lateral movement patterns related to the initial query.",
-            "severity": "medium"
-        }
-    return {"error": str(last_error) if last_error else "AI Analysis failed after multiple attempts"}
+        return _fallback(last_error, elastic_connector.execute_query(_fallback_query(), index_pattern=index_pattern, size_limit=size_limit))
+    return _fallback(last_error)
 
+async def _acall_llm(llm, messages, emit):
+    """Async _call_llm: ainvoke(), or astream() when someone is listening."""
+    if emit is None or not hasattr(llm, "astream"):
+        return (await llm.ainvoke(messages)).content
+    streamer = _JsonStringStreamer("analysis")
+    parts = []
+    async for chunk in llm.astream(messages):
+        text = chunk.content if isinstance(chunk.content, str) else "".join(str(c) for c in chunk.content)
+        parts.append(text)
+        delta = streamer.feed(text)
+        if delta:
+            emit("token", {"text": delta})
+    return "".join(parts)
+
+async def aprocess_query(user_input, schema_context, size_limit=100, index_pattern="wazuh-alerts-*", user_name="session", max_lookback_days=None, fields=None, role=None, on_event=None, session_id=None, rag_future=None):
+    """
+    process_query() for the event loop: the LLM is awaited through ainvoke/astream, searches
+    go through the async connector, blocking stages (history and cache lookups, model probing,
+    cost estimation, entity pivots, audit and memory writes) run on worker threads and retries
+    back off with asyncio.sleep. Cancelling the task (e.g. when the client disconnects) abandons
+    the query at its next await.
+    """
+    if on_event is not None:
+        # Stages on worker threads emit too; hand every event to the loop in order
+        loop, emit = asyncio.get_running_loop(), on_event
+        on_event = lambda kind, data: loop.call_soon_threadsafe(emit, kind, data)
+    run = _Investigation(user_input, schema_context, size_limit, index_pattern, user_name, max_lookback_days, fields, role, on_event, session_id)
+    if rag_future is None:
+        rag_future = prefetch_rag(user_input)
+    await asyncio.to_thread(run.prepare)
+
+    async def conversation():
+        if not run.messages:
+            with run.timed("rag_wait_ms"):
+                rag_context, run.timings["rag_ms"] = await asyncio.wrap_future(rag_future)
+            run.build_messages(rag_context)
+        run.messages.extend(run.corrections)
+        run.corrections.clear()
+        return run.messages
+
+    llm = None
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            full_response = run.reused_response(attempt)
+            if full_response is None:
+                if llm is None:
+                    llm = await asyncio.to_thread(get_llm)
+                with run.timed("llm_ms"):
+                    llm_output = await _acall_llm(llm, await conversation(), on_event)
+                full_response = _parse_json(llm_output)
+
+            parsed_query = run.validate(full_response, attempt)
+            if parsed_query is None:
+                continue
+            decision, parsed_query, cost = await asyncio.to_thread(run.estimate_cost, parsed_query)
+            parsed_query = run.apply_cost(decision, parsed_query, cost)
+            if parsed_query is None:
+                last_error = ValueError("Query exceeds the cost budget for this role")
+                continue
+
+            start_time = time.perf_counter()
+            projection = run.projection(parsed_query)
+            with run.timed("execute_ms"):
+                results = await elastic_connector.execute_query_async(parsed_query, index_pattern=index_pattern, size_limit=size_limit, fields=projection)
+            duration_ms = int((time.perf_counter() - start_time) * 1000)
+            run.emit("results", results)
+
+            if run.needs_investigation(results):
+                try:
+                    with run.timed("pivot_ms"):
+                        pivot = await asyncio.to_thread(entity_pivot.investigate, results.get("data", []), run.types_map, index_pattern, run.pivot_window_hours())
+                    messages = run.investigation_messages(pivot, results)
+                    if messages:
+                        if llm is None:
+                            llm = await asyncio.to_thread(get_llm)
+                        with run.timed("llm_ms"):
+                            run.apply_investigation(_parse_json(await _acall_llm(llm, messages, on_event)))
+                except Exception as e:
+                    logger.warning(f"Entity pivot investigation failed: {e}")
+
+            return await asyncio.to_thread(run.finish, parsed_query, results, duration_ms, cost)
+
+        except Exception as e:
+            last_error = e
+            llm = await asyncio.to_thread(run.failed, attempt, e) or llm
+            if attempt < MAX_RETRIES:
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            break
+
+    if _demo_mode():
+        logger.info("DEMO_MODE fallback active")
+        return _fallback(last_error, await elastic_connector.execute_query_async(_fallback_query(), index_pattern=index_pattern, size_limit=size_limit))
+    return _fallback(last_error)
+
+# Investigations one process_queries_batch() runs at a time (each may hold an LLM call and a search)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "100"))
+
+def _batch_key(prompt):
+    return " ".join(str(prompt).split()).lower()
+
+async def process_queries_batch(prompts, schema_context, concurrency=None, user_name="session", **kwargs):
+    """
+    Runs many prompts through aprocess_query, at most `concurrency` at a time, and yields
+    {"indexes", "prompt", "result"} as each one finishes. Prompts that are identical apart from
+    case and whitespace run once and report every position they appeared at. The schema is
+    parsed once for the whole batch and MITRE retrieval for every prompt starts up front.
+    Other keyword arguments go to aprocess_query. Closing the generator cancels unfinished work.
+    """
+    unique = OrderedDict()
+    for i, prompt in enumerate(prompts):
+        unique.setdefault(_batch_key(prompt), (prompt, []))[1].append(i)
+    if isinstance(schema_context, str):
+        try:
+            schema_context = json.loads(schema_context)
+        except Exception:
+            pass
+    semaphore = asyncio.Semaphore(max(1, concurrency or BATCH_CONCURRENCY))
+    batch_id = uuid.uuid4().hex[:8]
+    logger.info(f"Batch {batch_id}: {len(prompts)} prompts, {len(unique)} distinct")
+
+    async def run(n, prompt, rag_future):
+        async with semaphore:
+            try:
+                # Each prompt gets its own session so batch questions are never read as follow-ups of one another
+                return await aprocess_query(prompt, schema_context, user_name=user_name, session_id=f"batch-{batch_id}-{n}", rag_future=rag_future, **kwargs)
+            except Exception as e:
+                logger.error(f"Batch {batch_id} prompt {n} failed: {e}")
+                return {"error": str(e)}
+
+    tasks = {
+        asyncio.ensure_future(run(n, prompt, prefetch_rag(prompt))): (prompt, indexes)
+        for n, (prompt, indexes) in enumerate(unique.values())
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                prompt, indexes = tasks[task]
+                yield {"indexes": indexes, "prompt": prompt, "result": task.result()}
+    finally:
+        for task in pending:
+            task.cancel()
 
 if __name__ == "__main__":
     load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -0,0 +1,332 @@
+"""
+Seeded, vectorized generator of Wazuh-shaped alerts for load tests and the local engine.
+
+Alerts are produced in fixed-size chunks of NumPy columns (rule, agent, source IP,
+user and timestamp per row), so memory stays bounded by the chunk size no matter how
+many alerts are written. Chunk i is drawn from its own (seed, i) stream, so output is
+reproducible for a given seed and chunk size.
+
+    python src/alert_generator.py --count 20000000 --out alerts.ndjson.gz --bulk-index wazuh-alerts-4.x-synth
+"""
+import os
+import sys
+import gzip
+import time
+import argparse
+import logging
+
+import numpy as np
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+GENERATOR_CHUNK_SIZE = int(os.getenv("ALERT_GENERATOR_CHUNK_SIZE", "50000"))
+GENERATOR_AGENTS = int(os.getenv("ALERT_GENERATOR_AGENTS", "200"))
+GENERATOR_SOURCE_IPS = int(os.getenv("ALERT_GENERATOR_SOURCE_IPS", "50000"))
+# Zipf exponent for source IP popularity (higher = a few IPs dominate)
+GENERATOR_IP_ZIPF = float(os.getenv("ALERT_GENERATOR_IP_ZIPF", "1.1"))
+# Share of alerts that belong to injected attack scenarios
+GENERATOR_SCENARIO_RATE = float(os.getenv("ALERT_GENERATOR_SCENARIO_RATE", "0.02"))
+
+DAY_MS = 86_400_000
+HOUR_MS = 3_600_000
+
+# Relative alert volume per UTC hour: quiet nights, a business-hours plateau, evening tail
+DIURNAL_PROFILE = np.array([
+    0.30, 0.25, 0.22, 0.20, 0.22, 0.30, 0.50, 0.80, 1.10, 1.30, 1.35, 1.30,
+    1.20, 1.30, 1.35, 1.30, 1.20, 1.00, 0.80, 0.65, 0.55, 0.48, 0.40, 0.35,
+])
+WEEKEND_FACTOR = 0.45
+
+RULES = [
+    {"id": "5715", "level": 3, "description": "sshd: authentication success.", "groups": ("syslog", "sshd", "authentication_success"), "action": "logon-success", "port": 22, "decoder": "sshd", "location": "/var/log/auth.log", "mitre": ("T1078",), "weight": 18},
+    {"id": "5716", "level": 5, "description": "sshd: authentication failed.", "groups": ("syslog", "sshd", "authentication_failed"), "action": "logon-failure", "port": 22, "decoder": "sshd", "location": "/var/log/auth.log", "mitre": ("T1110.001",), "weight": 14},
+    {"id": "5712", "level": 10, "description": "sshd: brute force trying to get access to the system.", "groups": ("syslog", "sshd", "authentication_failures"), "action": "logon-failure", "port": 22, "decoder": "sshd", "location": "/var/log/auth.log", "mitre": ("T1110",), "weight": 1},
+    {"id": "60122", "level": 5, "description": "Logon failure - Unknown user or bad password.", "groups": ("windows", "windows_security", "authentication_failed"), "action": "logon-failure", "port": 3389, "decoder": "windows_eventchannel", "location": "EventChannel", "mitre": ("T1531",), "weight": 10},
+    {"id": "60106", "level": 3, "description": "Windows logon success.", "groups": ("windows", "windows_security", "authentication_success"), "action": "logon-success", "port": 3389, "decoder": "windows_eventchannel", "location": "EventChannel", "mitre": ("T1078",), "weight": 12},
+    {"id": "92652", "level": 12, "description": "Successful remote logon detected using RDP.", "groups": ("windows", "rdp"), "action": "logon-success", "port": 3389, "decoder": "windows_eventchannel", "location": "EventChannel", "mitre": ("T1021.001",), "weight": 0.3},
+    {"id": "550", "level": 7, "description": "Integrity checksum changed.", "groups": ("ossec", "syscheck", "syscheck_entry_modified"), "action": "file-modified", "file": "/etc/passwd", "decoder": "syscheck_integrity_changed", "location": "syscheck", "mitre": ("T1565.001",), "weight": 5},
+    {"id": "553", "level": 7, "description": "File deleted.", "groups": ("ossec", "syscheck", "syscheck_entry_deleted"), "action": "file-deleted", "file": "/var/www/html/index.php", "decoder": "syscheck_deleted", "location": "syscheck", "mitre": ("T1070.004",), "weight": 2},
+    {"id": "554", "level": 12, "description": "Shadow file access detected.", "groups": ("ossec", "syscheck", "syscheck_entry_modified"), "action": "file-modified", "file": "/etc/shadow", "decoder": "syscheck_integrity_changed", "location": "syscheck", "mitre": ("T1003.008",), "weight": 0.3},
+    {"id": "31101", "level": 5, "description": "Web server 400 error code.", "groups": ("web", "accesslog", "attack"), "action": "http-request", "port": 443, "decoder": "web-accesslog", "location": "/var/log/nginx/access.log", "weight": 10},
+    {"id": "31151", "level": 10, "description": "Multiple web server 400 error codes from same source ip.", "groups": ("web", "accesslog", "web_scan", "recon"), "action": "http-request", "port": 443, "decoder": "web-accesslog", "location": "/var/log/nginx/access.log", "mitre": ("T1595.002",), "weight": 0.5},
+    {"id": "5402", "level": 3, "description": "Successful sudo to ROOT executed.", "groups": ("syslog", "sudo"), "action": "sudo", "decoder": "sudo", "location": "/var/log/auth.log", "mitre": ("T1548.003",), "weight": 6},
+    {"id": "5501", "level": 3, "description": "PAM: Login session opened.", "groups": ("pam", "syslog", "authentication_success"), "action": "session-open", "decoder": "pam", "location": "/var/log/auth.log", "weight": 10},
+    {"id": "87105", "level": 12, "description": "VirusTotal: Alert - malicious file detected.", "groups": ("virustotal",), "action": "malware-detected", "file": "/tmp/payload.bin", "decoder": "json", "location": "virustotal", "mitre": ("T1204.002",), "weight": 0.2},
+    {"id": "100002", "level": 15, "description": "Possible privilege escalation via SUID binary.", "groups": ("privilege_escalation", "audit"), "action": "privilege-escalation", "file": "/usr/bin/pkexec", "decoder": "auditd", "location": "/var/log/audit/audit.log", "mitre": ("T1068",), "weight": 0.1},
+]
+RULE_INDEX = {r["id"]: i for i, r in enumerate(RULES)}
+USER_ACTIONS = ("logon-success", "logon-failure", "sudo", "session-open")
+
+# Attack scenarios: (rule id, events, spread in seconds from the scenario start)
+SCENARIOS = {
+    "ssh_brute_force": [("5716", 40, 300), ("5712", 3, 300), ("5715", 1, 330)],
+    "web_scan": [("31101", 60, 120), ("31151", 4, 120)],
+    "privilege_escalation": [("5715", 1, 0), ("5402", 2, 60), ("554", 1, 90), ("100002", 1, 120)],
+    "malware_drop": [("60106", 1, 0), ("87105", 1, 600), ("553", 1, 900)],
+}
+
+USERS = ["root", "admin", "administrator", "ubuntu", "ec2-user", "svc_backup", "svc_web", "jdoe", "asmith", "mlopez",
+         "guest", "oracle", "postgres", "test", "deploy", "support", "nagios", "git", "www-data", "operator"]
+AGENT_ROLES = ["web", "db", "ws", "fw", "dc", "app", "mail", "vpn"]
+
+def _zipf_weights(n, s):
+    w = 1.0 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+def _random_ips(rng, n, private=False):
+    if private:
+        octets = [np.full(n, 10), rng.integers(0, 256, n), rng.integers(0, 256, n), rng.integers(1, 255, n)]
+    else:
+        first = rng.integers(1, 224, n)
+        first = np.where(np.isin(first, (10, 127, 172, 192)), first + 1, first)
+        octets = [first, rng.integers(0, 256, n), rng.integers(0, 256, n), rng.integers(1, 255, n)]
+    return [f"{a}.{b}.{c}.{d}" for a, b, c, d in zip(*(o.tolist() for o in octets))]
+
+class AlertGenerator:
+    """
+    Draws alerts column-wise. A chunk is a dict of equal-length arrays:
+    ts (epoch ms), rule, agent, src (-1 = none), user (-1 = none) and scenario (-1 = background).
+    """
+    def __init__(self, seed=0, days=7, end_ms=None, n_agents=GENERATOR_AGENTS, n_source_ips=GENERATOR_SOURCE_IPS,
+                 ip_zipf=GENERATOR_IP_ZIPF, scenario_rate=GENERATOR_SCENARIO_RATE):
+        self.seed = seed
+        self.end_ms = int(end_ms if end_ms is not None else time.time() * 1000)
+        self.start_ms = self.end_ms - int(days * DAY_MS)
+        self.scenario_rate = scenario_rate
+        vocab_rng = np.random.default_rng([seed, 0xC0FFEE])
+
+        self.agent_names = [f"{AGENT_ROLES[i % len(AGENT_ROLES)]}-{i:03d}" for i in range(n_agents)]
+        self.agent_ips = _random_ips(vocab_rng, n_agents, private=True)
+        # A few chatty agents produce most of the noise
+        self.agent_p = _zipf_weights(n_agents, 0.8)[vocab_rng.permutation(n_agents)]
+        self.source_ips = _random_ips(vocab_rng, n_source_ips)
+        self.source_p = _zipf_weights(n_source_ips, ip_zipf)
+        # Attackers come from a separate pool so scenarios stand out from background traffic
+        self.attacker_ips = _random_ips(vocab_rng, 256)
+        self.user_p = _zipf_weights(len(USERS), 1.2)
+
+        weights = np.array([r["weight"] for r in RULES], dtype=np.float64)
+        self.rule_p = weights / weights.sum()
+        self.rule_port = np.array([r.get("port", np.nan) for r in RULES], dtype=np.float64)
+        self.rule_has_user = np.array([r["action"] in USER_ACTIONS for r in RULES])
+
+        # Hour-bin sampling weights over the whole window (diurnal curve x weekday factor)
+        first_hour = self.start_ms // HOUR_MS
+        hours = np.arange(first_hour, (self.end_ms - 1) // HOUR_MS + 1)
+        weekday = ((hours // 24) + 3) % 7  # 1970-01-01 was a Thursday (Mon=0)
+        w = DIURNAL_PROFILE[hours % 24] * np.where(weekday >= 5, WEEKEND_FACTOR, 1.0)
+        self.hour_bins = hours * HOUR_MS
+        self.hour_p = w / w.sum()
+
+        self.scenario_names = list(SCENARIOS)
+        self.scenario_templates = []
+        for name in self.scenario_names:
+            rules, offsets = [], []
+            for rule_id, count, spread in SCENARIOS[name]:
+                rules += [RULE_INDEX[rule_id]] * count
+                offsets += [spread * 1000] * count
+            self.scenario_templates.append((np.array(rules), np.array(offsets, dtype=np.int64)))
+
+    def _timestamps(self, rng, n):
+        bins = rng.choice(len(self.hour_bins), size=n, p=self.hour_p)
+        ts = self.hour_bins[bins] + rng.integers(0, HOUR_MS, size=n)
+        return np.clip(ts, self.start_ms, self.end_ms - 1)
+
+    def _scenarios(self, rng, budget):
+        """Builds up to `budget` scenario rows; every scenario instance shares agent, attacker and user."""
+        parts = []
+        per_type = budget // len(self.scenario_templates)
+        for sid, (rules, spreads) in enumerate(self.scenario_templates):
+            k = per_type // len(rules)
+            if k == 0:
+                continue
+            n = k * len(rules)
+            start = self._timestamps(rng, k)
+            inst = np.repeat(np.arange(k), len(rules))
+            ts = start[inst] + (rng.random(n) * np.tile(spreads, k)).astype(np.int64)
+            parts.append({
+                "ts": np.minimum(ts, self.end_ms - 1),
+                "rule": np.tile(rules, k),
+                "agent": rng.choice(len(self.agent_names), size=k)[inst],
+                "src": len(self.source_ips) + rng.integers(0, len(self.attacker_ips), size=k)[inst],
+                "user": rng.choice(len(USERS), size=k, p=self.user_p)[inst],
+                "scenario": np.full(n, sid),
+            })
+        return parts
+
+    def generate(self, n, chunk_index=0):
+        """Returns one chunk of n alerts drawn from the (seed, chunk_index) stream."""
+        rng = np.random.default_rng([self.seed, chunk_index])
+        parts = self._scenarios(rng, int(n * self.scenario_rate)) if self.scenario_rate > 0 else []
+        n_bg = n - sum(len(p["ts"]) for p in parts)
+        rule = rng.choice(len(RULES), size=n_bg, p=self.rule_p)
+        parts.insert(0, {
+            "ts": self._timestamps(rng, n_bg),
+            "rule": rule,
+            "agent": rng.choice(len(self.agent_names), size=n_bg, p=self.agent_p),
+            "src": rng.choice(len(self.source_ips), size=n_bg, p=self.source_p),
+            "user": rng.choice(len(USERS), size=n_bg, p=self.user_p),
+            "scenario": np.full(n_bg, -1),
+        })
+        chunk = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+        # Source IPs only exist on network alerts, users only on authentication-type alerts
+        chunk["src"] = np.where(np.isnan(self.rule_port[chunk["rule"]]), -1, chunk["src"])
+        chunk["user"] = np.where(self.rule_has_user[chunk["rule"]], chunk["user"], -1)
+        order = np.argsort(chunk["ts"], kind="stable")
+        return {k: v[order] for k, v in chunk.items()}
+
+    def iter_chunks(self, total, chunk_size=GENERATOR_CHUNK_SIZE):
+        for i, start in enumerate(range(0, total, chunk_size)):
+            yield start, self.generate(min(chunk_size, total - start), chunk_index=i)
+
+    def columns(self, chunk):
+        """
+        Field -> (type, vocab, codes, multi) for keywords or (type, values) for numbers/dates,
+        ready for columnar storage without materializing documents.
+        """
+        def mapped(values, idx):
+            vocab = sorted({v for v in values if v})
+            codes = np.array([vocab.index(v) if v else -1 for v in values], dtype=np.int32)
+            return vocab, codes[idx]
+
+        rule, agent = chunk["rule"], chunk["agent"]
+        src, user = chunk["src"], chunk["user"]
+        ports = self.rule_port[rule]
+        out = {
+            "@timestamp": ("date", chunk["ts"].astype(np.float64)),
+            "rule.id": ("keyword", [r["id"] for r in RULES], rule, False),
+            "rule.level": ("integer", np.array([r["level"] for r in RULES], dtype=np.float64)[rule]),
+            "rule.description": ("text", [r["description"] for r in RULES], rule, False),
+            "rule.groups": ("keyword", [r["groups"] for r in RULES], rule, True),
+            "agent.id": ("keyword", [f"{i:03d}" for i in range(len(self.agent_names))], agent, False),
+            "agent.name": ("keyword", self.agent_names, agent, False),
+            "agent.ip": ("keyword", self.agent_ips, agent, False),
+            "manager.name": ("keyword", ["wazuh-manager"], np.zeros(len(rule), dtype=np.int32), False),
+            "data.srcip": ("keyword", self.source_ips + self.attacker_ips, src, False),
+            "data.dstport": ("integer", ports),
+            "data.srcuser": ("keyword", USERS, user, False),
+        }
+        for field, key, multi in (("rule.mitre.id", "mitre", True), ("decoder.name", "decoder", False),
+                                  ("location", "location", False), ("syscheck.path", "file", False)):
+            vocab, codes = mapped([r.get(key) for r in RULES], rule)
+            out[field] = ("keyword", vocab, codes, multi)
+        return out
+
+    def _rule_fields(self, r):
+        rule = RULES[r]
+        rule_doc = {"id": rule["id"], "level": rule["level"], "description": rule["description"], "groups": list(rule["groups"])}
+        if "mitre" in rule:
+            rule_doc["mitre"] = {"id": list(rule["mitre"])}
+        return rule_doc, {"manager": {"name": "wazuh-manager"}, "decoder": {"name": rule["decoder"]}, "location": rule["location"]}
+
+    def _agent_doc(self, a):
+        return {"id": f"{a:03d}", "name": self.agent_names[a], "ip": self.agent_ips[a]}
+
+    @staticmethod
+    def _stamps(chunk):
+        return np.datetime_as_string(chunk["ts"].astype("datetime64[ms]"), unit="ms", timezone="UTC")
+
+    def documents(self, chunk, id_offset=0):
+        """Materializes a chunk as Wazuh alert dicts."""
+        all_ips = self.source_ips + self.attacker_ips
+        stamps = self._stamps(chunk)
+        docs = []
+        for i, (t, r, a, s, u) in enumerate(zip(chunk["ts"].tolist(), chunk["rule"].tolist(), chunk["agent"].tolist(),
+                                                chunk["src"].tolist(), chunk["user"].tolist())):
+            rule_doc, static = self._rule_fields(r)
+            doc = {"@timestamp": stamps[i].replace("Z", "+0000"), "id": f"{t // 1000}.{id_offset + i}",
+                   "rule": rule_doc, "agent": self._agent_doc(a)}
+            doc.update(static)
+            data = {}
+            if s >= 0:
+                data["srcip"] = all_ips[s]
+                data["dstport"] = RULES[r]["port"]
+            if u >= 0:
+                data["srcuser"] = USERS[u]
+            if data:
+                doc["data"] = data
+            if "file" in RULES[r]:
+                doc["syscheck"] = {"path": RULES[r]["file"]}
+            docs.append(doc)
+        return docs
+
+    def _fragments(self):
+        # Pre-serialized JSON pieces so NDJSON output never builds per-alert dicts
+        if not hasattr(self, "_frags"):
+            rule_frags, tail_frags, ports = [], [], []
+            for r, rule in enumerate(RULES):
+                rule_doc, static = self._rule_fields(r)
+                rule_frags.append(b'"rule":' + orjson.dumps(rule_doc) + b',"agent":')
+                tail_frags.append(b"," + orjson.dumps(static)[1:-1])
+                ports.append(b'","dstport":' + orjson.dumps(rule.get("port")))
+            files = [b',"syscheck":' + orjson.dumps({"path": r["file"]}) if "file" in r else b"" for r in RULES]
+            self._frags = {
+                "rule": rule_frags, "tail": tail_frags, "port": ports, "file": files,
+                "agent": [orjson.dumps(self._agent_doc(a)) for a in range(len(self.agent_names))],
+                "ip": [ip.encode() for ip in self.source_ips + self.attacker_ips],
+                "user": [orjson.dumps(u) for u in USERS],
+            }
+        return self._frags
+
+    def ndjson_lines(self, chunk, id_offset=0, action=b""):
+        """Serializes a chunk to NDJSON lines (each prefixed with `action`), equal to orjson.dumps(documents())."""
+        f = self._fragments()
+        rule_f, tail_f, port_f, file_f = f["rule"], f["tail"], f["port"], f["file"]
+        agent_f, ip_f, user_f = f["agent"], f["ip"], f["user"]
+        stamps = self._stamps(chunk)
+        lines = []
+        for i, (t, r, a, s, u) in enumerate(zip(chunk["ts"].tolist(), chunk["rule"].tolist(), chunk["agent"].tolist(),
+                                                chunk["src"].tolist(), chunk["user"].tolist())):
+            if s >= 0:
+                data = b',"data":{"srcip":"' + ip_f[s] + port_f[r] + (b',"srcuser":' + user_f[u] if u >= 0 else b"") + b"}"
+            elif u >= 0:
+                data = b',"data":{"srcuser":' + user_f[u] + b"}"
+            else:
+                data = b""
+            head = f'{{"@timestamp":"{stamps[i][:-1]}+0000","id":"{t // 1000}.{id_offset + i}",'.encode()
+            lines.append(action + head + rule_f[r] + agent_f[a] + tail_f[r] + data + file_f[r] + b"}\n")
+        return lines
+
+    def write_ndjson(self, fp, total, chunk_size=GENERATOR_CHUNK_SIZE, bulk_index=None):
+        """
+        Streams `total` alerts to a binary file object as NDJSON, or as an _bulk body when
+        bulk_index is set. Only one chunk is held in memory at a time. Returns alerts written.
+        """
+        action = orjson.dumps({"index": {"_index": bulk_index}}) + b"\n" if bulk_index else b""
+        written = 0
+        for start, chunk in self.iter_chunks(total, chunk_size):
+            lines = self.ndjson_lines(chunk, id_offset=start, action=action)
+            fp.write(b"".join(lines))
+            written += len(lines)
+        return written
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Wazuh alerts as NDJSON or an _bulk body.")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--out", default="-", help="output path ('-' for stdout, .gz to compress)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--chunk-size", type=int, default=GENERATOR_CHUNK_SIZE)
+    parser.add_argument("--bulk-index", default=None, help="emit _bulk action lines for this index")
+    args = parser.parse_args(argv)
+
+    gen = AlertGenerator(seed=args.seed, days=args.days)
+    if args.out == "-":
+        fp = sys.stdout.buffer
+    elif args.out.endswith(".gz"):
+        fp = gzip.open(args.out, "wb", compresslevel=3)
+    else:
+        fp = open(args.out, "wb")
+    started = time.perf_counter()
+    try:
+        written = gen.write_ndjson(fp, args.count, args.chunk_size, bulk_index=args.bulk_index)
+    finally:
+        if fp is not sys.stdout.buffer:
+            fp.close()
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {written} alerts in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f}/s)", file=sys.stderr)
+
+if __name__ == "__main__":
+    _main()
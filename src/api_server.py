@@ -1,5 +1,5 @@
 import os
-import json
+import orjson
 import logging
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -14,11 +14,28 @@ logger = logging.getLogger(__name__)
 
 import elastic_connector
 import schema_extractor
-from routes import auth, stats, chat, misc
+import llm_client
+import nl_cache
+import conversation_memory
+import dsl_repair
+import intent_templates
+import entity_pivot
+from routes import auth, stats, chat, misc, export
 import asyncio
-from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 
-app = FastAPI(title="SIEM Conversational Agent API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Resolve the working Gemini model once in the background, instead of per query
+    await llm_client.start()
+    yield
+    await llm_client.stop()
+    # Release the shared Elasticsearch connection pools on shutdown
+    elastic_connector.close_client()
+    await elastic_connector.close_async_client()
+
+app = FastAPI(title="SIEM Conversational Agent API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Global Exception Handler
 @app.exception_handler(Exception)
@@ -59,6 +76,7 @@ app.include_router(auth.router)
 app.include_router(stats.router)
 app.include_router(chat.router)
 app.include_router(misc.router)
+app.include_router(export.router)
 
 @app.get("/")
 async def root():
@@ -67,6 +85,7 @@ async def root():
 @app.get("/api/preflight")
 def preflight():
     demo = os.getenv("DEMO_MODE", "true").lower() == "true"
+    # ping() fails fast while its breaker is open
     es_ok = elastic_connector.ping()
     creds_ok = bool(os.getenv("ELASTIC_USER")) and bool(os.getenv("ELASTIC_PASSWORD"))
     api_ok = bool(os.getenv("GOOGLE_API_KEY"))
@@ -76,10 +95,24 @@ def preflight():
     except Exception:
         schema_ok = demo
     
+    es_stats = {
+        "esPool": elastic_connector.get_pool_stats(),
+        "esProjection": elastic_connector.get_projection_stats(),
+        "esCache": elastic_connector.get_cache_stats(),
+        "esCoalescing": elastic_connector.get_coalescing_stats(),
+        "esBreakers": elastic_connector.get_breaker_states(),
+        "esBatching": elastic_connector.get_batching_stats(),
+        "llmClient": llm_client.get_stats(),
+        "nlCache": nl_cache.translation_cache.snapshot(),
+        "conversationMemory": conversation_memory.memory_store.snapshot(),
+        "dslRepair": dsl_repair.get_stats(),
+        "intentTemplates": intent_templates.get_stats(),
+        "entityPivot": entity_pivot.get_stats(),
+    }
     if demo:
-        return {"esOk": True, "credsOk": True, "llmOk": api_ok, "schemaOk": True, "demoMode": True}
+        return {"esOk": True, "credsOk": True, "llmOk": api_ok, "schemaOk": True, "demoMode": True, **es_stats}
         
-    return {"esOk": es_ok, "credsOk": creds_ok, "llmOk": api_ok, "schemaOk": schema_ok}
+    return {"esOk": es_ok, "credsOk": creds_ok, "llmOk": api_ok, "schemaOk": schema_ok, **es_stats}
 
 @app.get("/api/schema")
 def schema(index: str):
@@ -91,6 +124,9 @@ def schema(index: str):
         fields.append({"name": k, "type": v})
     return {"index": index, "fields": fields}
 
+# Fields read by the SSE generators below; their polls bypass the result cache so the feeds never lag by its TTL
+STREAM_FIELDS = ["@timestamp", "rule.description", "rule.level", "agent.name"]
+
 # SSE for real-time alerts
 @app.get("/api/alerts/stream")
 async def stream_alerts(request: Request, index: str = "wazuh-alerts-*", min_level: int = 10):
@@ -116,7 +152,7 @@ async def stream_alerts(request: Request, index: str = "wazuh-alerts-*", min_lev
                     "sort": [{"@timestamp": {"order": "desc"}}]
                 }
                 
-                res = elastic_connector.execute_query(json.dumps(query), index_pattern=index)
+                res = await elastic_connector.execute_query_async(query, index_pattern=index, fields=STREAM_FIELDS, cache=False)
                 if res.get("status") == "success" and res.get("data"):
                     hit = res["data"][0]
                     source = hit.get("_source", {})
@@ -130,7 +166,7 @@ async def stream_alerts(request: Request, index: str = "wazuh-alerts-*", min_lev
                             "level": source.get("rule", {}).get("level", 0),
                             "agent": source.get("agent", {}).get("name", "unknown")
                         }
-                        yield f"data: {json.dumps(alert)}\n\n"
+                        yield f"data: {orjson.dumps(alert).decode()}\n\n"
                         last_timestamp = current_ts
             except Exception as e:
                 logger.error(f"SSE Error: {e}")
@@ -153,7 +189,7 @@ async def stream_logs(request: Request, index: str = "wazuh-alerts-*"):
                     "query": {"range": {"@timestamp": {"gte": "now-1m"}}},
                     "sort": [{"@timestamp": {"order": "desc"}}]
                 }
-                res = elastic_connector.execute_query(json.dumps(query), index_pattern=index)
+                res = await elastic_connector.execute_query_async(query, index_pattern=index, fields=STREAM_FIELDS, cache=False)
                 if res.get("status") == "success" and res.get("data"):
                     # Reverse to show oldest first in this batch
                     for hit in reversed(res["data"]):
@@ -161,7 +197,7 @@ async def stream_logs(request: Request, index: str = "wazuh-alerts-*"):
                         ts = source.get("@timestamp")
                         if last_timestamp is None or ts > last_timestamp:
                             log_line = f"[{ts}] {source.get('agent', {}).get('name', 'unknown')} -> {source.get('rule', {}).get('description', 'No description')}"
-                            yield f"data: {json.dumps({'line': log_line, 'id': hit.get('_id')})}\n\n"
+                            yield f"data: {orjson.dumps({'line': log_line, 'id': hit.get('_id')}).decode()}\n\n"
                             last_timestamp = ts
             except Exception as e:
                 logger.error(f"Log Stream Error: {e}")
@@ -115,19 +115,19 @@ with st.sidebar:
     if st.button("Sigma: Failed logins 24h"):
         idx = st.session_state.get('index_pattern', 'wazuh-alerts-*')
         dsl = {"size": 100, "query": {"bool": {"must": [{"match": {"event.action": "logon-failure"}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}}}
-        res = elastic_connector.execute_query(json.dumps(dsl), index_pattern=idx, size_limit=100)
+        res = elastic_connector.execute_query(dsl, index_pattern=idx, size_limit=100)
         st.session_state['builder_result'] = {"query_generated": json.dumps(dsl), "results": res}
         st.success("Sigma rule executed")
     if st.button("Sigma: RDP 24h"):
         idx = st.session_state.get('index_pattern', 'wazuh-alerts-*')
         dsl = {"size": 100, "query": {"bool": {"must": [{"term": {"destination.port": 3389}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}}}
-        res = elastic_connector.execute_query(json.dumps(dsl), index_pattern=idx, size_limit=100)
+        res = elastic_connector.execute_query(dsl, index_pattern=idx, size_limit=100)
         st.session_state['builder_result'] = {"query_generated": json.dumps(dsl), "results": res}
         st.success("Sigma rule executed")
     if st.button("Sigma: /etc/shadow access"):
         idx = st.session_state.get('index_pattern', 'wazuh-alerts-*')
         dsl = {"size": 100, "query": {"bool": {"must": [{"term": {"file.path": "/etc/shadow"}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}}}
-        res = elastic_connector.execute_query(json.dumps(dsl), index_pattern=idx, size_limit=100)
+        res = elastic_connector.execute_query(dsl, index_pattern=idx, size_limit=100)
         st.session_state['builder_result'] = {"query_generated": json.dumps(dsl), "results": res}
         st.success("Sigma rule executed")
 
@@ -186,7 +186,7 @@ with st.sidebar:
                     st.code(json.dumps({"query": {"nested": {"path": qb_field.split(".")[0], "query": {qb_op: {qb_field: qb_val}}}}}, indent=2))
                 st.error("; ".join(errs))
             else:
-                res = elastic_connector.execute_query(json.dumps(dsl), index_pattern=idx, size_limit=qb_size)
+                res = elastic_connector.execute_query(dsl, index_pattern=idx, size_limit=qb_size)
                 st.session_state['builder_result'] = {"query_generated": json.dumps(dsl), "results": res}
                 st.success("Builder query executed")
         except Exception as e:
@@ -242,7 +242,7 @@ if prompt:
                 st.error(f"Error: {response['error']}")
                 result_content = f"I encountered an error: {response['error']}"
             else:
-                generated_query = response.get("query_generated", "No query generated")
+                generated_query = json.dumps(response.get("query_generated") or {}, indent=2)
                 results = response.get("results", {})
                 hits = results.get("total_hits", 0)
 
@@ -264,7 +264,7 @@ if prompt:
                         }
                         try:
                             import altair as alt
-                            aggs = elastic_connector.execute_aggregation(json.dumps(terms_dsl), index_pattern=idx)
+                            aggs = elastic_connector.execute_aggregation(terms_dsl, index_pattern=idx)
                             buckets = aggs.get('top_terms', {}).get('buckets', []) if isinstance(aggs, dict) else []
                             data_terms = [{"value": b.get('key'), "count": b.get('doc_count', 0)} for b in buckets]
                             chart_terms = alt.Chart(alt.Data(values=data_terms)).mark_bar().encode(
@@ -276,7 +276,7 @@ if prompt:
                             sel_val = st.selectbox("Filter value", [d["value"] for d in data_terms] if data_terms else [])
                             if sel_val and st.button("Run filter"):
                                 fdsl = {"size": 100, "query": {"bool": {"must": [{"term": {agg_field: sel_val}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}}}
-                                fres = elastic_connector.execute_query(json.dumps(fdsl), index_pattern=idx, size_limit=100)
+                                fres = elastic_connector.execute_query(fdsl, index_pattern=idx, size_limit=100)
                                 st.json(fres)
                         except Exception:
                             pass
@@ -287,7 +287,7 @@ if prompt:
                     }
                     try:
                         import altair as alt
-                        haggs = elastic_connector.execute_aggregation(json.dumps(histo_dsl), index_pattern=idx)
+                        haggs = elastic_connector.execute_aggregation(histo_dsl, index_pattern=idx)
                         hb = haggs.get('by_time', {}).get('buckets', []) if isinstance(haggs, dict) else []
                         data_chart = [{"bucket": i, "count": b.get('doc_count', 0)} for i, b in enumerate(hb)]
                         chart = alt.Chart(alt.Data(values=data_chart)).mark_line(point=True).encode(
@@ -300,7 +300,7 @@ if prompt:
                         if st.button("Run bucket filter") and hb:
                             key = hb[sel_bucket].get('key_as_string') or hb[sel_bucket].get('key')
                             fdsl = {"size": 100, "query": {"bool": {"must": [{"range": {"@timestamp": {"gte": key, "lt": f"{key}||+1h"}}}]}}}
-                            fres = elastic_connector.execute_query(json.dumps(fdsl), index_pattern=idx, size_limit=100)
+                            fres = elastic_connector.execute_query(fdsl, index_pattern=idx, size_limit=100)
                             st.json(fres)
                     except Exception:
                         pass
@@ -320,9 +320,11 @@ if prompt:
                                 "size": 200,
                                 "query": {"bool": {"must": [{"term": {"file.path": "/etc/shadow"}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}}
                             }
-                            rf = elastic_connector.execute_query(json.dumps(q_failed), index_pattern=idx, size_limit=200)
-                            rr = elastic_connector.execute_query(json.dumps(q_rdp), index_pattern=idx, size_limit=200)
-                            rfile = elastic_connector.execute_query(json.dumps(q_file), index_pattern=idx, size_limit=200)
+                            with elastic_connector.batch() as b:
+                                h_failed = b.query(q_failed, index_pattern=idx, size_limit=200)
+                                h_rdp = b.query(q_rdp, index_pattern=idx, size_limit=200)
+                                h_file = b.query(q_file, index_pattern=idx, size_limit=200)
+                            rf, rr, rfile = h_failed.result(), h_rdp.result(), h_file.result()
                             score = {}
                             def bump(key, w):
                                 score[key] = score.get(key, 0) + w
@@ -511,10 +513,10 @@ if prompt:
                         ("RDP", {"size": 0, "query": {"bool": {"must": [{"term": {"destination.port": 3389}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}}}),
                         ("Shadow access", {"size": 0, "query": {"bool": {"must": [{"term": {"file.path": "/etc/shadow"}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}}})
                     ]
-                    counts = []
-                    for name, dsl in rules:
-                        r = elastic_connector.execute_query(json.dumps(dsl), index_pattern=idx, size_limit=0)
-                        counts.append((name, r.get("total_hits", 0)))
+                    # All rule counts go out as a single _msearch
+                    with elastic_connector.batch() as b:
+                        handles = [(name, b.query(dsl, index_pattern=idx, size_limit=0)) for name, dsl in rules]
+                    counts = [(name, h.result().get("total_hits", 0)) for name, h in handles]
                     cov = int(100 * (len([c for c in counts if c[1] > 0]) / len(rules))) if rules else 0
                     st.metric("Sigma coverage", f"{cov}%")
                     st.table({"rule": [n for n, _ in counts], "hits": [c for _, c in counts]})
@@ -1,6 +1,7 @@
 import sqlite3
 import os
 import time
+import orjson
 
 DB_PATH = os.getenv("AUDIT_DB_PATH", "audit.db")
 
@@ -10,6 +11,10 @@ def init_db():
     cur.execute(
         "CREATE TABLE IF NOT EXISTS queries (id INTEGER PRIMARY KEY AUTOINCREMENT, ts INTEGER, user TEXT, idx TEXT, hits INTEGER, duration_ms INTEGER, query_json TEXT)"
     )
+    # Pre-flight cost estimate (cost_guard), added after the table first shipped
+    cols = [r[1] for r in cur.execute("PRAGMA table_info(queries)").fetchall()]
+    if "cost_json" not in cols:
+        cur.execute("ALTER TABLE queries ADD COLUMN cost_json TEXT")
     cur.execute(
         "CREATE TABLE IF NOT EXISTS saved_searches (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, user TEXT, idx TEXT, query_json TEXT, created_ts INTEGER)"
     )
@@ -19,12 +24,16 @@ def init_db():
     conn.commit()
     conn.close()
 
-def log_query(user, idx, hits, duration_ms, query_json):
+def log_query(user, idx, hits, duration_ms, query_json, cost=None):
+    # Accept the DSL dict directly; it is serialized once, here
+    if not isinstance(query_json, str):
+        query_json = orjson.dumps(query_json).decode()
+    cost_json = orjson.dumps(cost).decode() if cost is not None else None
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute(
-        "INSERT INTO queries (ts, user, idx, hits, duration_ms, query_json) VALUES (?, ?, ?, ?, ?, ?)",
-        (int(time.time()), user, idx, int(hits), int(duration_ms), query_json),
+        "INSERT INTO queries (ts, user, idx, hits, duration_ms, query_json, cost_json) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (int(time.time()), user, idx, int(hits), int(duration_ms), query_json, cost_json),
     )
     conn.commit()
     conn.close()
@@ -39,10 +48,10 @@ def list_queries(limit=50):
 def export_queries_json(signing_key=None):
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
-    cur.execute("SELECT ts, user, idx, hits, duration_ms, query_json FROM queries ORDER BY id DESC")
+    cur.execute("SELECT ts, user, idx, hits, duration_ms, query_json, cost_json FROM queries ORDER BY id DESC")
     rows = cur.fetchall()
     conn.close()
-    data = [{"ts": r[0], "user": r[1], "idx": r[2], "hits": r[3], "duration_ms": r[4], "query_json": r[5]} for r in rows]
+    data = [{"ts": r[0], "user": r[1], "idx": r[2], "hits": r[3], "duration_ms": r[4], "query_json": r[5], "cost_json": r[6]} for r in rows]
     if signing_key:
         import hmac, hashlib, json as _json
         payload = _json.dumps(data, separators=(",", ":"))
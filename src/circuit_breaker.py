@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+BREAKER_WINDOW = int(os.getenv("ELASTIC_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("ELASTIC_BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("ELASTIC_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("ELASTIC_BREAKER_COOLDOWN", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+class CircuitBreaker:
+    """
+    Failure-rate breaker over the last `window` calls. Once open it rejects calls
+    until `cooldown` has passed, then lets a single probe through (half-open):
+    a successful probe closes it, a failed one re-opens it.
+    """
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = deque(maxlen=window)
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(f"Circuit '{self.name}' is open")
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(f"Circuit '{self.name}' is half-open, probe in progress")
+                self._probe_in_flight = True
+            self.stats["calls"] += 1
+
+    def record(self, success):
+        with self._lock:
+            if not success:
+                self.stats["failures"] += 1
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if success:
+                    logger.info(f"Circuit '{self.name}' closed after successful probe")
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._trip()
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._trip()
+
+    def abandon(self):
+        """The call never finished (e.g. cancelled); free the half-open probe slot."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def _trip(self):
+        if self.state != OPEN:
+            logger.warning(f"Circuit '{self.name}' opened; failing fast for {self.cooldown}s")
+            self.stats["opened"] += 1
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            recent = len(self._outcomes)
+            snap = dict(self.stats)
+            snap["state"] = self.state
+            snap["failure_rate"] = round(self._outcomes.count(False) / recent, 3) if recent else 0.0
+            snap["retry_in_s"] = round(max(self.cooldown - (time.monotonic() - self.opened_at), 0), 1) if self.state == OPEN else 0
+        return snap
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(name):
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+def snapshot():
+    return {name: b.snapshot() for name, b in list(_breakers.items())}
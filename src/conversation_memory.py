@@ -0,0 +1,200 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+import orjson
+from schema_extractor import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# Recent turns kept verbatim; older ones are folded into the running summary
+MEMORY_WINDOW_TURNS = int(os.getenv("MEMORY_WINDOW_TURNS", "6"))
+# Upper bound on the history rendered into a prompt (summary + recent turns)
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "400"))
+MEMORY_TURN_CHARS = int(os.getenv("MEMORY_TURN_CHARS", "600"))
+MEMORY_IDLE_SECONDS = int(os.getenv("MEMORY_IDLE_SECONDS", "1800"))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1000"))
+# Empty keeps sessions in process memory only
+MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH", "")
+# Summarize folded turns with the LLM instead of the built-in extractive digest
+MEMORY_LLM_SUMMARY = os.getenv("MEMORY_LLM_SUMMARY", "false").lower() == "true"
+
+# Prompts that lean on earlier turns ("show those from agent 7"); these must not be served from context-free caches
+# Only anaphora count: "above", "more", "it" etc. also occur in standalone questions ("rule level above 10")
+FOLLOW_UP_RE = re.compile(
+    r"\b(those|these|them|that one|the above|(?:the )?same (?:results?|query|search|ones?)|(?:the )?(?:previous|earlier|prior) (?:results?|query|search|ones?|hosts?|agents?|ips?|users?|alerts?))\b",
+    re.I,
+)
+
+def is_follow_up(prompt):
+    return bool(FOLLOW_UP_RE.search(str(prompt)))
+
+def _first_sentence(text, limit):
+    text = " ".join(str(text or "").split())
+    end = text.find(". ")
+    text = text[:end + 1] if 0 < end < limit else text
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+def extractive_summary(previous, turns, max_tokens=None):
+    """One line per folded turn (question and first sentence of the answer); oldest lines drop first."""
+    max_chars = (max_tokens or MEMORY_SUMMARY_TOKENS) * 4
+    lines = [l for l in (previous or "").split("\n") if l]
+    lines += [f"- {_first_sentence(t['input'], 160)} -> {_first_sentence(t['output'], 200)}" for t in turns]
+    while lines and sum(len(l) + 1 for l in lines) > max_chars:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def llm_summary(previous, turns, max_tokens=None):
+    import llm_client
+    transcript = "\n".join(f"User: {t['input']}\nAssistant: {t['output']}" for t in turns)
+    prompt = (f"Update this running summary of a SOC investigation in at most {max_tokens or MEMORY_SUMMARY_TOKENS} tokens. "
+              f"Keep entities (IPs, users, hosts, rule ids) and conclusions.\n\nSummary so far:\n{previous or '(none)'}\n\nNew turns:\n{transcript}")
+    return llm_client.get_llm().invoke(prompt).content.strip()
+
+class SessionMemory:
+    """Summary of older turns plus a window of recent ones, for one user session."""
+    def __init__(self, key, summary="", turns=None, last_used=None):
+        self.key = key
+        self.summary = summary
+        self.turns = list(turns or [])
+        self.last_used = last_used or time.time()
+
+    def tokens(self):
+        return estimate_tokens(self.summary) + sum(estimate_tokens(t["input"]) + estimate_tokens(t["output"]) for t in self.turns)
+
+    def render(self):
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier turns:\n{self.summary}")
+        if self.turns:
+            parts.append("Recent turns:\n" + "\n".join(f"User: {t['input']}\nAssistant: {t['output']}" for t in self.turns))
+        return "\n\n".join(parts)
+
+class MemoryStore:
+    """
+    Per-(user, session) conversation memory with a token budget. Turns beyond the window or
+    budget are summarized, idle sessions are evicted (and persisted to SQLite when configured).
+    """
+    def __init__(self, db_path=MEMORY_DB_PATH, window=MEMORY_WINDOW_TURNS, token_budget=MEMORY_TOKEN_BUDGET,
+                 idle_seconds=MEMORY_IDLE_SECONDS, max_sessions=MEMORY_MAX_SESSIONS, summarizer=None):
+        self.db_path = db_path
+        self.window = window
+        self.token_budget = token_budget
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.summarizer = summarizer or (llm_summary if MEMORY_LLM_SUMMARY else extractive_summary)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"sessions_created": 0, "sessions_loaded": 0, "evictions": 0, "summarizations": 0, "turns_saved": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS conversation_memory (session_key TEXT PRIMARY KEY, summary TEXT, turns_json TEXT, last_used_ts REAL)")
+        return conn
+
+    def _load(self, key):
+        if not self.db_path:
+            return None
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT summary, turns_json, last_used_ts FROM conversation_memory WHERE session_key = ?", (key,)).fetchone()
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Could not load conversation memory for {key}: {e}")
+            return None
+        if not row:
+            return None
+        self.stats["sessions_loaded"] += 1
+        return SessionMemory(key, row[0], orjson.loads(row[1]), row[2])
+
+    def _persist(self, session):
+        if not self.db_path:
+            return
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO conversation_memory (session_key, summary, turns_json, last_used_ts) VALUES (?, ?, ?, ?)",
+                (session.key, session.summary, orjson.dumps(session.turns).decode(), session.last_used),
+            )
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Could not persist conversation memory for {session.key}: {e}")
+
+    def _evict_idle(self, now):
+        """Drops sessions idle past idle_seconds or beyond max_sessions (caller holds the lock)."""
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.idle_seconds and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[key]
+            self.stats["evictions"] += 1
+
+    def _session(self, user, session_id):
+        key = f"{user}:{session_id or 'default'}"
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._load(key)
+                if session is None:
+                    session = SessionMemory(key)
+                    self.stats["sessions_created"] += 1
+                self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            session.last_used = now
+            return session
+
+    def history(self, user, session_id=None):
+        """Prompt-ready history for the session ("" when there is none)."""
+        return self._session(user, session_id).render()
+
+    def save(self, user, session_id, user_input, output):
+        session = self._session(user, session_id)
+        folded = []
+        with self._lock:
+            session.turns.append({"input": str(user_input)[:MEMORY_TURN_CHARS], "output": str(output)[:MEMORY_TURN_CHARS]})
+            self.stats["turns_saved"] += 1
+            while session.turns and (len(session.turns) > self.window or (session.tokens() > self.token_budget and len(session.turns) > 1)):
+                folded.append(session.turns.pop(0))
+        if folded:
+            # Summarizing may call the LLM; do it outside the store lock
+            try:
+                summary = self.summarizer(session.summary, folded)
+            except Exception as e:
+                logger.warning(f"Summarization failed, using extractive summary: {e}")
+                summary = extractive_summary(session.summary, folded)
+            with self._lock:
+                session.summary = summary
+                self.stats["summarizations"] += 1
+        self._persist(session)
+
+    def clear(self, user, session_id=None):
+        key = f"{user}:{session_id or 'default'}"
+        with self._lock:
+            self._sessions.pop(key, None)
+        if self.db_path:
+            try:
+                conn = self._connect()
+                conn.execute("DELETE FROM conversation_memory WHERE session_key = ?", (key,))
+                conn.commit()
+                conn.close()
+            except Exception as e:
+                logger.warning(f"Could not clear conversation memory for {key}: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            self._evict_idle(time.time())
+            stats = dict(self.stats)
+            stats["sessions"] = len(self._sessions)
+            stats["tokens"] = sum(s.tokens() for s in self._sessions.values())
+        return stats
+
+# Shared instance used by agent_logic
+memory_store = MemoryStore()
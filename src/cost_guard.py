@@ -0,0 +1,228 @@
+import os
+import re
+import copy
+import time
+import random
+import logging
+import threading
+import elastic_connector
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+COST_GUARD_ENABLED = os.getenv("COST_GUARD_ENABLED", "true").lower() == "true"
+# Budgets are estimated indexer time per query, in milliseconds
+ROLE_BUDGETS_MS = {
+    "analyst": int(os.getenv("COST_BUDGET_ANALYST_MS", "2000")),
+    "admin": int(os.getenv("COST_BUDGET_ADMIN_MS", "10000")),
+}
+DEFAULT_BUDGET_MS = int(os.getenv("COST_BUDGET_DEFAULT_MS", str(ROLE_BUDGETS_MS["analyst"])))
+# Over-budget queries get their time window narrowed instead of being rejected
+COST_REWRITE = os.getenv("COST_REWRITE", "true").lower() == "true"
+COST_MIN_WINDOW_SECONDS = int(os.getenv("COST_MIN_WINDOW_SECONDS", "900"))
+# Static cost model: nanoseconds of work per candidate document for a plain filter
+COST_NS_PER_DOC = float(os.getenv("COST_NS_PER_DOC", "20"))
+# Share of queries that also get a profiled run over a recent slice to measure real cost
+COST_PROFILE_SAMPLE_RATE = float(os.getenv("COST_PROFILE_SAMPLE_RATE", "0"))
+COST_PROFILE_SLICE = os.getenv("COST_PROFILE_SLICE", "now-15m")
+COST_STATS_TTL_SECONDS = int(os.getenv("COST_STATS_TTL_SECONDS", "60"))
+
+ALLOW = "allow"
+REWRITE = "rewrite"
+REJECT = "reject"
+
+# Extra cost multipliers per clause shape, added on top of a base weight of 1
+CLAUSE_WEIGHTS = {
+    "leading_wildcard": 25.0,
+    "wildcard": 2.0,
+    "regexp": 25.0,
+    "match": 0.5,
+    "query_string": 5.0,
+    "script": 50.0,
+    "terms_agg": 1.0,
+    "cardinality_agg": 1.0,
+    "date_histogram_agg": 0.5,
+}
+
+UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "H": 3600, "d": 86400, "w": 604800}
+RELATIVE_RE = re.compile(r"^now-(\d+)([smhHdw])(/[smhHdw])?$")
+
+_stats_cache = {}
+_stats_lock = threading.Lock()
+
+def _shard_stats(index_pattern):
+    now = time.monotonic()
+    with _stats_lock:
+        cached = _stats_cache.get(index_pattern)
+        if cached and now - cached[0] < COST_STATS_TTL_SECONDS:
+            return cached[1]
+    stats = elastic_connector.index_stats(index_pattern)
+    with _stats_lock:
+        _stats_cache[index_pattern] = (now, stats)
+    return stats
+
+def _bool_clauses(dsl):
+    b = dsl.get("query", {}).get("bool", {}) if isinstance(dsl.get("query"), dict) else {}
+    for key in ("must", "filter"):
+        clauses = b.get(key, [])
+        for clause in (clauses if isinstance(clauses, list) else [clauses]):
+            yield clause
+
+def _timestamp_ranges(dsl):
+    """The @timestamp range dicts a document must satisfy (top-level bool must/filter or a bare range)."""
+    q = dsl.get("query", {})
+    if isinstance(q, dict) and "range" in q and "@timestamp" in q["range"]:
+        return [q["range"]["@timestamp"]]
+    return [c["range"]["@timestamp"] for c in _bool_clauses(dsl)
+            if isinstance(c, dict) and isinstance(c.get("range"), dict) and "@timestamp" in c["range"]]
+
+def window_seconds(dsl):
+    """Lookback of the narrowest relative @timestamp lower bound, or None when unbounded/absolute."""
+    windows = []
+    for r in _timestamp_ranges(dsl):
+        m = RELATIVE_RE.match(str(r.get("gte", r.get("gt", ""))))
+        if m:
+            windows.append(int(m.group(1)) * UNIT_SECONDS[m.group(2)])
+    return min(windows) if windows else None
+
+def clause_weight(dsl):
+    """Multiplier over the plain-filter cost, plus the names of the clauses that raised it."""
+    weight, reasons = 1.0, []
+    def add(name):
+        nonlocal weight
+        weight += CLAUSE_WEIGHTS[name]
+        reasons.append(name)
+    def walk(obj):
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                if k in ("wildcard", "prefix") and isinstance(v, dict):
+                    for spec in v.values():
+                        pattern = spec.get("value", spec.get("wildcard", "")) if isinstance(spec, dict) else spec
+                        add("leading_wildcard" if k == "wildcard" and str(pattern)[:1] in ("*", "?") else "wildcard")
+                elif k in ("regexp", "query_string", "script"):
+                    add(k)
+                elif k in ("match", "match_phrase") and isinstance(v, dict):
+                    add("match")
+                else:
+                    walk(v)
+        elif isinstance(obj, list):
+            for item in obj:
+                walk(item)
+    def walk_aggs(aggs):
+        for spec in (aggs or {}).values():
+            if not isinstance(spec, dict):
+                continue
+            for kind in ("terms", "cardinality", "date_histogram"):
+                if kind in spec:
+                    add(f"{kind}_agg")
+            walk_aggs(spec.get("aggs") or spec.get("aggregations"))
+    walk(dsl.get("query", {}))
+    walk_aggs(dsl.get("aggs") or dsl.get("aggregations"))
+    return weight, reasons
+
+def _candidate_query(dsl, window=None):
+    """Only the time bounds of dsl (cheap to count from the @timestamp index), optionally overridden."""
+    if window is not None:
+        return {"query": {"range": {"@timestamp": {"gte": window}}}}
+    ranges = _timestamp_ranges(dsl)
+    if not ranges:
+        return {}
+    return {"query": {"bool": {"filter": [{"range": {"@timestamp": r}} for r in ranges]}}}
+
+def _profile_ns_per_doc(dsl, index_pattern):
+    """Measured query nanoseconds per candidate doc over a recent slice, or None if unusable."""
+    slice_query = {"query": {"bool": {"filter": [dsl.get("query", {"match_all": {}}), {"range": {"@timestamp": {"gte": COST_PROFILE_SLICE}}}]}}}
+    candidates = elastic_connector.count(_candidate_query({}, COST_PROFILE_SLICE), index_pattern)
+    if candidates <= 0:
+        return None
+    prof = elastic_connector.profile_query(slice_query, index_pattern)
+    return prof["time_in_nanos"] / candidates if prof["time_in_nanos"] else None
+
+def estimate(dsl, index_pattern="wazuh-alerts-*", profile=None):
+    """
+    Estimates the indexer time of dsl: candidate docs in its time window (via _count)
+    times per-doc cost, from the static clause model or, when profiled, measured.
+    """
+    stats = _shard_stats(index_pattern)
+    candidate = _candidate_query(dsl)
+    candidate_docs = elastic_connector.count(candidate, index_pattern) if candidate else stats["docs"]
+    weight, reasons = clause_weight(dsl)
+    est = {
+        "candidate_docs": candidate_docs,
+        "index_docs": stats["docs"],
+        "shards": stats["shards"],
+        "avg_doc_bytes": int(stats["store_bytes"] / stats["docs"]) if stats["docs"] else 0,
+        "window_seconds": window_seconds(dsl),
+        "clause_weight": weight,
+        "expensive_clauses": reasons,
+        "ns_per_doc": COST_NS_PER_DOC * weight,
+        "profiled": False,
+    }
+    est["est_scan_bytes"] = candidate_docs * est["avg_doc_bytes"]
+    if profile is None:
+        profile = COST_PROFILE_SAMPLE_RATE > 0 and random.random() < COST_PROFILE_SAMPLE_RATE
+    if profile:
+        try:
+            measured = _profile_ns_per_doc(dsl, index_pattern)
+            if measured:
+                est["ns_per_doc"] = measured
+                est["profiled"] = True
+        except Exception as e:
+            logger.warning(f"Profile sampling failed, using static cost model: {e}")
+    est["est_ms"] = round(candidate_docs * est["ns_per_doc"] / 1e6, 1)
+    return est
+
+def budget_for(role):
+    return ROLE_BUDGETS_MS.get(role, DEFAULT_BUDGET_MS)
+
+def _format_window(seconds):
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size and seconds % size == 0:
+            return f"now-{seconds // size}{unit}"
+    return f"now-{max(int(seconds // 60), 1)}m"
+
+def narrow_window(dsl, seconds):
+    """Copy of dsl with every relative @timestamp lower bound set to now-<seconds>."""
+    out = copy.deepcopy(dsl)
+    window = _format_window(seconds)
+    ranges = _timestamp_ranges(out)
+    if not ranges:
+        query = out.get("query") or {"match_all": {}}
+        out["query"] = {"bool": {"must": [query, {"range": {"@timestamp": {"gte": window}}}]}}
+        return out
+    for r in ranges:
+        r.pop("gt", None)
+        r["gte"] = window
+    return out
+
+def check(dsl, index_pattern="wazuh-alerts-*", role=None):
+    """
+    Returns (decision, dsl_to_run, estimate). Over-budget queries are rewritten to a
+    narrower window when that brings them under budget, otherwise rejected.
+    """
+    budget = budget_for(role)
+    if not COST_GUARD_ENABLED:
+        return ALLOW, dsl, {"budget_ms": budget, "decision": ALLOW, "skipped": True}
+    est = estimate(dsl, index_pattern)
+    est["budget_ms"] = budget
+    if est["est_ms"] <= budget:
+        est["decision"] = ALLOW
+        return ALLOW, dsl, est
+    if COST_REWRITE:
+        # Window scaled so the same per-doc cost fits the budget (10% headroom); unbounded
+        # queries are assumed to span the maximum lookback
+        span = est["window_seconds"] or int(os.getenv("MAX_LOOKBACK_DAYS", "7")) * 86400
+        target = int(span * budget / est["est_ms"] * 0.9) // 60 * 60
+        if target >= COST_MIN_WINDOW_SECONDS:
+            rewritten = narrow_window(dsl, target)
+            new_est = estimate(rewritten, index_pattern, profile=False)
+            new_est["ns_per_doc"] = est["ns_per_doc"]
+            new_est["est_ms"] = round(new_est["candidate_docs"] * est["ns_per_doc"] / 1e6, 1)
+            if new_est["est_ms"] <= budget:
+                new_est.update({"budget_ms": budget, "decision": REWRITE, "original_est_ms": est["est_ms"],
+                                "original_window_seconds": est["window_seconds"], "profiled": est["profiled"]})
+                logger.info(f"Cost guard narrowed window to {_format_window(target)} ({est['est_ms']}ms -> {new_est['est_ms']}ms, budget {budget}ms)")
+                return REWRITE, rewritten, new_est
+    est["decision"] = REJECT
+    logger.warning(f"Cost guard rejected query: est {est['est_ms']}ms over budget {budget}ms ({', '.join(est['expensive_clauses']) or 'large window'})")
+    return REJECT, dsl, est
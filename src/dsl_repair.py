@@ -0,0 +1,247 @@
+import os
+import re
+import copy
+import logging
+import threading
+import validator
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DSL_REPAIR_ENABLED = os.getenv("DSL_REPAIR_ENABLED", "true").lower() == "true"
+# Window added when the LLM forgot the @timestamp range entirely (capped at the role's max lookback)
+DSL_REPAIR_DEFAULT_WINDOW_HOURS = int(os.getenv("DSL_REPAIR_DEFAULT_WINDOW_HOURS", "24"))
+MAX_SIZE = 1000
+TOP_LEVEL_KEYS = ("query", "size", "aggs", "sort")
+
+UNIT_DAYS = {"m": 1 / 1440, "h": 1 / 24, "H": 1 / 24, "d": 1, "w": 7, "M": 30, "y": 365}
+LOOKBACK_RE = re.compile(r"^now-(\d+)([mhHdwMy])(/[mhHdwMy])?$")
+
+_stats = {"attempts": 0, "repaired": 0, "failed": 0, "rules": {}}
+_stats_lock = threading.Lock()
+
+def _bool_must(dsl):
+    """dsl["query"] as a bool query; returns its must list, wrapping the old query into it if needed."""
+    q = dsl.get("query")
+    if not isinstance(q, dict) or not q:
+        dsl["query"] = {"bool": {"must": []}}
+    elif "bool" not in q:
+        dsl["query"] = {"bool": {"must": [q]}}
+    b = dsl["query"]["bool"]
+    must = b.get("must", [])
+    b["must"] = must if isinstance(must, list) else [must]
+    return b["must"]
+
+def _pop_timestamp_ranges(dsl):
+    """Removes @timestamp ranges from the top-level bool must/filter (or a bare range) and returns them."""
+    q = dsl.get("query", {})
+    if isinstance(q, dict) and isinstance(q.get("range"), dict) and "@timestamp" in q["range"]:
+        dsl["query"] = {"bool": {"must": []}}
+        return [q["range"]["@timestamp"]]
+    found = []
+    b = q.get("bool", {}) if isinstance(q, dict) else {}
+    for key in ("must", "filter"):
+        clauses = b.get(key)
+        if clauses is None:
+            continue
+        clauses = clauses if isinstance(clauses, list) else [clauses]
+        keep = []
+        for c in clauses:
+            if isinstance(c, dict) and isinstance(c.get("range"), dict) and "@timestamp" in c["range"]:
+                found.append(c["range"]["@timestamp"])
+            else:
+                keep.append(c)
+        b[key] = keep
+    if "filter" in b and not b["filter"]:
+        del b["filter"]
+    return found
+
+def _lookback_days(bound):
+    m = LOOKBACK_RE.match(str(bound))
+    return int(m.group(1)) * UNIT_DAYS[m.group(2)] if m else None
+
+def fix_time_range(dsl, max_days, **_):
+    """
+    Exactly one relative @timestamp lower bound in bool.must, within max_days. Ranges in
+    filter or as a bare query are moved there; missing, absolute or too-long bounds are clamped.
+    """
+    ranges = _pop_timestamp_ranges(dsl)
+    rng = dict(ranges[0]) if ranges else {}
+    bound = rng.pop("gte", rng.pop("gt", None))
+    days = _lookback_days(bound) if bound is not None else None
+    if days is None:
+        hours = min(DSL_REPAIR_DEFAULT_WINDOW_HOURS, int(max_days * 24)) if bound is None else int(max_days * 24)
+        bound = f"now-{hours}h" if hours < 24 or hours % 24 else f"now-{hours // 24}d"
+    elif days > max_days:
+        bound = f"now-{int(max_days)}d"
+    elif not re.match(r"^now-\d+[dh]", str(bound)):
+        # The validator only reads d/h units
+        hours = max(int(round(days * 24)), 1)
+        bound = f"now-{hours}h"
+    rng["gte"] = bound
+    _bool_must(dsl).append({"range": {"@timestamp": rng}})
+    return True
+
+def _resolve_field(name, schema_fields):
+    if name in schema_fields:
+        return name
+    for candidate in (f"{name}.keyword", name[:-8] if name.endswith(".keyword") else None):
+        if candidate and candidate in schema_fields:
+            return candidate
+    # Only a missing prefix ("srcip" -> "data.srcip"); a shared leaf ("user.name" vs "agent.name") is a different field
+    suffix = [f for f in schema_fields if f.endswith("." + name)]
+    return suffix[0] if len(suffix) == 1 else None
+
+def fix_field_names(dsl, schema_fields, **_):
+    """Renames unknown fields that resolve to exactly one mapped field (".keyword" or a missing prefix)."""
+    changed = False
+    def walk(obj):
+        nonlocal changed
+        if isinstance(obj, dict):
+            for op in ("match", "match_phrase", "term", "terms", "wildcard", "prefix", "range"):
+                spec = obj.get(op)
+                if isinstance(spec, dict) and "field" not in spec:
+                    for f in list(spec):
+                        target = _resolve_field(f, schema_fields)
+                        if target and target != f:
+                            spec[target] = spec.pop(f)
+                            changed = True
+            for k, v in obj.items():
+                if k == "field" and isinstance(v, str):
+                    target = _resolve_field(v, schema_fields)
+                    if target and target != v:
+                        obj[k] = target
+                        changed = True
+                else:
+                    walk(v)
+        elif isinstance(obj, list):
+            for item in obj:
+                walk(item)
+    walk(dsl.get("query", {}))
+    walk(dsl.get("aggs", {}))
+    return changed
+
+def fix_operators(dsl, types_map, **_):
+    """match on keyword -> term, term on text -> match, wildcard without wildcards on numbers -> term."""
+    changed = False
+    def convert(clause):
+        nonlocal changed
+        for op in ("match", "term", "wildcard"):
+            spec = clause.get(op)
+            if not isinstance(spec, dict) or len(spec) != 1:
+                continue
+            f, v = next(iter(spec.items()))
+            t = (types_map or {}).get(f)
+            value = v.get("query", v.get("value", v.get("wildcard"))) if isinstance(v, dict) else v
+            if op == "match" and t == "keyword":
+                clause.pop("match")
+                clause["term"] = {f: value}
+            elif op == "term" and t == "text":
+                clause.pop("term")
+                clause["match"] = {f: value}
+            elif op == "wildcard" and t in ("integer", "long", "float", "double") and re.fullmatch(r"\**-?\d+(\.\d+)?\**", str(value)):
+                clause.pop("wildcard")
+                number = str(value).strip("*")
+                clause["term"] = {f: float(number) if "." in number else int(number)}
+            else:
+                continue
+            changed = True
+    def walk(obj):
+        if isinstance(obj, dict):
+            convert(obj)
+            for v in obj.values():
+                walk(v)
+        elif isinstance(obj, list):
+            for item in obj:
+                walk(item)
+    walk(dsl.get("query", {}))
+    return changed
+
+def fix_size(dsl, **_):
+    size = dsl.get("size")
+    try:
+        fixed = max(1, min(int(size), MAX_SIZE))
+    except (TypeError, ValueError):
+        fixed = 100
+    dsl["size"] = fixed
+    return fixed != size
+
+def fix_top_level(dsl, **_):
+    extra = [k for k in dsl if k not in TOP_LEVEL_KEYS]
+    for k in extra:
+        dsl.pop(k)
+    return bool(extra)
+
+def fix_sort(dsl, schema_fields, types_map, **_):
+    """Drops sort keys the validator refuses rather than guessing another order."""
+    sort = dsl.get("sort")
+    items = sort if isinstance(sort, list) else [sort]
+    keep = []
+    for it in items:
+        f = next(iter(it)) if isinstance(it, dict) and it else it
+        t = (types_map or {}).get(f)
+        size = dsl.get("size", 0)
+        if f in schema_fields and (t == "date" or (t in ("keyword", "text") and (dsl.get("aggs") or (size is not None and size <= 100)))):
+            keep.append(it)
+    if keep:
+        dsl["sort"] = keep
+    else:
+        dsl.pop("sort", None)
+    return len(keep) != len(items)
+
+# Validator error prefix -> repair rule
+RULES = [
+    ("Missing time range", "time_range", fix_time_range),
+    ("Lookback exceeds maximum", "time_range", fix_time_range),
+    ("Unknown field", "field_names", fix_field_names),
+    ("Match not appropriate", "operators", fix_operators),
+    ("Operator ", "operators", fix_operators),
+    ("Wildcard only permitted", "operators", fix_operators),
+    ("Invalid size", "size", fix_size),
+    ("Unsupported top-level key", "top_level", fix_top_level),
+    ("Unknown sort field", "sort", fix_sort),
+    ("Sort ", "sort", fix_sort),
+]
+
+def repair(dsl, errors, schema_fields, types_map=None, max_days=7, analyzers_map=None, passes=2):
+    """
+    Rewrites dsl for the mechanical validator errors in RULES and revalidates locally.
+    Returns (ok, dsl, errors, applied rule names); dsl is a repaired copy when anything applied.
+    """
+    with _stats_lock:
+        _stats["attempts"] += 1
+    fixed, applied = copy.deepcopy(dsl), []
+    ok = False
+    for _ in range(passes):
+        ran = set()
+        for err in errors:
+            for prefix, name, rule in RULES:
+                if err.startswith(prefix) and name not in ran:
+                    ran.add(name)
+                    try:
+                        if rule(fixed, schema_fields=schema_fields, types_map=types_map, max_days=max_days) and name not in applied:
+                            applied.append(name)
+                    except Exception as e:
+                        logger.debug(f"DSL repair rule {name} failed: {e}")
+                    break
+        if not ran:
+            break
+        ok, errors = validator.validate_dsl(fixed, schema_fields, types_map=types_map, max_days=max_days, analyzers_map=analyzers_map)
+        if ok:
+            break
+    with _stats_lock:
+        _stats["repaired" if ok else "failed"] += 1
+        if ok:
+            for name in applied:
+                _stats["rules"][name] = _stats["rules"].get(name, 0) + 1
+    if ok:
+        logger.info(f"Auto-repaired DSL ({', '.join(applied)}) without an LLM retry")
+    return ok, (fixed if ok else dsl), errors, applied
+
+def get_stats():
+    """Repair hit rate; every successful repair is one LLM re-prompt avoided."""
+    with _stats_lock:
+        stats = dict(_stats, rules=dict(_stats["rules"]))
+    stats["hit_rate"] = round(stats["repaired"] / stats["attempts"], 3) if stats["attempts"] else 0.0
+    stats["llm_calls_avoided"] = stats["repaired"]
+    return stats
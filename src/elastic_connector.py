@@ -1,7 +1,16 @@
 from elasticsearch import Elasticsearch
-import json
+import orjson
 import os
 import logging
+import asyncio
+import threading
+import time
+import query_cache
+import single_flight
+import circuit_breaker
+import micro_batch
+from contextlib import contextmanager
+from elasticsearch import ApiError
 
 # Configuration
 ELASTIC_URL = os.getenv("ELASTIC_URL", "https://localhost:9200")
@@ -9,6 +18,24 @@ ELASTIC_USER = os.getenv("ELASTIC_USER")
 ELASTIC_PASSWORD = os.getenv("ELASTIC_PASSWORD")
 VERIFY_SSL = os.getenv("VERIFY_SSL", "true").lower() == "true"
 REQUEST_TIMEOUT = int(os.getenv("ELASTIC_REQUEST_TIMEOUT", "20"))
+# Connection pool sizing for the shared client (urllib3 keep-alive pools, one per node)
+POOL_CONNECTIONS_PER_NODE = int(os.getenv("ELASTIC_CONNECTIONS_PER_NODE", "10"))
+POOL_MAX_NODES = int(os.getenv("ELASTIC_POOL_MAX_NODES", "0"))
+# Deep pagination (point-in-time + search_after)
+PIT_KEEP_ALIVE = os.getenv("ELASTIC_PIT_KEEP_ALIVE", "1m")
+PIT_PAGE_SIZE_MAX = 10000
+PIT_SORT = [{"@timestamp": {"order": "asc"}}, {"_shard_doc": "asc"}]
+# Response trimming: only ship the parts of the search response we actually read
+QUERY_FILTER_PATH = ["hits.total.value", "hits.hits._source"]
+AGG_FILTER_PATH = ["aggregations"]
+PAGE_FILTER_PATH = ["pit_id", "hits.hits._source", "hits.hits.sort"]
+# status is kept so no item collapses to {} and shifts the response positions
+MSEARCH_FILTER_PATH = ["responses.status", "responses.error", "responses.hits.total.value", "responses.hits.hits._source", "responses.aggregations"]
+# Micro-batching: searches issued within this window are sent as one _msearch (0 disables)
+BATCH_WINDOW_MS = float(os.getenv("ELASTIC_BATCH_WINDOW_MS", "2"))
+BATCH_MAX_SEARCHES = int(os.getenv("ELASTIC_BATCH_MAX", "50"))
+# "local" serves every request from the in-memory engine in local_engine.py instead of a cluster
+ELASTIC_BACKEND = os.getenv("ELASTIC_BACKEND", "elasticsearch").lower()
 ALLOWED_INDEXES = [s.strip() for s in os.getenv("ALLOWED_INDEXES", "wazuh-alerts-*").split(",") if s.strip()]
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,169 +43,874 @@ logger = logging.getLogger(__name__)
 DEMO_MODE = os.getenv("DEMO_MODE", "true").lower() == "true"
 logger.info(f"ELASTIC_CONNECTOR: DEMO_MODE={DEMO_MODE}")
 
+_client = None
+_client_lock = threading.Lock()
+_pool_stats = {"clients_created": 0, "client_reuses": 0, "clients_closed": 0}
+
+def _is_outage(e):
+    # Bad queries (4xx) say nothing about cluster health; only transport errors and 5xx count
+    status = getattr(e, "status_code", None)
+    if isinstance(e, ApiError) or isinstance(status, int):
+        return (status or 0) >= 500
+    return True
+
+def _guarded(endpoint, fn):
+    """Runs fn() behind the endpoint's circuit breaker; raises CircuitOpenError while open."""
+    breaker = circuit_breaker.get_breaker(endpoint)
+    breaker.allow()
+    try:
+        result = fn()
+    except Exception as e:
+        breaker.record(not _is_outage(e))
+        raise
+    except BaseException:
+        breaker.abandon()
+        raise
+    breaker.record(True)
+    return result
+
+async def _guarded_async(endpoint, fn):
+    breaker = circuit_breaker.get_breaker(endpoint)
+    breaker.allow()
+    try:
+        result = await fn()
+    except Exception as e:
+        breaker.record(not _is_outage(e))
+        raise
+    except BaseException:
+        breaker.abandon()
+        raise
+    breaker.record(True)
+    return result
+
+def get_breaker_states():
+    return circuit_breaker.snapshot()
+
+def _hosts():
+    hosts = [h.strip() for h in ELASTIC_URL.split(",") if h.strip()]
+    if POOL_MAX_NODES > 0:
+        hosts = hosts[:POOL_MAX_NODES]
+    return hosts
+
 def get_client():
-    if not ELASTIC_URL:
-        raise ValueError("ELASTIC_URL environment variable is not set.")
-    if not ELASTIC_USER or not ELASTIC_PASSWORD:
-        raise ValueError("ELASTIC_USER/ELASTIC_PASSWORD environment variables are not set.")
-    return Elasticsearch(
-        ELASTIC_URL,
-        basic_auth=(ELASTIC_USER, ELASTIC_PASSWORD),
-        verify_certs=VERIFY_SSL,
-        ssl_show_warn=not VERIFY_SSL
-    )
+    """
+    Returns the process-wide Elasticsearch client, creating it on first use.
+    The client keeps one keep-alive connection pool per node, so callers must not close it.
+    """
+    global _client
+    if _client is not None:
+        _pool_stats["client_reuses"] += 1
+        return _client
+    with _client_lock:
+        if _client is not None:
+            _pool_stats["client_reuses"] += 1
+            return _client
+        if ELASTIC_BACKEND == "local":
+            import local_engine
+            _client = local_engine.LocalElasticsearch()
+            _pool_stats["clients_created"] += 1
+            logger.info("Using in-memory local engine instead of Elasticsearch")
+            return _client
+        if not ELASTIC_URL:
+            raise ValueError("ELASTIC_URL environment variable is not set.")
+        if not ELASTIC_USER or not ELASTIC_PASSWORD:
+            raise ValueError("ELASTIC_USER/ELASTIC_PASSWORD environment variables are not set.")
+        _client = Elasticsearch(
+            _hosts(),
+            basic_auth=(ELASTIC_USER, ELASTIC_PASSWORD),
+            verify_certs=VERIFY_SSL,
+            ssl_show_warn=not VERIFY_SSL,
+            connections_per_node=POOL_CONNECTIONS_PER_NODE,
+            request_timeout=REQUEST_TIMEOUT
+        )
+        _pool_stats["clients_created"] += 1
+        logger.info(f"Created shared Elasticsearch client ({len(_hosts())} node(s), {POOL_CONNECTIONS_PER_NODE} connections/node)")
+        return _client
+
+def close_client():
+    """Closes the shared client and its connection pools. Safe to call more than once."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            return
+        try:
+            _client.close()
+        except Exception as e:
+            logger.warning(f"Error closing Elasticsearch client: {e}")
+        _client = None
+        _pool_stats["clients_closed"] += 1
+
+def get_pool_stats():
+    """
+    Client and connection reuse counters. `connections_opened` counts new TCP/TLS
+    connections across all node pools; every other request reused a kept-alive one.
+    """
+    stats = dict(_pool_stats)
+    stats["connections_opened"] = 0
+    stats["requests_sent"] = 0
+    client = _client
+    if client is not None:
+        try:
+            for node in client.transport.node_pool.all():
+                pool = getattr(node, "pool", None)
+                stats["connections_opened"] += getattr(pool, "num_connections", 0)
+                stats["requests_sent"] += getattr(pool, "num_requests", 0)
+        except Exception as e:
+            logger.debug(f"Could not read node pool stats: {e}")
+    stats["connections_reused"] = max(stats["requests_sent"] - stats["connections_opened"], 0)
+    return stats
 
 def ping(timeout=5):
     try:
         client = get_client()
-        return bool(client.ping(request_timeout=timeout))
+        return bool(_guarded("ping", lambda: client.ping(request_timeout=timeout)))
     except Exception:
         return DEMO_MODE
 
-def get_mock_data(size=5):
-    import random
-    from datetime import datetime, timedelta
-    
-    mock_alerts = []
-    actions = ["File access", "Login success", "Login failure", "Privilege escalation", "Malware detected"]
-    agents = ["web-server-01", "db-primary", "workstation-hr-02", "firewall-hq"]
-    src_ips = ["192.168.1.50", "10.0.0.120", "172.16.5.10", "8.8.8.8"]
-    
-    for i in range(size):
-        level = random.randint(3, 15)
-        mock_alerts.append({
-            "@timestamp": (datetime.now() - timedelta(minutes=random.randint(1, 1440))).isoformat(),
-            "rule": {
-                "level": level,
-                "description": f"Mock Alert: {random.choice(actions)}",
-                "id": str(random.randint(1000, 9999)),
-                "groups": ["mock", "security"]
-            },
-            "agent": {
-                "id": f"00{random.randint(1,9)}",
-                "name": random.choice(agents),
-                "ip": "10.0.0.5"
-            },
-            "data": {
-                "srcip": random.choice(src_ips),
-                "dstport": random.choice([80, 443, 22, 3389])
+# DEMO fallbacks only need a handful of docs; a small IP pool keeps building the generator cheap
+MOCK_SOURCE_IPS = 256
+MOCK_REFRESH_SECONDS = 3600
+_mock = {"gen": None, "built": 0.0, "chunk": 0}
+_mock_lock = threading.Lock()
+
+def _mock_generator(seed=None):
+    import alert_generator
+    if seed is not None:
+        return alert_generator.AlertGenerator(seed=seed, days=1, scenario_rate=0, n_source_ips=MOCK_SOURCE_IPS), 0
+    with _mock_lock:
+        # Rebuilt hourly so the mock alerts stay inside the last day
+        if _mock["gen"] is None or time.time() - _mock["built"] > MOCK_REFRESH_SECONDS:
+            _mock.update(gen=alert_generator.AlertGenerator(seed=time.time_ns(), days=1, scenario_rate=0, n_source_ips=MOCK_SOURCE_IPS),
+                         built=time.time(), chunk=0)
+        _mock["chunk"] += 1
+        return _mock["gen"], _mock["chunk"]
+
+def get_mock_data(size=5, seed=None):
+    """Realistic synthetic alerts from alert_generator (fresh random draw unless seeded)."""
+    gen, chunk = _mock_generator(seed)
+    return gen.documents(gen.generate(size, chunk_index=chunk))
+
+def _apply_projection(query_dsl, fields):
+    # An explicit _source in the DSL wins over the caller's projection
+    if fields and "_source" not in query_dsl:
+        query_dsl["_source"] = {"includes": list(fields)}
+    return query_dsl
+
+def _as_dsl(dsl, what="Query DSL"):
+    # Dicts are the native form; JSON text is still accepted from older callers.
+    # Returns a shallow copy so the caller's dict is never mutated.
+    if isinstance(dsl, (str, bytes)):
+        dsl = orjson.loads(dsl)
+    if not isinstance(dsl, dict):
+        raise ValueError(f"{what} must be a JSON object.")
+    return dict(dsl)
+
+def _prepare_query(query_dsl, index_pattern, size_limit, fields=None):
+    query_dsl = _as_dsl(query_dsl)
+    _apply_projection(query_dsl, fields)
+
+    if "size" not in query_dsl or not isinstance(query_dsl.get("size"), int):
+        query_dsl["size"] = size_limit
+    else:
+        query_dsl["size"] = min(query_dsl["size"], size_limit)
+
+    if index_pattern not in ALLOWED_INDEXES:
+        raise ValueError("Index not allowed")
+    return query_dsl
+
+def _prepare_aggregation(aggs_dsl, index_pattern):
+    aggs_dsl = _as_dsl(aggs_dsl, "Aggregation DSL")
+    # Only the aggregations are returned, so never fetch hits alongside them
+    aggs_dsl["size"] = 0
+    if index_pattern not in ALLOWED_INDEXES:
+        raise ValueError("Index not allowed")
+    return aggs_dsl
+
+def _prepare_msearch(queries, index_pattern, size_limit):
+    if index_pattern not in ALLOWED_INDEXES:
+        raise ValueError("Index not allowed")
+    body = []
+    for q in queries:
+        q = _as_dsl(q)
+        hdr = {"index": index_pattern}
+        body.append(hdr)
+        if "size" not in q or not isinstance(q.get("size"), int):
+            q["size"] = size_limit
+        else:
+            q["size"] = min(q["size"], size_limit)
+        body.append(q)
+    return body
+
+# Average full _source size per index, used to estimate what a projection saved
+_full_doc_bytes = {}
+_projection_stats = {"projected_requests": 0, "bytes_received": 0, "bytes_saved": 0}
+
+def _response_bytes(response):
+    try:
+        return int(response.meta.headers.get("content-length"))
+    except Exception:
+        pass
+    # Items from a batched _msearch carry no headers of their own
+    try:
+        return len(orjson.dumps(response)) if isinstance(response, dict) else None
+    except Exception:
+        return None
+
+def _calibration_body():
+    return {"size": 5, "query": {"match_all": {}}}
+
+def _record_doc_size(index_pattern, response):
+    n = len(response.get('hits', {}).get('hits', []))
+    size = _response_bytes(response)
+    if n and size:
+        _full_doc_bytes[index_pattern] = size / n
+
+def _record_projection(index_pattern, response, n_hits):
+    """Returns the estimated bytes saved by _source/filter_path, or None if unknown."""
+    size = _response_bytes(response)
+    full = _full_doc_bytes.get(index_pattern)
+    if size is None or not n_hits:
+        return None
+    _projection_stats["projected_requests"] += 1
+    _projection_stats["bytes_received"] += size
+    if full is None:
+        return None
+    saved = max(int(full * n_hits) - size, 0)
+    _projection_stats["bytes_saved"] += saved
+    return saved
+
+def get_projection_stats():
+    stats = dict(_projection_stats)
+    stats["full_doc_bytes"] = {k: int(v) for k, v in _full_doc_bytes.items()}
+    return stats
+
+def _query_result(response, index_pattern=None, projected=False):
+    hits = response.get('hits', {}).get('hits', [])
+    total = response.get('hits', {}).get('total', {}).get('value', 0)
+
+    result = {
+        "status": "success",
+        "total_hits": total,
+        "data": [hit.get('_source', {}) for hit in hits]
+    }
+    if projected:
+        result["bytes_saved"] = _record_projection(index_pattern, response, len(hits))
+    return result
+
+def _msearch_result(resp):
+    out = []
+    for r in resp.get("responses", []):
+        hits = r.get('hits', {}).get('hits', [])
+        total = r.get('hits', {}).get('total', {}).get('value', 0)
+        out.append({"total_hits": total, "data": [h.get('_source', {}) for h in hits]})
+    return {"status": "success", "results": out}
+
+def _query_fallback(e):
+    logger.error(f"Query execution failed: {e}")
+    if DEMO_MODE:
+        logger.info("DEMO_MODE active: Returning mock data")
+        mock_data = get_mock_data(size=10)
+        return {
+            "status": "success",
+            "total_hits": len(mock_data),
+            "data": mock_data,
+            "is_mock": True
+        }
+    return {
+        "status": "error",
+        "error": str(e)
+    }
+
+def _aggregation_fallback(e):
+    logger.error(f"Aggregation execution failed: {e}")
+    if DEMO_MODE:
+        logger.info("DEMO_MODE active: Returning mock aggregations")
+        # Simple mock aggregations for dashboard
+        return {
+            "active_agents": {"value": 4},
+            "top_attacker": {"buckets": [{"key": "192.168.1.50", "doc_count": 42}]},
+            "risk_scoring": {
+                "buckets": [
+                    {"key": "web-server-01", "score": {"value": 150}},
+                    {"key": "db-primary", "score": {"value": 85}},
+                    {"key": "firewall-hq", "score": {"value": 45}}
+                ]
             },
-            "manager": {"name": "wazuh-manager"},
-            "id": f"mock-{i}"
-        })
-    return mock_alerts
+            "by_time": {
+                "buckets": [
+                    {"key_as_string": "2026-02-10T08:00:00Z", "doc_count": 10},
+                    {"key_as_string": "2026-02-10T09:00:00Z", "doc_count": 25},
+                    {"key_as_string": "2026-02-10T10:00:00Z", "doc_count": 15}
+                ]
+            }
+        }
+    return {"error": str(e)}
+
+# Identical searches already in flight share one upstream call
+_sync_flight = single_flight.SingleFlight()
+_async_flight = single_flight.AsyncSingleFlight()
+
+def _cache_lookup(kind, index_pattern, dsl, cache=True):
+    key = query_cache.canonical_key(kind, index_pattern, dsl)
+    if not (cache and query_cache.CACHE_ENABLED):
+        return key, None
+    return key, query_cache.result_cache.get(key)
+
+def _cache_store(key, kind, dsl, result, cache=True):
+    if cache and query_cache.CACHE_ENABLED:
+        query_cache.result_cache.set(key, result, query_cache.query_class(kind, dsl))
+
+def get_cache_stats():
+    return query_cache.result_cache.snapshot()
+
+def get_coalescing_stats():
+    return {
+        "sync": dict(_sync_flight.stats),
+        "async": dict(_async_flight.stats),
+        "coalesced": _sync_flight.stats["coalesced"] + _async_flight.stats["coalesced"]
+    }
+
+# --- Micro-batching into _msearch ---
+
+def _msearch_body(items):
+    body = []
+    for index, q in items:
+        body.append({"index": index})
+        body.append(q)
+    return body
+
+def _msearch_filter_path(items):
+    """MSEARCH_FILTER_PATH narrowed to what the batched items can return (no hits for size-0 items only)."""
+    wants_hits = any(q.get("size", 10) != 0 for _, q in items)
+    wants_aggs = any(q.get("aggs") or q.get("aggregations") for _, q in items)
+    return [p for p in MSEARCH_FILTER_PATH
+            if (wants_hits or not p.startswith("responses.hits.hits")) and (wants_aggs or p != "responses.aggregations")]
+
+def _send_msearch(items):
+    client = get_client()
+    body = _msearch_body(items)
+    filter_path = _msearch_filter_path(items)
+    resp = _guarded("msearch", lambda: client.msearch(body=body, filter_path=filter_path, request_timeout=REQUEST_TIMEOUT))
+    return resp.get("responses", [])
+
+async def _send_msearch_async(items):
+    client = get_async_client()
+    body = _msearch_body(items)
+    filter_path = _msearch_filter_path(items)
+    resp = await _guarded_async("msearch", lambda: client.msearch(body=body, filter_path=filter_path, request_timeout=REQUEST_TIMEOUT))
+    return resp.get("responses", [])
+
+_sync_batcher = micro_batch.MicroBatcher(_send_msearch, BATCH_WINDOW_MS, BATCH_MAX_SEARCHES)
+_async_batcher = micro_batch.AsyncMicroBatcher(_send_msearch_async, BATCH_WINDOW_MS, BATCH_MAX_SEARCHES)
+
+def _search(client, index_pattern, body, filter_path):
+    if BATCH_WINDOW_MS > 0:
+        return _sync_batcher.submit(index_pattern, body)
+    return _guarded("search", lambda: client.search(index=index_pattern, body=body, filter_path=filter_path, request_timeout=REQUEST_TIMEOUT))
+
+async def _search_async(client, index_pattern, body, filter_path):
+    if BATCH_WINDOW_MS > 0:
+        return await _async_batcher.submit(index_pattern, body)
+    return await _guarded_async("search", lambda: client.search(index=index_pattern, body=body, filter_path=filter_path, request_timeout=REQUEST_TIMEOUT))
 
-def execute_query(query_dsl, index_pattern="wazuh-alerts-*", size_limit=1000):
+class SearchBatch(micro_batch.Batch):
+    """
+    Explicit batch scope returned by batch(). query()/aggregation() return handles
+    whose result() gives the same shape as execute_query/execute_aggregation.
+    """
+    def query(self, query_dsl, index_pattern="wazuh-alerts-*", size_limit=1000, fields=None):
+        item = micro_batch.BatchItem(index_pattern, None, on_error=_query_fallback)
+        try:
+            body = _prepare_query(query_dsl, index_pattern, size_limit, fields)
+        except Exception as e:
+            item.resolve(error=e)
+            return item
+        key, cached = _cache_lookup("query", index_pattern, body)
+        if cached is not None:
+            item.resolve(response=cached)
+            return item
+
+        def on_result(resp):
+            result = _query_result(resp, index_pattern, "_source" in body and body["size"] > 0)
+            _cache_store(key, "query", body, result)
+            return result
+        item.body, item.on_result = body, on_result
+        return self.add(item)
+
+    def aggregation(self, aggs_dsl, index_pattern="wazuh-alerts-*"):
+        item = micro_batch.BatchItem(index_pattern, None, on_error=_aggregation_fallback)
+        try:
+            body = _prepare_aggregation(aggs_dsl, index_pattern)
+        except Exception as e:
+            item.resolve(error=e)
+            return item
+        key, cached = _cache_lookup("aggregation", index_pattern, body)
+        if cached is not None:
+            item.resolve(response=cached)
+            return item
+
+        def on_result(resp):
+            result = resp.get('aggregations', {})
+            _cache_store(key, "aggregation", body, result)
+            return result
+        item.body, item.on_result = body, on_result
+        return self.add(item)
+
+@contextmanager
+def batch():
+    """
+    Sends every search issued inside the scope as a single _msearch on exit:
+
+        with elastic_connector.batch() as b:
+            failed = b.query(q_failed)
+            histo = b.aggregation(histo_dsl)
+        failed.result(), histo.result()
+    """
+    b = SearchBatch(_send_msearch)
+    try:
+        yield b
+    finally:
+        b.flush()
+
+def get_batching_stats():
+    return {"sync": dict(_sync_batcher.stats), "async": dict(_async_batcher.stats), "window_ms": BATCH_WINDOW_MS}
+
+def execute_query(query_dsl, index_pattern="wazuh-alerts-*", size_limit=1000, fields=None, cache=True):
     """
     Executes a raw DSL query against Elasticsearch.
+    `fields` restricts the returned _source to those (dotted) field names.
+    `cache=False` bypasses the result cache (live tails that must not lag by a TTL).
     """
     try:
         client = get_client()
-        # Ensure query is a dict
-        if isinstance(query_dsl, str):
-            query_dsl = json.loads(query_dsl)
-        if not isinstance(query_dsl, dict):
-            raise ValueError("Query DSL must be a JSON object.")
-
-        if "size" not in query_dsl or not isinstance(query_dsl.get("size"), int):
-            query_dsl["size"] = size_limit
-        else:
-            query_dsl["size"] = min(query_dsl["size"], size_limit)
-            
-        if index_pattern not in ALLOWED_INDEXES:
-            raise ValueError("Index not allowed")
-        logger.info(f"Executing query on {index_pattern} with size {query_dsl['size']}")
-        response = client.search(index=index_pattern, body=query_dsl, request_timeout=REQUEST_TIMEOUT)
-        
-        hits = response.get('hits', {}).get('hits', [])
-        total = response.get('hits', {}).get('total', {}).get('value', 0)
-        
-        return {
-            "status": "success",
-            "total_hits": total,
-            "data": [hit.get('_source', {}) for hit in hits]
-        }
-        
+        query_dsl = _prepare_query(query_dsl, index_pattern, size_limit, fields)
+        key, cached = _cache_lookup("query", index_pattern, query_dsl, cache)
+        if cached is not None:
+            return cached
+
+        def run():
+            projected = "_source" in query_dsl and query_dsl["size"] > 0
+            if projected and index_pattern not in _full_doc_bytes:
+                _record_doc_size(index_pattern, _guarded("search", lambda: client.search(index=index_pattern, body=_calibration_body(), request_timeout=REQUEST_TIMEOUT)))
+            logger.info(f"Executing query on {index_pattern} with size {query_dsl['size']}")
+            response = _search(client, index_pattern, query_dsl, QUERY_FILTER_PATH)
+            result = _query_result(response, index_pattern, projected)
+            _cache_store(key, "query", query_dsl, result, cache)
+            return result
+        return _sync_flight.do(key, run)
     except Exception as e:
-        logger.error(f"Query execution failed: {e}")
-        if DEMO_MODE:
-            logger.info("DEMO_MODE active: Returning mock data")
-            mock_data = get_mock_data(size=10)
-            return {
-                "status": "success",
-                "total_hits": len(mock_data),
-                "data": mock_data,
-                "is_mock": True
-            }
-        return {
-            "status": "error",
-            "error": str(e)
-        }
+        return _query_fallback(e)
 
 def execute_aggregation(aggs_dsl, index_pattern="wazuh-alerts-*"):
     try:
         client = get_client()
-        if isinstance(aggs_dsl, str):
-            aggs_dsl = json.loads(aggs_dsl)
-        if not isinstance(aggs_dsl, dict):
-            raise ValueError("Aggregation DSL must be a JSON object.")
-        if index_pattern not in ALLOWED_INDEXES:
-            raise ValueError("Index not allowed")
-        logger.info(f"Executing aggregation on {index_pattern}")
-        response = client.search(index=index_pattern, body=aggs_dsl, request_timeout=REQUEST_TIMEOUT)
-        return response.get('aggregations', {})
+        aggs_dsl = _prepare_aggregation(aggs_dsl, index_pattern)
+        key, cached = _cache_lookup("aggregation", index_pattern, aggs_dsl)
+        if cached is not None:
+            return cached
+
+        def run():
+            logger.info(f"Executing aggregation on {index_pattern}")
+            response = _search(client, index_pattern, aggs_dsl, AGG_FILTER_PATH)
+            result = response.get('aggregations', {})
+            _cache_store(key, "aggregation", aggs_dsl, result)
+            return result
+        return _sync_flight.do(key, run)
     except Exception as e:
-        logger.error(f"Aggregation execution failed: {e}")
-        if DEMO_MODE:
-            logger.info("DEMO_MODE active: Returning mock aggregations")
-            # Simple mock aggregations for dashboard
-            return {
-                "active_agents": {"value": 4},
-                "top_attacker": {"buckets": [{"key": "192.168.1.50", "doc_count": 42}]},
-                "risk_scoring": {
-                    "buckets": [
-                        {"key": "web-server-01", "score": {"value": 150}},
-                        {"key": "db-primary", "score": {"value": 85}},
-                        {"key": "firewall-hq", "score": {"value": 45}}
-                    ]
-                },
-                "by_time": {
-                    "buckets": [
-                        {"key_as_string": "2026-02-10T08:00:00Z", "doc_count": 10},
-                        {"key_as_string": "2026-02-10T09:00:00Z", "doc_count": 25},
-                        {"key_as_string": "2026-02-10T10:00:00Z", "doc_count": 15}
-                    ]
-                }
-            }
-        return {"error": str(e)}
+        return _aggregation_fallback(e)
 
 def execute_multi_query(queries, index_pattern="wazuh-alerts-*", size_limit=100):
-    client = get_client()
     try:
-        if index_pattern not in ALLOWED_INDEXES:
-            raise ValueError("Index not allowed")
-        body = []
-        for q in queries:
-            if isinstance(q, str):
-                q = json.loads(q)
-            hdr = {"index": index_pattern}
-            body.append(hdr)
-            if "size" not in q or not isinstance(q.get("size"), int):
-                q["size"] = size_limit
-            else:
-                q["size"] = min(q["size"], size_limit)
-            body.append(q)
-        resp = client.msearch(body=body, request_timeout=REQUEST_TIMEOUT)
-        out = []
-        for r in resp.get("responses", []):
-            hits = r.get('hits', {}).get('hits', [])
-            total = r.get('hits', {}).get('total', {}).get('value', 0)
-            out.append({"total_hits": total, "data": [h.get('_source', {}) for h in hits]})
-        return {"status": "success", "results": out}
+        client = get_client()
+        body = _prepare_msearch(queries, index_pattern, size_limit)
+        resp = _guarded("msearch", lambda: client.msearch(body=body, request_timeout=REQUEST_TIMEOUT))
+        return _msearch_result(resp)
     except Exception as e:
         logger.error(f"Multi query failed: {e}")
         return {"status": "error", "error": str(e)}
 
+# --- Async connector (AsyncElasticsearch) for use inside FastAPI handlers ---
+
+_async_client = None
+_async_client_loop = None
+
+async def _close_quietly(client):
+    try:
+        await client.close()
+    except Exception as e:
+        logger.debug(f"Error closing replaced AsyncElasticsearch client: {e}")
+
+def _retire_async_client(client, loop):
+    """
+    Closes a client whose loop is no longer the current one: on its own loop while that is
+    still running, otherwise (e.g. after asyncio.run() returned) on the current loop.
+    """
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(_close_quietly(client), loop)
+    else:
+        asyncio.get_running_loop().create_task(_close_quietly(client))
+    _pool_stats["clients_closed"] += 1
+
+def get_async_client():
+    """
+    Returns the process-wide AsyncElasticsearch client, creating it on first use.
+    The aiohttp session is bound to an event loop, so a new loop gets a new client and
+    the previous one is closed rather than leaking its connection pool.
+    Requires the aiohttp transport (pip install "elasticsearch[async]").
+    """
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is not None and _async_client_loop is loop:
+        _pool_stats["client_reuses"] += 1
+        return _async_client
+    with _client_lock:
+        if _async_client is not None and _async_client_loop is loop:
+            _pool_stats["client_reuses"] += 1
+            return _async_client
+        if _async_client is not None:
+            _retire_async_client(_async_client, _async_client_loop)
+            _async_client, _async_client_loop = None, None
+        if ELASTIC_BACKEND == "local":
+            import local_engine
+            _async_client = local_engine.AsyncLocalElasticsearch()
+            _async_client_loop = loop
+            _pool_stats["clients_created"] += 1
+            return _async_client
+        if not ELASTIC_URL:
+            raise ValueError("ELASTIC_URL environment variable is not set.")
+        if not ELASTIC_USER or not ELASTIC_PASSWORD:
+            raise ValueError("ELASTIC_USER/ELASTIC_PASSWORD environment variables are not set.")
+        from elasticsearch import AsyncElasticsearch
+        _async_client = AsyncElasticsearch(
+            _hosts(),
+            basic_auth=(ELASTIC_USER, ELASTIC_PASSWORD),
+            verify_certs=VERIFY_SSL,
+            ssl_show_warn=not VERIFY_SSL,
+            connections_per_node=POOL_CONNECTIONS_PER_NODE,
+            request_timeout=REQUEST_TIMEOUT
+        )
+        _async_client_loop = loop
+        _pool_stats["clients_created"] += 1
+        logger.info("Created shared AsyncElasticsearch client")
+        return _async_client
+
+async def close_async_client():
+    """Closes the shared async client. Safe to call more than once."""
+    global _async_client, _async_client_loop
+    client = _async_client
+    _async_client = None
+    _async_client_loop = None
+    if client is None:
+        return
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning(f"Error closing AsyncElasticsearch client: {e}")
+    _pool_stats["clients_closed"] += 1
+
+async def ping_async(timeout=5):
+    try:
+        client = get_async_client()
+        return bool(await _guarded_async("ping", lambda: client.ping(request_timeout=timeout)))
+    except Exception:
+        return DEMO_MODE
+
+async def execute_query_async(query_dsl, index_pattern="wazuh-alerts-*", size_limit=1000, fields=None, cache=True):
+    """
+    Async twin of execute_query; does not block the event loop while Elasticsearch works.
+    """
+    try:
+        client = get_async_client()
+        query_dsl = _prepare_query(query_dsl, index_pattern, size_limit, fields)
+        key, cached = _cache_lookup("query", index_pattern, query_dsl, cache)
+        if cached is not None:
+            return cached
+
+        async def run():
+            projected = "_source" in query_dsl and query_dsl["size"] > 0
+            if projected and index_pattern not in _full_doc_bytes:
+                _record_doc_size(index_pattern, await _guarded_async("search", lambda: client.search(index=index_pattern, body=_calibration_body(), request_timeout=REQUEST_TIMEOUT)))
+            logger.info(f"Executing async query on {index_pattern} with size {query_dsl['size']}")
+            response = await _search_async(client, index_pattern, query_dsl, QUERY_FILTER_PATH)
+            result = _query_result(response, index_pattern, projected)
+            _cache_store(key, "query", query_dsl, result, cache)
+            return result
+        return await _async_flight.do(key, run)
+    except Exception as e:
+        # Building mock data is CPU work; keep it off the event loop
+        return await asyncio.to_thread(_query_fallback, e)
+
+async def execute_aggregation_async(aggs_dsl, index_pattern="wazuh-alerts-*"):
+    try:
+        client = get_async_client()
+        aggs_dsl = _prepare_aggregation(aggs_dsl, index_pattern)
+        key, cached = _cache_lookup("aggregation", index_pattern, aggs_dsl)
+        if cached is not None:
+            return cached
+
+        async def run():
+            logger.info(f"Executing async aggregation on {index_pattern}")
+            response = await _search_async(client, index_pattern, aggs_dsl, AGG_FILTER_PATH)
+            result = response.get('aggregations', {})
+            _cache_store(key, "aggregation", aggs_dsl, result)
+            return result
+        return await _async_flight.do(key, run)
+    except Exception as e:
+        return _aggregation_fallback(e)
+
+async def execute_multi_query_async(queries, index_pattern="wazuh-alerts-*", size_limit=100):
+    try:
+        client = get_async_client()
+        body = _prepare_msearch(queries, index_pattern, size_limit)
+        resp = await _guarded_async("msearch", lambda: client.msearch(body=body, request_timeout=REQUEST_TIMEOUT))
+        return _msearch_result(resp)
+    except Exception as e:
+        logger.error(f"Multi query failed: {e}")
+        return {"status": "error", "error": str(e)}
+
+# --- Deep pagination: point-in-time + search_after ---
+
+def _prepare_page(query_dsl, page_size, pit_id, search_after, keep_alive, fields=None):
+    query_dsl = _as_dsl(query_dsl)
+    # Paging is always over hits in a stable (@timestamp, shard doc) order
+    body = {k: v for k, v in query_dsl.items() if k not in ("aggs", "sort", "size", "from")}
+    _apply_projection(body, fields)
+    body["size"] = max(1, min(int(page_size), PIT_PAGE_SIZE_MAX))
+    body["sort"] = PIT_SORT
+    body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+    body["track_total_hits"] = False
+    if search_after:
+        body["search_after"] = search_after
+    return body
+
+def _page_result(response, pit_id, page_size):
+    hits = response.get('hits', {}).get('hits', [])
+    return {
+        "status": "success",
+        "data": [hit.get('_source', {}) for hit in hits],
+        # Elasticsearch may hand back a new PIT id on every page
+        "pit_id": response.get("pit_id", pit_id),
+        "search_after": hits[-1].get("sort") if hits else None,
+        "done": len(hits) < page_size
+    }
+
+def open_pit(index_pattern="wazuh-alerts-*", keep_alive=PIT_KEEP_ALIVE):
+    if index_pattern not in ALLOWED_INDEXES:
+        raise ValueError("Index not allowed")
+    return _guarded("pit", lambda: get_client().open_point_in_time(index=index_pattern, keep_alive=keep_alive))["id"]
+
+def close_pit(pit_id):
+    if not pit_id:
+        return
+    try:
+        _guarded("pit", lambda: get_client().close_point_in_time(id=pit_id))
+    except Exception as e:
+        logger.warning(f"Failed to close point-in-time: {e}")
+
+def search_page(query_dsl, index_pattern="wazuh-alerts-*", page_size=1000, pit_id=None, search_after=None, keep_alive=PIT_KEEP_ALIVE, fields=None):
+    """
+    Fetches one page of a point-in-time scan. Pass the returned pit_id and
+    search_after back in to get the next page; the PIT is closed on the last page.
+    """
+    try:
+        client = get_client()
+        if pit_id is None:
+            pit_id = open_pit(index_pattern, keep_alive)
+        body = _prepare_page(query_dsl, page_size, pit_id, search_after, keep_alive, fields)
+        response = _guarded("search", lambda: client.search(body=body, filter_path=PAGE_FILTER_PATH, request_timeout=REQUEST_TIMEOUT))
+        page = _page_result(response, pit_id, body["size"])
+        if page["done"]:
+            close_pit(page["pit_id"])
+            page["pit_id"] = None
+        return page
+    except Exception as e:
+        close_pit(pit_id)
+        logger.error(f"Paged query failed: {e}")
+        return {"status": "error", "error": str(e)}
+
+def iter_query(query_dsl, index_pattern="wazuh-alerts-*", chunk_size=1000, keep_alive=PIT_KEEP_ALIVE, max_hits=None, fields=None):
+    """
+    Yields every hit matching query_dsl in chunks of at most chunk_size documents.
+    Only one chunk is held in memory at a time. The PIT is closed when the scan
+    finishes, fails or the caller stops iterating (generator close).
+    """
+    pit_id = open_pit(index_pattern, keep_alive)
+    search_after = None
+    seen = 0
+    try:
+        client = get_client()
+        while True:
+            size = chunk_size if max_hits is None else min(chunk_size, max_hits - seen)
+            if size <= 0:
+                return
+            body = _prepare_page(query_dsl, size, pit_id, search_after, keep_alive, fields)
+            response = _guarded("search", lambda: client.search(body=body, filter_path=PAGE_FILTER_PATH, request_timeout=REQUEST_TIMEOUT))
+            page = _page_result(response, pit_id, body["size"])
+            pit_id, search_after = page["pit_id"], page["search_after"]
+            if page["data"]:
+                seen += len(page["data"])
+                yield page["data"]
+            if page["done"]:
+                return
+    finally:
+        close_pit(pit_id)
+
+async def open_pit_async(index_pattern="wazuh-alerts-*", keep_alive=PIT_KEEP_ALIVE):
+    if index_pattern not in ALLOWED_INDEXES:
+        raise ValueError("Index not allowed")
+    resp = await _guarded_async("pit", lambda: get_async_client().open_point_in_time(index=index_pattern, keep_alive=keep_alive))
+    return resp["id"]
+
+async def close_pit_async(pit_id):
+    if not pit_id:
+        return
+    try:
+        await _guarded_async("pit", lambda: get_async_client().close_point_in_time(id=pit_id))
+    except Exception as e:
+        logger.warning(f"Failed to close point-in-time: {e}")
+
+async def search_page_async(query_dsl, index_pattern="wazuh-alerts-*", page_size=1000, pit_id=None, search_after=None, keep_alive=PIT_KEEP_ALIVE, fields=None):
+    try:
+        client = get_async_client()
+        if pit_id is None:
+            pit_id = await open_pit_async(index_pattern, keep_alive)
+        body = _prepare_page(query_dsl, page_size, pit_id, search_after, keep_alive, fields)
+        response = await _guarded_async("search", lambda: client.search(body=body, filter_path=PAGE_FILTER_PATH, request_timeout=REQUEST_TIMEOUT))
+        page = _page_result(response, pit_id, body["size"])
+        if page["done"]:
+            await close_pit_async(page["pit_id"])
+            page["pit_id"] = None
+        return page
+    except Exception as e:
+        await close_pit_async(pit_id)
+        logger.error(f"Paged query failed: {e}")
+        return {"status": "error", "error": str(e)}
+
+async def iter_query_async(query_dsl, index_pattern="wazuh-alerts-*", chunk_size=1000, keep_alive=PIT_KEEP_ALIVE, max_hits=None, fields=None):
+    """Async generator twin of iter_query; the PIT is closed on aclose()/cancellation."""
+    pit_id = await open_pit_async(index_pattern, keep_alive)
+    search_after = None
+    seen = 0
+    try:
+        client = get_async_client()
+        while True:
+            size = chunk_size if max_hits is None else min(chunk_size, max_hits - seen)
+            if size <= 0:
+                return
+            body = _prepare_page(query_dsl, size, pit_id, search_after, keep_alive, fields)
+            response = await _guarded_async("search", lambda: client.search(body=body, filter_path=PAGE_FILTER_PATH, request_timeout=REQUEST_TIMEOUT))
+            page = _page_result(response, pit_id, body["size"])
+            pit_id, search_after = page["pit_id"], page["search_after"]
+            if page["data"]:
+                seen += len(page["data"])
+                yield page["data"]
+            if page["done"]:
+                return
+    finally:
+        # Shielded so a cancelled consumer (e.g. a disconnected HTTP client) still frees the PIT
+        await asyncio.shield(close_pit_async(pit_id))
+
+# --- Cost estimation primitives (_count, index stats, profile) ---
+
+STATS_FILTER_PATH = ["_shards.total", "_all.primaries.docs.count", "_all.primaries.store.size_in_bytes"]
+PROFILE_FILTER_PATH = ["hits.total.value", "profile.shards.searches.query.time_in_nanos"]
+
+def count(query_dsl, index_pattern="wazuh-alerts-*"):
+    """Number of documents matching the "query" part of query_dsl (_count API)."""
+    if index_pattern not in ALLOWED_INDEXES:
+        raise ValueError("Index not allowed")
+    client = get_client()
+    dsl = _as_dsl(query_dsl)
+    body = {"query": dsl["query"]} if dsl.get("query") else {}
+    response = _guarded("count", lambda: client.count(index=index_pattern, body=body, request_timeout=REQUEST_TIMEOUT))
+    return int(response.get("count", 0))
+
+def index_stats(index_pattern="wazuh-alerts-*"):
+    """Primary doc count, primary store size and shard copies for the indexes behind a pattern."""
+    if index_pattern not in ALLOWED_INDEXES:
+        raise ValueError("Index not allowed")
+    client = get_client()
+    response = _guarded("stats", lambda: client.indices.stats(index=index_pattern, metric="docs,store", filter_path=STATS_FILTER_PATH, request_timeout=REQUEST_TIMEOUT))
+    primaries = response.get("_all", {}).get("primaries", {})
+    return {
+        "docs": int(primaries.get("docs", {}).get("count", 0)),
+        "store_bytes": int(primaries.get("store", {}).get("size_in_bytes", 0)),
+        "shards": int(response.get("_shards", {}).get("total", 0)),
+    }
+
+def profile_query(query_dsl, index_pattern="wazuh-alerts-*"):
+    """
+    Runs the query with profile: true and size 0. Returns total hits and the summed
+    query time across shards in nanoseconds. Callers should narrow the query first.
+    """
+    if index_pattern not in ALLOWED_INDEXES:
+        raise ValueError("Index not allowed")
+    client = get_client()
+    dsl = _as_dsl(query_dsl)
+    body = {"size": 0, "profile": True, "query": dsl.get("query", {"match_all": {}})}
+    response = _guarded("search", lambda: client.search(index=index_pattern, body=body, filter_path=PROFILE_FILTER_PATH, request_timeout=REQUEST_TIMEOUT))
+    nanos = sum(
+        q.get("time_in_nanos", 0)
+        for shard in response.get("profile", {}).get("shards", [])
+        for search in shard.get("searches", [])
+        for q in search.get("query", [])
+    )
+    return {"hits": response.get("hits", {}).get("total", {}).get("value", 0), "time_in_nanos": nanos}
+
+# --- Composite aggregation streaming (after_key paging) ---
+
+COMPOSITE_NAME = "stream"
+COMPOSITE_FILTER_PATH = [f"aggregations.{COMPOSITE_NAME}.after_key", f"aggregations.{COMPOSITE_NAME}.buckets"]
+
+def _prepare_composite(sources, query_dsl, sub_aggs, page_size, after_key):
+    composite = {"size": min(int(page_size), PIT_PAGE_SIZE_MAX), "sources": sources}
+    if after_key:
+        composite["after"] = after_key
+    agg = {"composite": composite}
+    if sub_aggs:
+        agg["aggs"] = sub_aggs
+    body = {"size": 0, "aggs": {COMPOSITE_NAME: agg}}
+    if query_dsl:
+        q = _as_dsl(query_dsl)
+        body["query"] = q.get("query", q)
+    return body
+
+def _composite_page(response):
+    agg = response.get("aggregations", {}).get(COMPOSITE_NAME, {})
+    return agg.get("buckets", []), agg.get("after_key")
+
+def iter_composite(sources, index_pattern="wazuh-alerts-*", query_dsl=None, sub_aggs=None, page_size=1000):
+    """
+    Yields every bucket of a composite aggregation, one page (at most page_size buckets)
+    at a time, following after_key. Memory is bounded by the page size, not the cardinality.
+    `sources` is the composite "sources" list, e.g. [{"agent": {"terms": {"field": "agent.name"}}}].
+    """
+    _prepare_aggregation({}, index_pattern)
+    client = get_client()
+    after_key = None
+    while True:
+        body = _prepare_composite(sources, query_dsl, sub_aggs, page_size, after_key)
+        response = _guarded("search", lambda: client.search(index=index_pattern, body=body, filter_path=COMPOSITE_FILTER_PATH, request_timeout=REQUEST_TIMEOUT))
+        buckets, after_key = _composite_page(response)
+        if buckets:
+            yield buckets
+        if not buckets or after_key is None:
+            return
+
+async def iter_composite_async(sources, index_pattern="wazuh-alerts-*", query_dsl=None, sub_aggs=None, page_size=1000):
+    """Async generator twin of iter_composite."""
+    _prepare_aggregation({}, index_pattern)
+    client = get_async_client()
+    after_key = None
+    while True:
+        body = _prepare_composite(sources, query_dsl, sub_aggs, page_size, after_key)
+        response = await _guarded_async("search", lambda: client.search(index=index_pattern, body=body, filter_path=COMPOSITE_FILTER_PATH, request_timeout=REQUEST_TIMEOUT))
+        buckets, after_key = _composite_page(response)
+        if buckets:
+            yield buckets
+        if not buckets or after_key is None:
+            return
+
 if __name__ == "__main__":
     # Test connection
     client = get_client()
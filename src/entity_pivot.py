@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+import elastic_connector
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PIVOT_WINDOW_HOURS = int(os.getenv("PIVOT_WINDOW_HOURS", "24"))
+# Most frequent values pivoted on per entity kind
+PIVOT_MAX_VALUES = int(os.getenv("PIVOT_MAX_VALUES", "3"))
+PIVOT_TOP_RULES = 3
+
+# Entity kind -> candidate fields in preference order (first one in the mapping wins)
+ENTITY_FIELDS = {
+    "srcip": ("data.srcip", "source.ip"),
+    "user": ("data.srcuser", "user.name", "data.dstuser"),
+    "agent": ("agent.name",),
+    "hash": ("syscheck.sha256_after", "syscheck.sha1_after", "syscheck.md5_after", "file.hash.sha256", "data.virustotal.source.sha1"),
+}
+RULE_FIELDS = ("rule.description", "rule.id")
+
+_stats = {"investigations": 0, "searches": 0, "entities": 0, "summary_chars": 0, "raw_chars": 0}
+_stats_lock = threading.Lock()
+
+def _value(doc, path):
+    """Dotted lookup that accepts both nested _source and flattened keys."""
+    if path in doc:
+        return doc[path]
+    cur = doc
+    for part in path.split("."):
+        if not isinstance(cur, dict) or part not in cur:
+            return None
+        cur = cur[part]
+    return cur
+
+def _field(kind, types, hits):
+    candidates = ENTITY_FIELDS[kind]
+    if types:
+        return next((f for f in candidates if f in types), None)
+    return next((f for f in candidates if any(_value(h, f) is not None for h in hits)), None)
+
+def with_entity_fields(fields, types=None):
+    """
+    A _source projection extended with every candidate entity field the mapping has, so hits
+    that are pivoted on still carry hashes and ECS user/source fields the display projection drops.
+    """
+    extra = [f for candidates in ENTITY_FIELDS.values() for f in candidates if (not types or f in types) and f not in fields]
+    return list(fields) + extra
+
+def extract_entities(hits, types=None, max_values=PIVOT_MAX_VALUES):
+    """{kind: (field, [most frequent values])} for the entity kinds present in hits."""
+    entities = {}
+    for kind in ENTITY_FIELDS:
+        field = _field(kind, types, hits)
+        if field is None:
+            continue
+        counts = Counter()
+        for h in hits:
+            v = _value(h, field)
+            for item in (v if isinstance(v, list) else [v]):
+                if item not in (None, "", "-"):
+                    counts[str(item)] += 1
+        if counts:
+            entities[kind] = (field, [v for v, _ in counts.most_common(max_values)])
+    return entities
+
+def pivot_aggregation(field, values, types, window_hours, spread_fields):
+    """Size-0 search: per value, how much related activity there is, where and which rules fired."""
+    rule_field = next((f for f in RULE_FIELDS if (types or {}).get(f) == "keyword"), "rule.id")
+    per_value = {
+        "first_seen": {"min": {"field": "@timestamp"}},
+        "last_seen": {"max": {"field": "@timestamp"}},
+        "max_level": {"max": {"field": "rule.level"}},
+        "top_rules": {"terms": {"field": rule_field, "size": PIVOT_TOP_RULES}},
+    }
+    for kind, f in spread_fields.items():
+        per_value[f"distinct_{kind}"] = {"cardinality": {"field": f}}
+    return {
+        "size": 0,
+        "query": {"bool": {"filter": [
+            {"terms": {field: values}},
+            {"range": {"@timestamp": {"gte": f"now-{window_hours}h"}}},
+        ]}},
+        "aggs": {"by_value": {"terms": {"field": field, "size": len(values)}, "aggs": per_value}},
+    }
+
+def _when(metric):
+    if not metric or metric.get("value") is None:
+        return None
+    if metric.get("value_as_string"):
+        return metric["value_as_string"]
+    return datetime.fromtimestamp(metric["value"] / 1000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _summarize(kind, field, aggs):
+    rows = []
+    for b in (aggs or {}).get("by_value", {}).get("buckets", []):
+        row = {
+            "kind": kind, "field": field, "value": b.get("key"), "events": b.get("doc_count", 0),
+            "first_seen": _when(b.get("first_seen")), "last_seen": _when(b.get("last_seen")),
+            "max_level": (b.get("max_level") or {}).get("value"),
+            "top_rules": [(r.get("key"), r.get("doc_count", 0)) for r in (b.get("top_rules") or {}).get("buckets", [])],
+        }
+        for k, v in b.items():
+            if k.startswith("distinct_"):
+                row[k] = v.get("value", 0)
+        rows.append(row)
+    return rows
+
+def investigate(hits, types=None, index_pattern="wazuh-alerts-*", window_hours=PIVOT_WINDOW_HOURS):
+    """
+    Pivots on the entities in hits with one related-event search per entity kind, all sent
+    as a single _msearch. Returns {"entities", "pivots", "searches", "took_ms"}.
+    """
+    t0 = time.perf_counter()
+    entities = extract_entities(hits, types)
+    spread = {k: f for k, (f, _) in entities.items() if k in ("srcip", "user", "agent")}
+    pivots = []
+    if entities:
+        with elastic_connector.batch() as b:
+            handles = [
+                (kind, field, b.aggregation(pivot_aggregation(field, values, types, window_hours, {k: f for k, f in spread.items() if k != kind}), index_pattern))
+                for kind, (field, values) in entities.items()
+            ]
+        for kind, field, handle in handles:
+            try:
+                pivots.extend(_summarize(kind, field, handle.result()))
+            except Exception as e:
+                logger.warning(f"Pivot on {kind} failed: {e}")
+        # Rule ids mean little to the LLM; label them with descriptions seen in the hits
+        described = {str(_value(h, "rule.id")): _value(h, "rule.description") for h in hits if _value(h, "rule.description")}
+        for p in pivots:
+            p["top_rules"] = [(f"{r} {described[str(r)]}" if str(r) in described else r, n) for r, n in p["top_rules"]]
+    with _stats_lock:
+        _stats["investigations"] += 1
+        _stats["searches"] += len(entities)
+        _stats["entities"] += sum(len(v) for _, v in entities.values())
+    return {"entities": {k: v for k, (_, v) in entities.items()}, "pivots": pivots, "searches": len(entities),
+            "took_ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+def render(summary):
+    """One compact line per pivoted entity, for the LLM prompt."""
+    lines = []
+    for p in summary["pivots"]:
+        spread = ", ".join(f"{v} distinct {k[len('distinct_'):]}" for k, v in p.items() if k.startswith("distinct_") and v)
+        rules = "; ".join(f"{r} ({n})" for r, n in p["top_rules"])
+        level = f", max level {int(p['max_level'])}" if p["max_level"] is not None else ""
+        lines.append(f"- {p['kind']} {p['value']}: {p['events']} events {p['first_seen']} -> {p['last_seen']}{level}"
+                     f"{'; ' + spread if spread else ''}{'; top rules: ' + rules if rules else ''}")
+    return "\n".join(lines)
+
+def record_prompt(summary_text, raw_text):
+    """Tracks how much smaller the pivot summary is than the raw hits it replaces."""
+    with _stats_lock:
+        _stats["summary_chars"] += len(summary_text)
+        _stats["raw_chars"] += len(raw_text)
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["prompt_chars_saved"] = max(stats["raw_chars"] - stats["summary_chars"], 0)
+    return stats
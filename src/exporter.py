@@ -0,0 +1,127 @@
+"""
+Row encoders for streamed exports: NDJSON or CSV, optionally gzip-compressed.
+Each encoder turns one chunk of documents into bytes, so nothing larger than a chunk is buffered.
+"""
+import io
+import csv
+import zlib
+import orjson
+from contextlib import aclosing
+import elastic_connector
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+# Spreadsheet apps evaluate cells starting with these; prefix them so exported log data stays inert
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def flatten(doc, parent="", out=None):
+    """{"rule": {"level": 5}} -> {"rule.level": 5}; lists are kept as values."""
+    out = {} if out is None else out
+    for k, v in doc.items():
+        key = f"{parent}.{k}" if parent else k
+        if isinstance(v, dict):
+            flatten(v, key, out)
+        else:
+            out[key] = v
+    return out
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        value = ";".join("" if v is None else (orjson.dumps(v).decode() if isinstance(v, (dict, list)) else str(v)) for v in value)
+    elif isinstance(value, bool):
+        value = "true" if value else "false"
+    elif not isinstance(value, str):
+        return value
+    if value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+class NdjsonEncoder:
+    def __init__(self, flat=False):
+        self.flat = flat
+
+    def encode(self, docs):
+        return b"".join(orjson.dumps(flatten(d) if self.flat else d) + b"\n" for d in docs)
+
+    def finish(self):
+        return b""
+
+class CsvEncoder:
+    """
+    Columns are `columns` when given, else the flattened keys seen in the first chunk.
+    Keys that first appear in later chunks are dropped so the header never changes mid-stream.
+    """
+    def __init__(self, columns=None):
+        self.columns = list(columns) if columns else None
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf, lineterminator="\n")
+        self._header_written = False
+
+    def encode(self, docs):
+        rows = [flatten(d) for d in docs]
+        if self.columns is None:
+            seen = {}
+            for row in rows:
+                for k in row:
+                    seen.setdefault(k, None)
+            self.columns = list(seen)
+        if not self._header_written and self.columns:
+            self._writer.writerow(self.columns)
+            self._header_written = True
+        for row in rows:
+            self._writer.writerow([_cell(row.get(c)) for c in self.columns])
+        data = self._buf.getvalue().encode("utf-8")
+        self._buf.seek(0)
+        self._buf.truncate()
+        return data
+
+    def finish(self):
+        return b""
+
+class GzipEncoder:
+    """Wraps another encoder; every chunk is sync-flushed so the client can decompress as it arrives."""
+    def __init__(self, inner, level=6):
+        self.inner = inner
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def encode(self, docs):
+        return self._z.compress(self.inner.encode(docs)) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._z.compress(self.inner.finish()) + self._z.flush(zlib.Z_FINISH)
+
+def make_encoder(fmt="ndjson", gzip=False, columns=None, flat=False):
+    """Returns (encoder, media_type, file extension)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    encoder = CsvEncoder(columns) if fmt == "csv" else NdjsonEncoder(flat=flat)
+    media_type, ext = FORMATS[fmt]
+    if gzip:
+        return GzipEncoder(encoder), "application/gzip", f"{ext}.gz"
+    return encoder, media_type, ext
+
+async def stream_export(query_dsl, index_pattern, encoder, chunk_size=1000, max_rows=None, fields=None, is_disconnected=None, stats=None):
+    """
+    Yields encoded bytes one PIT page at a time. The next page is only requested once the
+    previous chunk has been consumed, so a slow client throttles the cluster reads.
+    The PIT is closed when the stream ends, is closed early, or the client disconnects.
+    """
+    stats = {} if stats is None else stats
+    stats.setdefault("rows", 0)
+    pages = elastic_connector.iter_query_async(query_dsl, index_pattern=index_pattern, chunk_size=chunk_size, max_hits=max_rows, fields=fields)
+    async with aclosing(pages):
+        async for chunk in pages:
+            if is_disconnected is not None and await is_disconnected():
+                stats["disconnected"] = True
+                return
+            stats["rows"] += len(chunk)
+            data = encoder.encode(chunk)
+            if data:
+                yield data
+    tail = encoder.finish()
+    if tail:
+        yield tail
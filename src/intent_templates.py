@@ -0,0 +1,304 @@
+import os
+import re
+import math
+import logging
+import threading
+from nl_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "true").lower() == "true"
+# Share of the question's words a template must account for before the LLM is skipped
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.9"))
+# Have the LLM write the narrative for a template hit in the background, after the results are returned
+INTENT_LLM_NARRATIVE = os.getenv("INTENT_LLM_NARRATIVE", "false").lower() == "true"
+DEFAULT_WINDOW = "24h"
+
+IP_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
+PORT_RE = re.compile(r"\bport\s+(\d{1,5})\b")
+USER_RE = re.compile(r"\b(?:user|account|username)\s+([a-z0-9_.$\\-]+)")
+AGENT_RE = re.compile(r"\b(?:agent|host|server|machine)\s+([a-z0-9_.\-]+)")
+LEVEL_RE = re.compile(r"\blevel\s*(?:>=|>|of|above|over)?\s*(\d{1,2})\+?")
+# normalize_prompt has already turned "24 hours" into "24h"
+SPAN_RE = re.compile(r"^(\d+)([mhdw])$")
+SPAN_WORDS = {"hour": "1h", "day": "1d", "week": "1w", "month": "30d", "yesterday": "48h"}
+UNIT_HOURS = {"m": 1 / 60, "h": 1, "d": 24, "w": 168}
+
+# Words every template may leave unexplained without lowering confidence
+NEUTRAL_WORDS = {
+    "alert", "event", "log", "entry", "entrie", "record", "activity", "happened", "occurred", "seen", "detected",
+    "connection", "session", "attempt", "access", "accessed", "by", "at", "and", "or", "who", "what", "when", "where",
+    "how", "many", "count", "top", "latest", "new", "our", "my", "there", "have", "has", "been", "did", "do", "ip",
+    "address", "source", "src", "user", "account", "agent", "host", "server", "machine", "port", "level", "severity",
+    "this", "it", "now", "time", "window", "period", "since", "within", "hour", "day", "week", "month", "yesterday",
+    "involving", "about", "happening",
+}
+# The word before an IP says which side of the connection it is; with neither, the template is not trusted
+SOURCE_WORDS = {"from", "by", "source", "src", "originating"}
+DESTINATION_WORDS = {"to", "against", "targeting", "into", "toward", "towards", "destination", "dst"}
+PRECEDING_WORD_RE = re.compile(r"\b([a-z]+)\s+(?:(?:the|ip|address|host)\s+)*$")
+
+# Each template: trigger words (all groups must match), extra words it explains, field candidates
+# in preference order (first one present in the mapping wins), and the canned narrative.
+TEMPLATES = [
+    {
+        "name": "failed_logins",
+        "requires": [{"failed", "failure", "fail", "unsuccessful", "bad", "invalid"}, {"login", "logon", "authentication", "auth", "sign-in", "signin", "password"}],
+        "explains": {"wrong", "credential"},
+        "match": [("event.action", "logon-failure"), ("rule.groups", "authentication_failed")],
+        "severity": "medium",
+        "mitre": [{"id": "T1110", "name": "Brute Force", "description": "Adversaries may use brute force techniques to gain access to accounts when passwords are unknown."}],
+        "analysis": "Failed authentication attempts{scope} in the last {window}. Repeated failures from one source or against one account indicate password guessing.",
+        "remediation": "Lock out or rate-limit the targeted accounts and block sources with repeated failures.",
+    },
+    {
+        "name": "brute_force",
+        "requires": [{"brute", "bruteforce", "brute-force", "spraying", "spray"}],
+        "explains": {"force", "password", "ssh", "login", "logon"},
+        "match": [("rule.groups", "authentication_failures"), ("event.action", "logon-failure")],
+        "severity": "high",
+        "mitre": [{"id": "T1110", "name": "Brute Force", "description": "Adversaries may use brute force techniques to gain access to accounts when passwords are unknown."}],
+        "analysis": "Brute-force detections{scope} in the last {window}: many authentication failures in a short period from the same source.",
+        "remediation": "Block the offending source IPs at the firewall and enforce account lockout and MFA.",
+    },
+    {
+        "name": "successful_logins",
+        "requires": [{"successful", "success", "succeeded"}, {"login", "logon", "authentication", "auth", "sign-in", "signin"}],
+        "explains": set(),
+        "match": [("event.action", "logon-success"), ("rule.groups", "authentication_success")],
+        "severity": "low",
+        "mitre": [{"id": "T1078", "name": "Valid Accounts", "description": "Adversaries may obtain and abuse credentials of existing accounts."}],
+        "analysis": "Successful logins{scope} in the last {window}. Review logins following failures or from unusual sources.",
+        "remediation": None,
+    },
+    {
+        "name": "rdp",
+        "requires": [{"rdp", "remote-desktop", "3389"}],
+        "explains": {"remote", "desktop", "inbound", "external"},
+        "match": [("destination.port", 3389), ("data.dstport", 3389)],
+        "severity": "medium",
+        "mitre": [{"id": "T1021", "name": "Remote Services", "description": "Adversaries may use valid accounts to log into a service that accepts remote connections, such as RDP."}],
+        "analysis": "RDP (port 3389) activity{scope} in the last {window}. Exposed or unexpected RDP is a common lateral movement and initial access path.",
+        "remediation": "Restrict RDP to a VPN or jump host and require NLA and MFA.",
+    },
+    {
+        "name": "ssh",
+        "requires": [{"ssh", "sshd"}],
+        "explains": {"inbound"},
+        "match": [("destination.port", 22), ("data.dstport", 22)],
+        "severity": "low",
+        "mitre": [{"id": "T1021", "name": "Remote Services", "description": "Adversaries may use valid accounts to log into a service that accepts remote connections, such as SSH."}],
+        "analysis": "SSH (port 22) activity{scope} in the last {window}.",
+        "remediation": None,
+    },
+    {
+        "name": "shadow_access",
+        "requires": [{"/etc/shadow", "shadow"}],
+        "explains": {"file", "read", "modified", "change", "changed", "touched", "opened", "etc"},
+        "match": [("file.path", "/etc/shadow"), ("syscheck.path", "/etc/shadow")],
+        "severity": "high",
+        "mitre": [{"id": "T1003.008", "name": "OS Credential Dumping: /etc/passwd and /etc/shadow", "description": "Adversaries may dump /etc/shadow to crack password hashes offline."}],
+        "analysis": "Access to /etc/shadow{scope} in the last {window}. Reads or changes outside package updates suggest credential dumping.",
+        "remediation": "Verify the change against patching activity; if unexplained, rotate local passwords and investigate the host.",
+    },
+    {
+        "name": "malware",
+        "requires": [{"malware", "virus", "malicious", "trojan", "ransomware"}],
+        "explains": {"file", "detection", "detected", "found", "virustotal"},
+        "match": [("rule.groups", "virustotal"), ("event.action", "malware-detected")],
+        "severity": "high",
+        "mitre": [{"id": "T1204", "name": "User Execution", "description": "An adversary may rely upon a user opening a malicious file in order to gain execution."}],
+        "analysis": "Malware detections{scope} in the last {window}.",
+        "remediation": "Quarantine the affected files and isolate the hosts until they are cleaned.",
+    },
+    {
+        "name": "privilege_escalation",
+        "requires": [{"privilege", "privesc", "suid", "escalation"}],
+        "explains": {"escalation", "root"},
+        "match": [("rule.groups", "privilege_escalation"), ("event.action", "privilege-escalation")],
+        "severity": "critical",
+        "mitre": [{"id": "T1548", "name": "Abuse Elevation Control Mechanism", "description": "Adversaries may circumvent mechanisms designed to control elevated privileges."}],
+        "analysis": "Privilege escalation detections{scope} in the last {window}.",
+        "remediation": "Isolate the host, review the SUID binaries and audit recent sudoers changes.",
+    },
+    {
+        "name": "high_severity",
+        "requires": [{"high", "critical", "severe", "level"}],
+        "explains": {"severity", "priority", "important"},
+        "match": [],
+        "severity": "high",
+        "mitre": [],
+        "analysis": "High severity alerts{scope} in the last {window}.",
+        "remediation": None,
+    },
+]
+
+ENTITY_FIELDS = {
+    "srcip": ["data.srcip", "source.ip"],
+    "dstip": ["data.dstip", "destination.ip"],
+    "user": ["data.srcuser", "user.name", "data.dstuser"],
+    "agent": ["agent.name"],
+    "port": ["data.dstport", "destination.port"],
+}
+
+def _normalized(words):
+    """Vocabulary in the same form normalize_prompt gives the question ("this" -> "thi", "logins" -> "login")."""
+    return {normalize_prompt(w) or w for w in words}
+
+NEUTRAL_WORDS = _normalized(NEUTRAL_WORDS)
+for _t in TEMPLATES:
+    _t["requires"] = [_normalized(g) for g in _t["requires"]]
+    _t["vocab"] = set().union(*_t["requires"]) | _normalized(_t["explains"])
+
+SCOPE_LABELS = {"srcip": "from {}", "dstip": "to {}", "user": "for user {}", "agent": "on agent {}", "port": "on port {}"}
+
+_stats = {"matches": 0, "low_confidence": 0, "no_match": 0}
+_stats_lock = threading.Lock()
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+def _window(words, max_days):
+    """Lookback from "24h"/"7d" tokens (or "day"/"week" words) in the normalized prompt, capped at max_days."""
+    hours, used = None, set()
+    for w in words:
+        m = SPAN_RE.match(w)
+        if m:
+            hours = int(m.group(1)) * UNIT_HOURS[m.group(2)]
+            used.add(w)
+        elif w in SPAN_WORDS and hours is None:
+            m = SPAN_RE.match(SPAN_WORDS[w])
+            hours = int(m.group(1)) * UNIT_HOURS[m.group(2)]
+            used.add(w)
+    hours = hours or int(DEFAULT_WINDOW[:-1])
+    if max_days is not None:
+        hours = min(hours, max_days * 24)
+    # Round up: "90 minutes" must not become now-1h (the validator only reads d/h units)
+    hours = max(math.ceil(round(hours, 6)), 1)
+    return (f"{hours // 24}d" if hours % 24 == 0 else f"{hours}h"), used
+
+def _preceding_word(text, start):
+    m = PRECEDING_WORD_RE.search(text[:start])
+    return m.group(1) if m else None
+
+def _entities(text):
+    """
+    ({key: value}, direction words that introduced an entity, whether an IP's direction is unclear).
+    An IP goes to srcip or dstip by the word before it; an IP with neither, or a second IP on the
+    same side, leaves the direction unclear.
+    """
+    found, directions, unclear = {}, set(), False
+    for m in IP_RE.finditer(text):
+        word = _preceding_word(text, m.start())
+        key = "srcip" if word in SOURCE_WORDS else "dstip" if word in DESTINATION_WORDS else None
+        if key is None or key in found:
+            unclear = True
+            continue
+        found[key] = m.group(0)
+        directions.add(word)
+    for key, rx in (("port", PORT_RE), ("user", USER_RE), ("agent", AGENT_RE)):
+        m = rx.search(text)
+        if m:
+            found[key] = int(m.group(1)) if key == "port" else m.group(1)
+            word = _preceding_word(text, m.start())
+            if word in SOURCE_WORDS or word in DESTINATION_WORDS:
+                directions.add(word)
+    return found, _normalized(directions), unclear
+
+def _clause(field, value, types):
+    if types.get(field) == "text":
+        return {"match": {field: value}}
+    return {"term": {field: value}}
+
+def _first_field(candidates, types):
+    return next((f for f in candidates if f in types), None)
+
+def match(prompt, types, max_days=None):
+    """
+    Best template for prompt as {"template", "confidence", "response"} (response shaped like
+    the LLM's JSON), or None when nothing matches with INTENT_MIN_CONFIDENCE or the mapping
+    (`types`, as from validator.field_types) lacks the template's fields.
+    """
+    types = types or {}
+    text = str(prompt).lower()
+    normalized = normalize_prompt(text)
+    words = normalized.split()
+    if not words:
+        return None
+    entities, direction_words, unclear = _entities(text)
+    window, span_words = _window(words, max_days)
+    entity_words = {str(v).lower() for v in entities.values()} | direction_words
+    best = None
+    for t in TEMPLATES:
+        if not all(any(w in group or any(w.startswith(g) for g in group if len(g) > 4) for w in words) for group in t["requires"]):
+            continue
+        vocab = t["vocab"]
+        explained = [w for w in words if w in vocab or w in NEUTRAL_WORDS or w in span_words or w in entity_words
+                     or any(w.startswith(g) for g in vocab if len(g) > 4)]
+        confidence = len(explained) / len(words)
+        if best is None or confidence > best[1]:
+            best = (t, confidence)
+    if best is None:
+        _count("no_match")
+        return None
+    t, confidence = best
+    if unclear:
+        # "10.0.0.5" alone could be either data.srcip or data.dstip; let the LLM decide
+        confidence = min(confidence, INTENT_MIN_CONFIDENCE / 2)
+    template_port = next((v for f, v in t["match"] if f in ENTITY_FIELDS["port"]), None)
+    if template_port is not None and entities.get("port", template_port) != template_port:
+        # "ssh on port 2222": the template's port clause and narrative would be wrong
+        confidence = min(confidence, INTENT_MIN_CONFIDENCE / 2)
+    if confidence < INTENT_MIN_CONFIDENCE:
+        _count("low_confidence")
+        logger.debug(f"Intent {t['name']} matched with low confidence {confidence:.2f}")
+        return None
+    clauses = []
+    if t["match"]:
+        field_value = next(((f, v) for f, v in t["match"] if f in types), None)
+        if field_value is None:
+            _count("no_match")
+            return None
+        clauses.append(_clause(field_value[0], field_value[1], types))
+    if t["name"] == "high_severity":
+        if "rule.level" not in types:
+            _count("no_match")
+            return None
+        m = LEVEL_RE.search(text)
+        floor = int(m.group(1)) if m else (12 if "critical" in words else 10)
+        # The validator only allows range on @timestamp, so levels are listed
+        clauses.append({"terms": {"rule.level": list(range(floor, 16))}})
+    scope = []
+    for key, value in entities.items():
+        if key == "port" and value == template_port:
+            continue
+        field = _first_field(ENTITY_FIELDS[key], types)
+        if field is None:
+            _count("no_match")
+            return None
+        clauses.append(_clause(field, value, types))
+        scope.append(SCOPE_LABELS[key].format(value))
+    clauses.append({"range": {"@timestamp": {"gte": f"now-{window}"}}})
+    _count("matches")
+    response = {
+        "query": {"query": {"bool": {"must": clauses}}, "sort": [{"@timestamp": {"order": "desc"}}]},
+        "analysis": t["analysis"].format(scope=(" " + ", ".join(scope)) if scope else "", window=window),
+        "story": None,
+        "mitre": t["mitre"],
+        "remediation": t["remediation"],
+        "severity": t["severity"],
+        "confidence": int(round(confidence * 100)),
+        "confidence_reason": f"Matched the '{t['name']}' hunt template; no LLM was used.",
+    }
+    return {"template": t["name"], "confidence": round(confidence, 2), "response": response}
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    total = sum(stats.values())
+    stats["hit_rate"] = round(stats["matches"] / total, 3) if total else 0.0
+    # Every template match is one LLM translation not made
+    stats["llm_calls_saved"] = stats["matches"]
+    return stats
@@ -0,0 +1,197 @@
+import os
+import time
+import json
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# "gemini" talks to Google; "fake" is an offline stand-in for load tests and local development
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+LLM_MODELS = [m.strip() for m in os.getenv(
+    "LLM_MODELS",
+    "gemini-1.5-flash,gemini-1.5-flash-latest,gemini-1.5-pro,gemini-1.0-pro,gemini-pro,gemini-2.0-flash,gemini-2.0-flash-exp"
+).split(",") if m.strip()]
+# Re-check the preferred models in the background so we move back to them when they recover
+LLM_PROBE_INTERVAL_SECONDS = int(os.getenv("LLM_PROBE_INTERVAL_SECONDS", "600"))
+# "rest" keeps one pooled HTTPS session per client; "grpc" keeps one long-lived channel
+LLM_TRANSPORT = os.getenv("LLM_TRANSPORT", "") or None
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_FAKE_LATENCY_MS = int(os.getenv("LLM_FAKE_LATENCY_MS", "0"))
+# Simulated client construction cost, so the saving from reuse can be measured offline
+LLM_FAKE_SETUP_MS = int(os.getenv("LLM_FAKE_SETUP_MS", "0"))
+
+FAKE_RESPONSE = {
+    "query": {
+        "size": 10,
+        "query": {"bool": {"must": [{"range": {"@timestamp": {"gte": "now-24h"}}}]}},
+        "sort": [{"@timestamp": {"order": "desc"}}]
+    },
+    "analysis": "Offline LLM backend: recent alerts are returned without model analysis.",
+    "story": None,
+    "mitre": [],
+    "remediation": None,
+    "severity": "low",
+    "confidence": 50,
+    "confidence_reason": "Generated by the fake LLM backend."
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+_active_model = None
+_probe_lock = threading.Lock()
+_stats = {"clients_created": 0, "client_reuses": 0, "setup_ms_total": 0.0, "probes": 0, "last_probe": None, "probe_errors": {}}
+_reprobe_task = None
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+class FakeChatModel:
+    """Offline chat model with the invoke/stream/ainvoke surface agent_logic uses."""
+    def __init__(self, model, latency_ms=None, response=None):
+        self.model = model
+        self.latency_ms = LLM_FAKE_LATENCY_MS if latency_ms is None else latency_ms
+        self.response = response or os.getenv("LLM_FAKE_RESPONSE") or json.dumps(FAKE_RESPONSE)
+        self.calls = 0
+        if LLM_FAKE_SETUP_MS:
+            time.sleep(LLM_FAKE_SETUP_MS / 1000)
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return FakeResponse(self.response)
+
+    def stream(self, messages, chunk_chars=24, **kwargs):
+        """Yields the response in small pieces, spreading the latency across them like a real stream."""
+        self.calls += 1
+        pieces = [self.response[i:i + chunk_chars] for i in range(0, len(self.response), chunk_chars)] or [""]
+        for piece in pieces:
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000 / len(pieces))
+            yield FakeResponse(piece)
+
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return FakeResponse(self.response)
+
+    async def astream(self, messages, chunk_chars=24, **kwargs):
+        self.calls += 1
+        pieces = [self.response[i:i + chunk_chars] for i in range(0, len(self.response), chunk_chars)] or [""]
+        for piece in pieces:
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000 / len(pieces))
+            yield FakeResponse(piece)
+
+def _build(model_name):
+    if LLM_BACKEND == "fake":
+        return FakeChatModel(model_name)
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set.")
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    kwargs = {"model": model_name, "temperature": 0, "google_api_key": api_key, "max_retries": 1, "timeout": LLM_TIMEOUT_SECONDS}
+    if LLM_TRANSPORT:
+        kwargs["transport"] = LLM_TRANSPORT
+    return ChatGoogleGenerativeAI(**kwargs)
+
+def get_client(model_name):
+    """
+    Returns the process-wide chat client for model_name, creating it on first use.
+    Clients are thread-safe and keep their HTTP/gRPC connections open between calls.
+    """
+    client = _clients.get(model_name)
+    if client is not None:
+        _stats["client_reuses"] += 1
+        return client
+    with _clients_lock:
+        client = _clients.get(model_name)
+        if client is not None:
+            _stats["client_reuses"] += 1
+            return client
+        started = time.perf_counter()
+        client = _build(model_name)
+        setup_ms = (time.perf_counter() - started) * 1000
+        _stats["clients_created"] += 1
+        _stats["setup_ms_total"] += setup_ms
+        _clients[model_name] = client
+        logger.info(f"Created {LLM_BACKEND} chat client for {model_name} in {setup_ms:.1f}ms")
+        return client
+
+def probe(models=None):
+    """
+    Finds the first model in preference order that answers a one-word prompt and makes it
+    the active model. Constructing a client does not check the model exists, so this calls it.
+    """
+    global _active_model
+    with _probe_lock:
+        errors = {}
+        for model_name in models or LLM_MODELS:
+            try:
+                get_client(model_name).invoke("ping")
+            except Exception as e:
+                logger.warning(f"LLM model {model_name} unavailable: {e}")
+                errors[model_name] = str(e)
+                continue
+            if model_name != _active_model:
+                logger.info(f"Active LLM model: {model_name}")
+            _active_model = model_name
+            break
+        _stats["probes"] += 1
+        _stats["last_probe"] = int(time.time())
+        _stats["probe_errors"] = errors
+        if len(errors) == len(models or LLM_MODELS):
+            raise ValueError(f"Could not initialize any Gemini model: {errors}")
+        return _active_model
+
+def get_llm():
+    """Chat client for the active model; probes once if no model has been resolved yet."""
+    model_name = _active_model or probe()
+    return get_client(model_name)
+
+def mark_failed(model_name=None):
+    """Forget the active model (e.g. after it starts returning NOT_FOUND) so the next call re-probes."""
+    global _active_model
+    if model_name is None or model_name == _active_model:
+        _active_model = None
+
+async def _reprobe_loop():
+    """Warm-up probe right away, then re-probes every LLM_PROBE_INTERVAL_SECONDS (if > 0)."""
+    while True:
+        try:
+            await asyncio.to_thread(probe)
+        except Exception as e:
+            logger.warning(f"Background LLM probe failed, requests will resolve the model lazily: {e}")
+        if LLM_PROBE_INTERVAL_SECONDS <= 0:
+            return
+        await asyncio.sleep(LLM_PROBE_INTERVAL_SECONDS)
+
+async def start():
+    """
+    Resolves the working model in the background so startup never waits on slow or
+    unreachable models; requests arriving first resolve it themselves via get_llm().
+    """
+    global _reprobe_task
+    if _reprobe_task is None:
+        _reprobe_task = asyncio.create_task(_reprobe_loop())
+
+async def stop():
+    global _reprobe_task
+    if _reprobe_task is not None:
+        _reprobe_task.cancel()
+        _reprobe_task = None
+
+def get_stats():
+    """Client reuse counters; `setup_ms_saved` is the construction time reuse avoided."""
+    stats = dict(_stats)
+    stats["backend"] = LLM_BACKEND
+    stats["active_model"] = _active_model
+    created = stats["clients_created"]
+    stats["avg_setup_ms"] = round(stats["setup_ms_total"] / created, 2) if created else 0.0
+    stats["setup_ms_saved"] = round(stats["avg_setup_ms"] * stats["client_reuses"], 1)
+    return stats
@@ -0,0 +1,1023 @@
+"""
+In-memory stand-in for Elasticsearch.
+
+Documents are held column by column (dictionary-encoded keywords, float/epoch-ms
+NumPy arrays for numbers and dates), and the DSL subset the validator allows is
+evaluated as vectorized boolean masks. LocalElasticsearch / AsyncLocalElasticsearch
+expose the slice of the elasticsearch-py client API that elastic_connector uses,
+so the connector can run against it with ELASTIC_BACKEND=local.
+"""
+import os
+import re
+import time
+import asyncio
+import bisect
+import itertools
+import threading
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+
+import alert_generator
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+LOCAL_INDEX_NAME = os.getenv("LOCAL_ES_INDEX", "wazuh-alerts-4.x-local")
+LOCAL_DOCS = int(os.getenv("LOCAL_ES_DOCS", "100000"))
+LOCAL_DAYS = int(os.getenv("LOCAL_ES_DAYS", "7"))
+LOCAL_SEED = int(os.getenv("LOCAL_ES_SEED", "42"))
+# Simulated network round trip added to every request, in milliseconds
+LOCAL_LATENCY_MS = float(os.getenv("LOCAL_ES_LATENCY_MS", "0"))
+
+NUMERIC_TYPES = ("integer", "long", "short", "byte", "float", "double", "half_float", "scaled_float")
+
+class LocalEngineError(Exception):
+    """Mirrors an Elasticsearch error response; status_code follows HTTP semantics."""
+    def __init__(self, reason, status_code=400, error_type="parsing_exception"):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.error_type = error_type
+
+    def to_response(self):
+        return {"error": {"type": self.error_type, "reason": str(self)}, "status": self.status_code}
+
+# --- Date math ---
+
+UNIT_MS = {"s": 1000, "m": 60_000, "h": 3_600_000, "H": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+DATE_OP_RE = re.compile(r"([+-])(\d+)([yMwdhHms])|/([yMwdhHms])")
+MONDAY_OFFSET_MS = 4 * 86_400_000  # 1970-01-05 was the first Monday after the epoch
+
+def now_ms():
+    return int(time.time() * 1000)
+
+def _parse_iso(s):
+    s = s.strip()
+    if re.fullmatch(r"-?\d+", s):
+        return int(s)
+    dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def _add_months(ms, months):
+    dt = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    y, m = divmod(dt.month - 1 + months, 12)
+    day = min(dt.day, 28)
+    return int(dt.replace(year=dt.year + y, month=m + 1, day=day).timestamp() * 1000)
+
+def _round(ms, unit, up):
+    if unit in ("M", "y"):
+        dt = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+        start = dt.replace(month=1 if unit == "y" else dt.month, day=1, hour=0, minute=0, second=0, microsecond=0)
+        lo = int(start.timestamp() * 1000)
+        return _add_months(lo, 12 if unit == "y" else 1) - 1 if up else lo
+    size = UNIT_MS[unit]
+    offset = MONDAY_OFFSET_MS if unit == "w" else 0
+    lo = (ms - offset) // size * size + offset
+    return lo + size - 1 if up else lo
+
+def parse_date(value, now=None, round_up=False):
+    """
+    Parses ISO-8601, epoch millis and date math ("now-24h", "now-7d/d",
+    "2026-02-10T08:00:00Z||+1h"). round_up applies ES rounding for gt/lte.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    s = str(value).strip()
+    if s.startswith("now"):
+        anchor, rest = (now if now is not None else now_ms()), s[3:]
+    elif "||" in s:
+        head, rest = s.split("||", 1)
+        anchor = _parse_iso(head)
+    else:
+        return _parse_iso(s)
+    pos = 0
+    for m in DATE_OP_RE.finditer(rest):
+        if m.start() != pos:
+            break
+        pos = m.end()
+        if m.group(4):
+            anchor = _round(anchor, m.group(4), round_up)
+            continue
+        n = int(m.group(2)) * (1 if m.group(1) == "+" else -1)
+        unit = m.group(3)
+        anchor = _add_months(anchor, n * (12 if unit == "y" else 1)) if unit in ("M", "y") else anchor + n * UNIT_MS[unit]
+    if pos != len(rest):
+        raise LocalEngineError(f"failed to parse date field [{s}]")
+    return anchor
+
+def format_date(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{int(ms) % 1000:03d}Z"
+
+INTERVAL_NAMES = {"second": "1s", "minute": "1m", "hour": "1h", "day": "1d", "week": "1w"}
+
+def parse_interval(value):
+    s = INTERVAL_NAMES.get(str(value), str(value))
+    m = re.fullmatch(r"(\d+)(ms|[smhdw])", s)
+    if not m:
+        raise LocalEngineError(f"unsupported interval [{value}]")
+    n, unit = int(m.group(1)), m.group(2)
+    return n if unit == "ms" else n * UNIT_MS[unit]
+
+TOKEN_RE = re.compile(r"[a-z0-9_]+")
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+def wildcard_regex(pattern, case_insensitive=False):
+    rx = re.escape(pattern).replace(r"\*", ".*").replace(r"\?", ".")
+    return re.compile(rx, re.IGNORECASE if case_insensitive else 0)
+
+# --- Columns ---
+
+class KeywordColumn:
+    """
+    Dictionary-encoded column: codes[i] indexes vocab, -1 means missing.
+    Multi-valued fields store a tuple per vocab entry. Text columns are keyword
+    columns that also match on analyzed tokens.
+    """
+    def __init__(self, ftype, vocab, codes, multi=False):
+        self.type = ftype
+        self.vocab = list(vocab)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.multi = multi
+        self._tokens = None
+        self._rank = None
+        self._elements = None
+
+    def _values_of(self, code):
+        v = self.vocab[code]
+        return v if self.multi else (v,)
+
+    def codes_where(self, pred):
+        return [c for c in range(len(self.vocab)) if any(pred(v) for v in self._values_of(c))]
+
+    def mask_for_codes(self, codes):
+        if not codes:
+            return np.zeros(len(self.codes), dtype=bool)
+        if len(codes) == 1:
+            return self.codes == codes[0]
+        return np.isin(self.codes, codes)
+
+    def token_sets(self):
+        if self._tokens is None:
+            self._tokens = [set(itertools.chain.from_iterable(tokenize(v) for v in self._values_of(c))) for c in range(len(self.vocab))]
+        return self._tokens
+
+    def exists(self):
+        return self.codes >= 0
+
+    def value(self, i):
+        c = self.codes[i]
+        if c < 0:
+            return None
+        v = self.vocab[c]
+        return list(v) if self.multi else v
+
+    def elements(self):
+        """Distinct element values and, per vocab code, the element ids it contains."""
+        if self._elements is None:
+            names = sorted({e for c in range(len(self.vocab)) for e in self._values_of(c)}, key=str)
+            pos = {e: i for i, e in enumerate(names)}
+            self._elements = (names, [[pos[e] for e in self._values_of(c)] for c in range(len(self.vocab))])
+        return self._elements
+
+    def sort_key(self):
+        # Rank of each code in lexicographic order, NaN for missing
+        if self._rank is None:
+            order = sorted(range(len(self.vocab)), key=lambda c: str(self.vocab[c]))
+            rank = np.empty(len(self.vocab), dtype=np.float64)
+            rank[order] = np.arange(len(order))
+            self._rank = rank
+        out = np.full(len(self.codes), np.nan)
+        present = self.codes >= 0
+        out[present] = self._rank[self.codes[present]]
+        return out
+
+    def sort_value_rank(self, value):
+        ranked = sorted(str(v) for v in self.vocab)
+        i = bisect.bisect_left(ranked, str(value))
+        return float(i) if i < len(ranked) and ranked[i] == str(value) else i - 0.5
+
+class NumericColumn:
+    """Numbers as float64 (NaN = missing); dates as epoch millis in the same layout."""
+    def __init__(self, ftype, values):
+        self.type = ftype
+        self.values = np.asarray(values, dtype=np.float64)
+
+    def exists(self):
+        return ~np.isnan(self.values)
+
+    def value(self, i):
+        v = self.values[i]
+        if np.isnan(v):
+            return None
+        if self.type == "date":
+            return format_date(int(v))
+        return float(v) if self.type in ("float", "double", "half_float", "scaled_float") else int(v)
+
+    def sort_key(self):
+        return self.values
+
+    def parse(self, v, round_up=False, now=None):
+        if self.type == "date":
+            return float(parse_date(v, now=now, round_up=round_up))
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            raise LocalEngineError(f"failed to parse [{v}] as {self.type}")
+
+# --- Index ---
+
+def _set_path(doc, path, value):
+    cur = doc
+    for part in path[:-1]:
+        cur = cur.setdefault(part, {})
+    cur[path[-1]] = value
+
+def _flatten(doc, parent="", out=None):
+    out = {} if out is None else out
+    for k, v in doc.items():
+        key = f"{parent}.{k}" if parent else k
+        if isinstance(v, dict):
+            _flatten(v, key, out)
+        else:
+            out[key] = v
+    return out
+
+def _source_filter(spec):
+    """Returns a predicate over field names for a _source spec, or None for everything."""
+    if spec is None or spec is True:
+        return None
+    if spec is False:
+        return lambda f: False
+    includes, excludes = spec, []
+    if isinstance(spec, dict):
+        includes, excludes = spec.get("includes", spec.get("include", [])), spec.get("excludes", spec.get("exclude", []))
+    includes = [includes] if isinstance(includes, str) else list(includes or [])
+    excludes = [excludes] if isinstance(excludes, str) else list(excludes or [])
+    inc = [wildcard_regex(p) for p in includes]
+    exc = [wildcard_regex(p) for p in excludes]
+    def matches(rx_list, f):
+        parts = f.split(".")
+        return any(rx.fullmatch(".".join(parts[:n])) for rx in rx_list for n in range(1, len(parts) + 1))
+    return lambda f: (not inc or matches(inc, f)) and not matches(exc, f)
+
+class LocalIndex:
+    def __init__(self, name, columns, n_docs):
+        self.name = name
+        self.columns = columns
+        self.n_docs = n_docs
+        self.doc_ids = np.arange(n_docs, dtype=np.float64)
+        self._paths = {f: f.split(".") for f in columns}
+
+    @classmethod
+    def from_documents(cls, name, docs, types):
+        """Builds an index from dicts; `types` maps dotted field names to mapping types."""
+        flat = [_flatten(d) for d in docs]
+        n = len(flat)
+        columns = {}
+        for field, ftype in types.items():
+            raw = [d.get(field) for d in flat]
+            if ftype in NUMERIC_TYPES or ftype == "date":
+                vals = np.full(n, np.nan)
+                for i, v in enumerate(raw):
+                    if v is not None:
+                        vals[i] = parse_date(v) if ftype == "date" else float(v)
+                columns[field] = NumericColumn(ftype, vals)
+            else:
+                multi = any(isinstance(v, list) for v in raw)
+                vocab, lookup, codes = [], {}, np.full(n, -1, dtype=np.int32)
+                for i, v in enumerate(raw):
+                    if v is None:
+                        continue
+                    key = tuple(v) if isinstance(v, list) else ((v,) if multi else v)
+                    if key not in lookup:
+                        lookup[key] = len(vocab)
+                        vocab.append(key)
+                    codes[i] = lookup[key]
+                columns[field] = KeywordColumn(ftype, vocab, codes, multi=multi)
+        return cls(name, columns, n)
+
+    def mapping(self):
+        props = {}
+        for field, col in self.columns.items():
+            cur = props
+            parts = field.split(".")
+            for part in parts[:-1]:
+                cur = cur.setdefault(part, {"properties": {}})["properties"]
+            cur[parts[-1]] = {"type": col.type}
+        return {"mappings": {"properties": props}}
+
+    def column(self, field):
+        col = self.columns.get(field)
+        if col is None and field.endswith(".keyword"):
+            col = self.columns.get(field[:-len(".keyword")])
+        return col
+
+    def source(self, i, field_filter=None):
+        doc = {}
+        for field, col in self.columns.items():
+            if field_filter is not None and not field_filter(field):
+                continue
+            v = col.value(i)
+            if v is not None:
+                _set_path(doc, self._paths[field], v)
+        return doc
+
+# --- Query evaluation ---
+
+def _field_spec(body, value_key="value"):
+    if not isinstance(body, dict) or len(body) == 0:
+        raise LocalEngineError("query must name exactly one field")
+    field, spec = next(iter(body.items()))
+    if isinstance(spec, dict):
+        return field, spec.get(value_key, spec.get("query")), spec
+    return field, spec, {}
+
+class QueryEvaluator:
+    def __init__(self, index, now=None):
+        self.index = index
+        self.n = index.n_docs
+        self.now = now if now is not None else now_ms()
+
+    def _col(self, field):
+        col = self.index.column(field)
+        if col is None:
+            # Unmapped fields match nothing, like Elasticsearch
+            return None
+        return col
+
+    def evaluate(self, q):
+        if not q:
+            return np.ones(self.n, dtype=bool)
+        if not isinstance(q, dict) or len(q) != 1:
+            raise LocalEngineError("query malformed, expected a single query type")
+        kind, body = next(iter(q.items()))
+        handler = getattr(self, f"_q_{kind}", None)
+        if handler is None:
+            raise LocalEngineError(f"unknown or unsupported query [{kind}]")
+        return handler(body)
+
+    def _none(self):
+        return np.zeros(self.n, dtype=bool)
+
+    def _q_match_all(self, body):
+        return np.ones(self.n, dtype=bool)
+
+    def _q_match_none(self, body):
+        return self._none()
+
+    def _q_bool(self, body):
+        def clauses(key):
+            v = body.get(key, [])
+            return v if isinstance(v, list) else [v]
+        mask = np.ones(self.n, dtype=bool)
+        required = clauses("must") + clauses("filter")
+        for c in required:
+            mask &= self.evaluate(c)
+        should = clauses("should")
+        if should:
+            msm = body.get("minimum_should_match", 0 if required else 1)
+            msm = int(str(msm).rstrip("%")) if not isinstance(msm, int) else msm
+            if msm > 0:
+                hits = np.zeros(self.n, dtype=np.int32)
+                for c in should:
+                    hits += self.evaluate(c)
+                mask &= hits >= msm
+        for c in clauses("must_not"):
+            mask &= ~self.evaluate(c)
+        return mask
+
+    def _term_mask(self, col, value):
+        if col is None:
+            return self._none()
+        if isinstance(col, NumericColumn):
+            return col.values == col.parse(value, now=self.now)
+        if col.type == "text":
+            tok = str(value)
+            sets = col.token_sets()
+            return col.mask_for_codes([c for c in range(len(col.vocab)) if tok in sets[c]])
+        return col.mask_for_codes(col.codes_where(lambda v: str(v) == str(value)))
+
+    def _q_term(self, body):
+        field, value, _ = _field_spec(body)
+        return self._term_mask(self._col(field), value)
+
+    def _q_terms(self, body):
+        body = {k: v for k, v in body.items() if k != "boost"}
+        field, values, _ = _field_spec(body)
+        col = self._col(field)
+        mask = self._none()
+        for v in values or []:
+            mask |= self._term_mask(col, v)
+        return mask
+
+    def _q_match(self, body):
+        field, value, spec = _field_spec(body, "query")
+        col = self._col(field)
+        if col is None:
+            return self._none()
+        if isinstance(col, NumericColumn) or col.type != "text":
+            return self._term_mask(col, value)
+        tokens = set(tokenize(value))
+        if not tokens:
+            return self._none()
+        want_all = str(spec.get("operator", "or")).lower() == "and"
+        sets = col.token_sets()
+        codes = [c for c in range(len(col.vocab)) if (tokens <= sets[c] if want_all else tokens & sets[c])]
+        return col.mask_for_codes(codes)
+
+    def _q_match_phrase(self, body):
+        field, value, _ = _field_spec(body, "query")
+        col = self._col(field)
+        if col is None:
+            return self._none()
+        if isinstance(col, NumericColumn):
+            return self._term_mask(col, value)
+        phrase = " ".join(tokenize(value))
+        return col.mask_for_codes(col.codes_where(lambda v: phrase in " ".join(tokenize(v))))
+
+    def _q_wildcard(self, body):
+        field, value, spec = _field_spec(body)
+        value = spec.get("wildcard", value) if spec else value
+        col = self._col(field)
+        if col is None:
+            return self._none()
+        if isinstance(col, NumericColumn):
+            raise LocalEngineError(f"Can only use wildcard queries on keyword and text fields - not on [{field}] which is of type [{col.type}]")
+        if col.type == "text":
+            rx = wildcard_regex(str(value).lower())
+            sets = col.token_sets()
+            return col.mask_for_codes([c for c in range(len(col.vocab)) if any(rx.fullmatch(t) for t in sets[c])])
+        rx = wildcard_regex(str(value), bool(spec.get("case_insensitive")))
+        return col.mask_for_codes(col.codes_where(lambda v: rx.fullmatch(str(v)) is not None))
+
+    def _q_prefix(self, body):
+        field, value, _ = _field_spec(body)
+        return self._q_wildcard({field: str(value).replace("*", r"\*") + "*"})
+
+    def _q_exists(self, body):
+        col = self._col(body.get("field", ""))
+        return col.exists() if col is not None else self._none()
+
+    def _q_range(self, body):
+        field, _, spec = _field_spec(body)
+        col = self._col(field)
+        if col is None:
+            return self._none()
+        if not isinstance(col, NumericColumn):
+            raise LocalEngineError(f"range queries on [{col.type}] field [{field}] are not supported locally")
+        vals = col.values
+        mask = ~np.isnan(vals)
+        for op, v in spec.items():
+            if op == "gte":
+                mask &= vals >= col.parse(v, now=self.now)
+            elif op == "gt":
+                mask &= vals > col.parse(v, round_up=True, now=self.now)
+            elif op == "lte":
+                mask &= vals <= col.parse(v, round_up=True, now=self.now)
+            elif op == "lt":
+                mask &= vals < col.parse(v, now=self.now)
+            elif op not in ("format", "time_zone", "boost"):
+                raise LocalEngineError(f"unsupported range parameter [{op}]")
+        return mask
+
+    def _q_constant_score(self, body):
+        return self.evaluate(body.get("filter", {}))
+
+# --- Sorting ---
+
+def _sort_spec(sort):
+    items = sort if isinstance(sort, list) else [sort]
+    out = []
+    for it in items:
+        if isinstance(it, str):
+            out.append((it, "desc" if it == "_score" else "asc"))
+        elif isinstance(it, dict):
+            for f, cfg in it.items():
+                order = cfg.get("order", "asc") if isinstance(cfg, dict) else cfg
+                out.append((f, str(order).lower()))
+    return out
+
+def _sort_keys(index, spec, candidates):
+    """Ascending float keys per sort field (desc negated, missing last)."""
+    keys = []
+    for field, order in spec:
+        if field in ("_shard_doc", "_doc"):
+            raw = index.doc_ids[candidates]
+        elif field == "_score":
+            raw = np.zeros(len(candidates))
+        else:
+            col = index.column(field)
+            if col is None:
+                raise LocalEngineError(f"No mapping found for [{field}] in order to sort on")
+            raw = col.sort_key()[candidates]
+        k = raw if order == "asc" else -raw
+        keys.append(np.where(np.isnan(k), np.inf, k))
+    return keys
+
+def _sort_value(index, field, i):
+    if field in ("_shard_doc", "_doc"):
+        return int(i)
+    if field == "_score":
+        return None
+    col = index.column(field)
+    v = col.values[i] if isinstance(col, NumericColumn) else None
+    if isinstance(col, NumericColumn):
+        return None if np.isnan(v) else (int(v) if col.type in ("date", "integer", "long", "short", "byte") else float(v))
+    return col.value(i)
+
+def _after_key(index, field, order, value):
+    if field in ("_shard_doc", "_doc", "_score"):
+        k = float(value or 0)
+    else:
+        col = index.column(field)
+        if isinstance(col, NumericColumn):
+            k = col.parse(value)
+        else:
+            k = col.sort_value_rank(value)
+    return k if order == "asc" else -k
+
+def top_hits(index, mask, sort, start, size, search_after=None):
+    candidates = np.flatnonzero(mask)
+    spec = _sort_spec(sort) if sort else []
+    if not spec:
+        return candidates[start:start + size], spec
+    keys = _sort_keys(index, spec, candidates)
+    if search_after is not None:
+        after = [_after_key(index, f, o, v) for (f, o), v in zip(spec, search_after)]
+        greater = np.zeros(len(candidates), dtype=bool)
+        equal = np.ones(len(candidates), dtype=bool)
+        for k, a in zip(keys, after):
+            greater |= equal & (k > a)
+            equal &= k == a
+        candidates = candidates[greater]
+        keys = [k[greater] for k in keys]
+    want = start + size
+    if len(keys) == 1 and want < len(candidates) // 4:
+        part = np.argpartition(keys[0], want - 1)[:want] if want > 0 else np.array([], dtype=np.int64)
+        part = part[np.lexsort((part, keys[0][part]))]
+        order = part
+    else:
+        order = np.lexsort(tuple(reversed(keys)))
+    return candidates[order[start:want]], spec
+
+# --- Aggregations ---
+
+class AggregationEvaluator:
+    def __init__(self, index, now=None):
+        self.index = index
+        self.now = now
+
+    def run(self, aggs, mask):
+        out = {}
+        for name, spec in (aggs or {}).items():
+            sub = spec.get("aggs") or spec.get("aggregations")
+            kinds = [k for k in spec if k not in ("aggs", "aggregations", "meta")]
+            if len(kinds) != 1:
+                raise LocalEngineError(f"Expected exactly one aggregation type for [{name}]")
+            handler = getattr(self, f"_a_{kinds[0]}", None)
+            if handler is None:
+                raise LocalEngineError(f"unknown or unsupported aggregation [{kinds[0]}]", error_type="x_content_parse_exception")
+            out[name] = handler(spec[kinds[0]], mask, sub)
+        return out
+
+    def _numeric(self, body, mask):
+        col = self.index.column(body.get("field", ""))
+        if col is None:
+            return np.array([])
+        if not isinstance(col, NumericColumn):
+            raise LocalEngineError(f"Field [{body.get('field')}] of type [{col.type}] is not supported for aggregation")
+        vals = col.values[mask]
+        return vals[~np.isnan(vals)]
+
+    def _a_sum(self, body, mask, sub):
+        return {"value": float(self._numeric(body, mask).sum())}
+
+    def _a_avg(self, body, mask, sub):
+        vals = self._numeric(body, mask)
+        return {"value": float(vals.mean()) if len(vals) else None}
+
+    def _a_min(self, body, mask, sub):
+        vals = self._numeric(body, mask)
+        return {"value": float(vals.min()) if len(vals) else None}
+
+    def _a_max(self, body, mask, sub):
+        vals = self._numeric(body, mask)
+        return {"value": float(vals.max()) if len(vals) else None}
+
+    def _a_value_count(self, body, mask, sub):
+        col = self.index.column(body.get("field", ""))
+        return {"value": int((mask & col.exists()).sum()) if col is not None else 0}
+
+    def _a_cardinality(self, body, mask, sub):
+        col = self.index.column(body.get("field", ""))
+        if col is None:
+            return {"value": 0}
+        if isinstance(col, NumericColumn):
+            return {"value": int(np.unique(self._numeric(body, mask)).size)}
+        codes = np.unique(col.codes[mask & (col.codes >= 0)])
+        if col.multi:
+            _, per_code = col.elements()
+            return {"value": len({e for c in codes for e in per_code[c]})}
+        return {"value": int(codes.size)}
+
+    def _a_terms(self, body, mask, sub):
+        field = body.get("field", "")
+        size = int(body.get("size", 10))
+        min_doc_count = int(body.get("min_doc_count", 1))
+        order = body.get("order", {"_count": "desc"})
+        order = order[0] if isinstance(order, list) and order else order
+        col = self.index.column(field)
+        empty = {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0, "buckets": []}
+        if col is None:
+            return empty
+        if isinstance(col, NumericColumn):
+            vals = self._numeric(body, mask)
+            keys, counts = np.unique(vals, return_counts=True)
+            entries = [(k, int(c), None) for k, c in zip(keys.tolist(), counts.tolist())]
+            as_key = (lambda k: int(k)) if col.type not in ("float", "double") else float
+            bucket_mask = lambda k: mask & (col.values == k)
+        elif col.multi:
+            names, per_code = col.elements()
+            code_counts = np.bincount(col.codes[mask & (col.codes >= 0)], minlength=len(col.vocab))
+            elem_counts = np.zeros(len(names), dtype=np.int64)
+            for c, n in enumerate(code_counts):
+                if n:
+                    elem_counts[per_code[c]] += n
+            entries = [(names[e], int(n), e) for e, n in enumerate(elem_counts) if n]
+            as_key = lambda k: k
+            bucket_mask = lambda e: mask & col.mask_for_codes([c for c in range(len(col.vocab)) if e in per_code[c]])
+        else:
+            counts = np.bincount(col.codes[mask & (col.codes >= 0)], minlength=len(col.vocab))
+            nz = np.flatnonzero(counts)
+            entries = [(col.vocab[c], int(counts[c]), c) for c in nz]
+            as_key = lambda k: k
+            bucket_mask = lambda c: mask & (col.codes == c)
+        entries = [e for e in entries if e[1] >= min_doc_count]
+        (okey, odir), = order.items() if isinstance(order, dict) and order else (("_count", "desc"),)
+        reverse = str(odir).lower() == "desc"
+        if okey == "_key":
+            entries.sort(key=lambda e: e[0], reverse=reverse)
+        else:
+            entries.sort(key=lambda e: (-e[1] if reverse else e[1], str(e[0])))
+        top = entries[:size]
+        buckets = []
+        for key, count, ref in top:
+            bucket = {"key": as_key(key), "doc_count": count}
+            if sub:
+                bucket.update(self.run(sub, bucket_mask(key if ref is None else ref)))
+            buckets.append(bucket)
+        return {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": int(sum(e[1] for e in entries[size:])),
+            "buckets": buckets
+        }
+
+    def _a_date_histogram(self, body, mask, sub):
+        field = body.get("field", "@timestamp")
+        interval = body.get("fixed_interval") or body.get("calendar_interval") or body.get("interval")
+        if interval is None:
+            raise LocalEngineError("date_histogram requires an interval")
+        step = parse_interval(interval)
+        min_doc_count = int(body.get("min_doc_count", 0))
+        col = self.index.column(field)
+        if col is None or not isinstance(col, NumericColumn):
+            return {"buckets": []}
+        present = mask & ~np.isnan(col.values)
+        if not present.any():
+            return {"buckets": []}
+        bucket_of = np.floor_divide(col.values[present], step).astype(np.int64)
+        lo = int(bucket_of.min())
+        counts = np.bincount(bucket_of - lo)
+        all_buckets = None
+        buckets = []
+        for offset, count in enumerate(counts.tolist()):
+            if count < min_doc_count:
+                continue
+            key = (lo + offset) * step
+            bucket = {"key_as_string": format_date(key), "key": key, "doc_count": int(count)}
+            if sub:
+                if all_buckets is None:
+                    all_buckets = np.floor_divide(np.nan_to_num(col.values, nan=-1.0), step).astype(np.int64)
+                bucket.update(self.run(sub, present & (all_buckets == lo + offset)))
+            buckets.append(bucket)
+        return {"buckets": buckets}
+
+    def _grouped_metrics(self, sub, rows, inverse, n_groups):
+        """Per-bucket sum/avg/min/max/value_count in one pass; None if sub has other agg types."""
+        out = {}
+        for name, spec in sub.items():
+            kinds = [k for k in spec if k not in ("meta",)]
+            if len(kinds) != 1 or kinds[0] not in ("sum", "avg", "min", "max", "value_count"):
+                return None
+            col = self.index.column(spec[kinds[0]].get("field", ""))
+            if not isinstance(col, NumericColumn):
+                return None
+            vals = col.values[rows]
+            ok = ~np.isnan(vals)
+            cnt = np.bincount(inverse[ok], minlength=n_groups)
+            kind = kinds[0]
+            if kind == "value_count":
+                res = cnt.astype(np.float64)
+            elif kind in ("sum", "avg"):
+                res = np.bincount(inverse[ok], weights=vals[ok], minlength=n_groups)
+                if kind == "avg":
+                    res = np.where(cnt > 0, res / np.maximum(cnt, 1), np.nan)
+            else:
+                res = np.full(n_groups, np.inf if kind == "min" else -np.inf)
+                (np.minimum if kind == "min" else np.maximum).at(res, inverse[ok], vals[ok])
+                res = np.where(cnt > 0, res, np.nan)
+            out[name] = (kind, res)
+        return out
+
+    def _a_composite(self, body, mask, sub):
+        size = int(body.get("size", 10))
+        sources = []
+        present = mask.copy()
+        for source in body.get("sources", []):
+            (name, spec), = source.items()
+            if "terms" not in spec:
+                raise LocalEngineError(f"composite source [{name}] must be a terms source")
+            field = spec["terms"].get("field", "")
+            col = self.index.column(field)
+            if col is None:
+                return {"buckets": []}
+            if isinstance(col, KeywordColumn) and col.multi:
+                raise LocalEngineError(f"composite on multi-valued field [{field}] is not supported locally")
+            sources.append((name, field, col))
+            present &= col.exists()
+        if not sources:
+            raise LocalEngineError("composite requires at least one source")
+        rows = np.flatnonzero(present)
+        if not len(rows):
+            return {"buckets": []}
+        # Composite buckets are ordered by key: lexicographic rank for keywords, value for numbers
+        keys = np.column_stack([col.sort_key()[rows] for _, _, col in sources])
+        uniq, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        start = 0
+        after = body.get("after")
+        if after:
+            after_row = [col.parse(after[name]) if isinstance(col, NumericColumn) else col.sort_value_rank(after[name])
+                         for name, _, col in sources]
+            greater = np.zeros(len(uniq), dtype=bool)
+            equal = np.ones(len(uniq), dtype=bool)
+            for k, a in enumerate(after_row):
+                greater |= equal & (uniq[:, k] > a)
+                equal &= uniq[:, k] == a
+            start = int(np.argmax(greater)) if greater.any() else len(uniq)
+        stop = min(start + size, len(uniq))
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        metrics = self._grouped_metrics(sub, rows, inverse, len(uniq)) if sub else {}
+        buckets = []
+        for j in range(start, stop):
+            members = rows[order[bounds[j]:bounds[j + 1]]]
+            bucket = {"key": {name: _sort_value(self.index, field, members[0]) for name, field, _ in sources},
+                      "doc_count": int(counts[j])}
+            if metrics is None:
+                sel = np.zeros(len(mask), dtype=bool)
+                sel[members] = True
+                bucket.update(self.run(sub, sel))
+            else:
+                for name, (kind, res) in metrics.items():
+                    v = res[j]
+                    bucket[name] = {"value": None if np.isnan(v) else (int(v) if kind == "value_count" else float(v))}
+            buckets.append(bucket)
+        out = {"buckets": buckets}
+        if buckets:
+            out["after_key"] = buckets[-1]["key"]
+        return out
+
+    def _a_filter(self, body, mask, sub):
+        sel = mask & QueryEvaluator(self.index, now=self.now).evaluate(body)
+        out = {"doc_count": int(sel.sum())}
+        if sub:
+            out.update(self.run(sub, sel))
+        return out
+
+# --- Engine ---
+
+class LocalEngine:
+    def __init__(self):
+        self.indices = {}
+        self._pits = {}
+        self._pit_seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add_index(self, index):
+        self.indices[index.name] = index
+        return index
+
+    def resolve(self, pattern):
+        for p in str(pattern or "*").split(","):
+            rx = wildcard_regex(p.strip())
+            for name, index in self.indices.items():
+                if rx.fullmatch(name):
+                    return index
+        raise LocalEngineError(f"no such index [{pattern}]", status_code=404, error_type="index_not_found_exception")
+
+    def mapping(self, pattern):
+        index = self.resolve(pattern)
+        return {index.name: index.mapping()}
+
+    def stats(self, pattern):
+        index = self.resolve(pattern)
+        nbytes = sum(c.codes.nbytes if isinstance(c, KeywordColumn) else c.values.nbytes for c in index.columns.values())
+        primaries = {"docs": {"count": index.n_docs}, "store": {"size_in_bytes": nbytes}}
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}, "_all": {"primaries": primaries, "total": primaries}}
+
+    def open_pit(self, pattern):
+        index = self.resolve(pattern)
+        with self._lock:
+            pit_id = f"local-pit-{next(self._pit_seq)}"
+            self._pits[pit_id] = index.name
+        return pit_id
+
+    def close_pit(self, pit_id):
+        with self._lock:
+            return self._pits.pop(pit_id, None) is not None
+
+    def _index_for(self, pattern, body):
+        pit = body.get("pit")
+        if pit:
+            name = self._pits.get(pit.get("id"))
+            if name is None:
+                raise LocalEngineError("No search context found for the point-in-time id", status_code=404, error_type="search_context_missing_exception")
+            return self.indices[name]
+        return self.resolve(pattern)
+
+    def count(self, pattern, body=None):
+        body = body or {}
+        index = self.resolve(pattern)
+        return {"count": int(QueryEvaluator(index).evaluate(body.get("query")).sum())}
+
+    def search(self, pattern, body=None):
+        started = time.perf_counter()
+        body = body or {}
+        index = self._index_for(pattern, body)
+        now = now_ms()
+        query_started = time.perf_counter_ns()
+        mask = QueryEvaluator(index, now=now).evaluate(body.get("query"))
+        query_nanos = time.perf_counter_ns() - query_started
+        size = int(body.get("size", 10))
+        start = int(body.get("from", 0))
+        rows, spec = top_hits(index, mask, body.get("sort"), start, size, body.get("search_after"))
+        field_filter = _source_filter(body.get("_source"))
+        hits = []
+        for i in rows.tolist():
+            hit = {"_index": index.name, "_id": f"local-{i}", "_score": None}
+            if body.get("_source") is not False:
+                hit["_source"] = index.source(i, field_filter)
+            if spec:
+                hit["sort"] = [_sort_value(index, f, i) for f, _ in spec]
+            hits.append(hit)
+        response = {
+            "took": 0,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": int(mask.sum()), "relation": "eq"}, "max_score": None, "hits": hits},
+        }
+        aggs = body.get("aggs") or body.get("aggregations")
+        if aggs:
+            response["aggregations"] = AggregationEvaluator(index, now=now).run(aggs, mask)
+        if body.get("pit"):
+            response["pit_id"] = body["pit"]["id"]
+        if body.get("profile"):
+            query_type = next(iter(body.get("query") or {"match_all": {}}))
+            response["profile"] = {"shards": [{
+                "id": f"[local][{index.name}][0]",
+                "searches": [{"query": [{"type": query_type, "description": "", "time_in_nanos": query_nanos}], "rewrite_time": 0, "collector": []}],
+                "aggregations": [],
+            }]}
+        response["took"] = int((time.perf_counter() - started) * 1000)
+        return response
+
+    def msearch(self, items):
+        responses = []
+        for pattern, body in items:
+            try:
+                r = self.search(pattern, body)
+                r["status"] = 200
+                responses.append(r)
+            except LocalEngineError as e:
+                responses.append(e.to_response())
+        return responses
+
+# --- Synthetic corpus ---
+
+def generate_corpus(n_docs=LOCAL_DOCS, seed=LOCAL_SEED, days=LOCAL_DAYS, now=None, name=LOCAL_INDEX_NAME):
+    """Builds a Wazuh-like index straight from alert_generator columns (no per-document dicts)."""
+    gen = alert_generator.AlertGenerator(seed=seed, days=days, end_ms=now)
+    columns = {}
+    for field, spec in gen.columns(gen.generate(n_docs)).items():
+        if len(spec) == 2:
+            columns[field] = NumericColumn(*spec)
+        else:
+            ftype, vocab, codes, multi = spec
+            columns[field] = KeywordColumn(ftype, vocab, codes, multi=multi)
+    return LocalIndex(name, columns, n_docs)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Process-wide engine, seeded with the synthetic corpus on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                started = time.perf_counter()
+                engine = LocalEngine()
+                engine.add_index(generate_corpus())
+                logger.info(f"Local engine indexed {LOCAL_DOCS} docs in {time.perf_counter() - started:.2f}s")
+                _engine = engine
+    return _engine
+
+# --- elasticsearch-py compatible clients ---
+
+class _LocalIndices:
+    def __init__(self, client):
+        self._client = client
+
+    def stats(self, index=None, **kwargs):
+        return self._client._call(self._client.engine.stats, index)
+
+class LocalElasticsearch:
+    """Implements the client methods elastic_connector calls, backed by LocalEngine."""
+    def __init__(self, engine=None, latency_ms=None):
+        self.engine = engine or get_engine()
+        self.latency = (LOCAL_LATENCY_MS if latency_ms is None else latency_ms) / 1000.0
+        self.indices = _LocalIndices(self)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _call(self, fn, *args):
+        self._wait()
+        try:
+            return fn(*args)
+        except LocalEngineError:
+            raise
+        except Exception as e:
+            raise LocalEngineError(str(e), status_code=500, error_type="exception")
+
+    def search(self, index=None, body=None, **kwargs):
+        return self._call(self.engine.search, index, body)
+
+    def count(self, index=None, body=None, **kwargs):
+        return self._call(self.engine.count, index, body)
+
+    def msearch(self, body=None, **kwargs):
+        lines = list(body or [])
+        items = [(lines[i].get("index"), lines[i + 1]) for i in range(0, len(lines) - 1, 2)]
+        return {"took": 0, "responses": self._call(self.engine.msearch, items)}
+
+    def open_point_in_time(self, index=None, keep_alive=None, **kwargs):
+        return {"id": self._call(self.engine.open_pit, index)}
+
+    def close_point_in_time(self, id=None, body=None, **kwargs):
+        return {"succeeded": self._call(self.engine.close_pit, id), "num_freed": 1}
+
+    def ping(self, **kwargs):
+        return True
+
+    def close(self):
+        pass
+
+class AsyncLocalElasticsearch:
+    """Async twin: simulated latency uses asyncio.sleep and evaluation runs in a worker thread."""
+    def __init__(self, engine=None, latency_ms=None):
+        self._sync = LocalElasticsearch(engine, latency_ms=0)
+        self.latency = (LOCAL_LATENCY_MS if latency_ms is None else latency_ms) / 1000.0
+
+    async def _call(self, fn, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def search(self, index=None, body=None, **kwargs):
+        return await self._call(self._sync.search, index, body)
+
+    async def count(self, index=None, body=None, **kwargs):
+        return await self._call(self._sync.count, index, body)
+
+    async def msearch(self, body=None, **kwargs):
+        return await self._call(self._sync.msearch, body)
+
+    async def open_point_in_time(self, index=None, keep_alive=None, **kwargs):
+        return await self._call(self._sync.open_point_in_time, index)
+
+    async def close_point_in_time(self, id=None, body=None, **kwargs):
+        return await self._call(self._sync.close_point_in_time, id)
+
+    async def ping(self, **kwargs):
+        return True
+
+    async def close(self):
+        pass
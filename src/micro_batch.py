@@ -0,0 +1,160 @@
+import time
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BatchItemError(Exception):
+    """One search inside an _msearch failed; the others are unaffected."""
+    def __init__(self, status, error):
+        reason = error.get("reason") if isinstance(error, dict) else error
+        super().__init__(f"msearch item failed ({status}): {reason}")
+        self.status_code = status
+        self.error = error
+
+def _unpack(response):
+    if not isinstance(response, dict):
+        raise BatchItemError(None, "missing response")
+    if "error" in response:
+        raise BatchItemError(response.get("status"), response["error"])
+    return response
+
+class BatchItem:
+    """Pending result of one search in a batch; `on_result`/`on_error` shape what result() returns."""
+    def __init__(self, index, body, on_result=None, on_error=None):
+        self.index = index
+        self.body = body
+        self.on_result = on_result
+        self.on_error = on_error
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+        self._value = None
+        self._shaped = False
+
+    def resolve(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.event.set()
+
+    def result(self):
+        self.event.wait()
+        if self.error is not None:
+            if self.on_error:
+                return self.on_error(self.error)
+            raise self.error
+        if not self._shaped:
+            self._value = self.on_result(self.response) if self.on_result else self.response
+            self._shaped = True
+        return self._value
+
+def dispatch(send, items):
+    """Sends items as one _msearch and resolves each with its own response or error."""
+    if not items:
+        return
+    try:
+        responses = send([(it.index, it.body) for it in items])
+    except Exception as e:
+        for it in items:
+            it.resolve(error=e)
+        return
+    for i, it in enumerate(items):
+        try:
+            it.resolve(response=_unpack(responses[i] if i < len(responses) else None))
+        except BatchItemError as e:
+            it.resolve(error=e)
+
+class Batch:
+    """Explicit batch scope: searches added here go out as one _msearch on flush()."""
+    def __init__(self, send):
+        self.send = send
+        self.items = []
+
+    def add(self, item):
+        self.items.append(item)
+        return item
+
+    def flush(self):
+        items, self.items = self.items, []
+        dispatch(self.send, items)
+
+class MicroBatcher:
+    """
+    Collects searches from concurrent threads for up to `window_ms` (or until
+    `max_batch` are queued) and sends them as a single _msearch.
+    """
+    def __init__(self, send, window_ms, max_batch):
+        self.send = send
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending = []
+        self._leader_active = False
+        self._full = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "searches": 0}
+
+    def submit(self, index, body):
+        item = BatchItem(index, body)
+        with self._lock:
+            self._pending.append(item)
+            leader = not self._leader_active
+            self._leader_active = True
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+        if leader:
+            self._full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._leader_active = False
+                self._full.clear()
+            self.stats["batches"] += 1
+            self.stats["searches"] += len(batch)
+            dispatch(self.send, batch)
+        return item.result()
+
+class AsyncMicroBatcher:
+    """asyncio flavour of MicroBatcher; `send` is a coroutine function."""
+    def __init__(self, send, window_ms, max_batch):
+        self.send = send
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending = {}
+        self._timers = {}
+        self.stats = {"batches": 0, "searches": 0}
+
+    async def submit(self, index, body):
+        loop = asyncio.get_running_loop()
+        key = id(loop)
+        fut = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((index, body, fut))
+        if len(pending) >= self.max_batch:
+            self._flush_soon(loop, key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush_soon, loop, key)
+        return _unpack(await fut)
+
+    def _flush_soon(self, loop, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            loop.create_task(self._flush(batch))
+
+    async def _flush(self, batch):
+        self.stats["batches"] += 1
+        self.stats["searches"] += len(batch)
+        started = time.perf_counter()
+        try:
+            responses = await self.send([(index, body) for index, body, _ in batch])
+        except Exception as e:
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        logger.debug(f"msearch of {len(batch)} searches took {int((time.perf_counter() - started) * 1000)}ms")
+        for i, (_, _, fut) in enumerate(batch):
+            if not fut.done():
+                fut.set_result(responses[i] if i < len(responses) else None)
@@ -0,0 +1,275 @@
+import os
+import re
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+NL_CACHE_ENABLED = os.getenv("NL_CACHE_ENABLED", "true").lower() == "true"
+NL_CACHE_DB_PATH = os.getenv("NL_CACHE_DB_PATH", os.getenv("AUDIT_DB_PATH", "audit.db"))
+NL_CACHE_MAX_ENTRIES = int(os.getenv("NL_CACHE_MAX_ENTRIES", "2000"))
+NL_CACHE_TTL_SECONDS = int(os.getenv("NL_CACHE_TTL_SECONDS", str(7 * 86400)))
+# Near-duplicate lookup; 0 disables it and keeps exact (normalized) matches only
+NL_CACHE_SIMILARITY = float(os.getenv("NL_CACHE_SIMILARITY", "0.9"))
+EMBED_DIM = 512
+
+# Only the LLM's translation is cached; results are always fetched fresh
+CACHED_FIELDS = ("query", "analysis", "story", "mitre", "remediation", "severity", "confidence", "confidence_reason")
+
+FILLER_WORDS = {
+    "show", "me", "list", "find", "get", "give", "display", "please", "can", "you", "i", "want", "see",
+    "the", "a", "an", "all", "any", "of", "for", "in", "on", "over", "during", "with", "that", "which", "are", "is", "were", "was",
+    "last", "past", "previous", "recent", "attempt", "attempts", "event", "events", "alert", "alerts", "activity",
+}
+UNIT_WORDS = {
+    "minute": "m", "minutes": "m", "min": "m", "mins": "m",
+    "hour": "h", "hours": "h", "hr": "h", "hrs": "h",
+    "day": "d", "days": "d", "week": "w", "weeks": "w",
+}
+# Words that change what a query selects; near-duplicates must agree on all of them
+MEANINGFUL_WORDS = {"not", "no", "without", "except", "exclude", "excluding", "external", "internal", "success", "successful", "failed", "failure"}
+# Direction decides source vs destination fields, so these stay in the key ("from 10.0.0.5" != "to 10.0.0.5")
+DIRECTION_WORDS = {"from", "to", "into", "against", "toward", "towards", "targeting"}
+MEANINGFUL_WORDS |= DIRECTION_WORDS | {"yesterday"}
+# "want to see ..." is phrasing, not direction
+LEAD_IN_RE = re.compile(r"\b(?:want|need|like) to\b")
+TOKEN_RE = re.compile(r"[a-z0-9_.@:/*-]+")
+SPAN_RE = re.compile(r"\b(\d+)\s*(minutes?|mins?|hours?|hrs?|hr|days?|weeks?)\b")
+
+def normalize_prompt(text):
+    """Lowercase, unify time spans ("24 hours" -> "24h", "today" -> "24h"), drop filler and plurals."""
+    text = LEAD_IN_RE.sub(" ", str(text).lower().replace("today", "24h"))
+    text = SPAN_RE.sub(lambda m: f"{m.group(1)}{UNIT_WORDS[m.group(2)]}", text)
+    words = []
+    for w in TOKEN_RE.findall(text):
+        w = w.strip(".-:")
+        if not w or w in FILLER_WORDS:
+            continue
+        if len(w) > 3 and w.endswith("s") and not w.endswith("ss") and not any(c.isdigit() for c in w):
+            w = w[:-1]
+        words.append(w)
+    return " ".join(words)
+
+# Common SIEM question vocabulary that paraphrases may swap freely; any other word is a value
+# (hostname, username, process name...) and must be identical for a near-duplicate hit
+VOCABULARY_WORDS = {normalize_prompt(w) or w for w in (
+    "login", "logon", "logoff", "logout", "sign-in", "signin", "authentication", "auth", "password", "credential",
+    "brute", "force", "spray", "scan", "scanning", "attack", "attacker", "threat", "suspicious", "unusual", "anomalous",
+    "ssh", "sshd", "rdp", "vpn", "dns", "http", "https", "url", "domain", "traffic", "connection", "session", "network",
+    "host", "hostname", "agent", "server", "machine", "endpoint", "user", "username", "account", "ip", "address",
+    "source", "destination", "src", "dst", "port", "inbound", "outbound", "blocked", "allowed", "denied", "firewall",
+    "file", "hash", "malware", "virus", "process", "command", "privilege", "escalation", "root", "admin",
+    "change", "changed", "modified", "created", "deleted", "access", "accessed", "rule", "level", "severity",
+    "high", "critical", "medium", "low", "mitre", "technique", "tactic", "country", "top", "count", "many", "most",
+    "how", "who", "what", "when", "where", "why", "by", "per", "each", "and", "or", "at", "new", "happened", "occurred",
+)}
+
+def must_match(normalized):
+    """
+    Numbers, time spans, IPs, polarity and direction words, and every word outside
+    VOCABULARY_WORDS; a near-duplicate hit requires these to be identical.
+    """
+    return tuple(sorted(w for w in normalized.split()
+                        if any(c.isdigit() for c in w) or w in MEANINGFUL_WORDS or w not in VOCABULARY_WORDS))
+
+def schema_fingerprint(schema_context):
+    if isinstance(schema_context, str):
+        try:
+            schema_context = orjson.loads(schema_context)
+        except Exception:
+            return hashlib.sha1(schema_context.encode()).hexdigest()[:16]
+    return hashlib.sha1(orjson.dumps(schema_context, option=orjson.OPT_SORT_KEYS)).hexdigest()[:16]
+
+def scope_key(index_pattern, schema_fp, role=None, max_lookback_days=None):
+    """Everything besides the prompt that changes which DSL is valid."""
+    return f"{index_pattern}|{schema_fp}|{role or ''}|{max_lookback_days if max_lookback_days is not None else ''}"
+
+def hashed_embedding(normalized):
+    """Bag of words plus character trigrams, hashed into EMBED_DIM dims and L2-normalized."""
+    vec = np.zeros(EMBED_DIM, dtype=np.float32)
+    for w in normalized.split():
+        vec[zlib.crc32(w.encode()) % EMBED_DIM] += 2.0
+        padded = f" {w} "
+        for i in range(len(padded) - 2):
+            vec[zlib.crc32(padded[i:i + 3].encode()) % EMBED_DIM] += 1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+class NLCache:
+    """
+    LRU of validated LLM translations keyed on (scope, normalized prompt), persisted to SQLite.
+    `embed` maps a normalized prompt to a unit vector for near-duplicate lookups; any
+    embeddings object with embed_query() can be plugged in instead of the hashed default.
+    """
+    def __init__(self, db_path=NL_CACHE_DB_PATH, max_entries=NL_CACHE_MAX_ENTRIES, ttl=NL_CACHE_TTL_SECONDS,
+                 similarity=NL_CACHE_SIMILARITY, embed=None):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.embed = embed or hashed_embedding
+        self._entries = OrderedDict()
+        self._scope_fps = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS nl_cache (key TEXT PRIMARY KEY, scope TEXT, idx TEXT, schema_fp TEXT, prompt TEXT, vector BLOB, value_json TEXT, created_ts INTEGER, last_used_ts REAL)"
+        )
+        return conn
+
+    def _load(self):
+        if self._loaded or not self.db_path:
+            self._loaded = True
+            return
+        self._loaded = True
+        try:
+            conn = self._connect()
+            rows = conn.execute("SELECT key, scope, idx, schema_fp, prompt, vector, value_json, created_ts FROM nl_cache ORDER BY last_used_ts ASC").fetchall()
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Could not load NL cache from {self.db_path}: {e}")
+            return
+        for key, scope, idx, fp, prompt, vector, value_json, created in rows:
+            self._entries[key] = {"scope": scope, "idx": idx, "fp": fp, "prompt": prompt,
+                                  "vector": np.frombuffer(vector, dtype=np.float32) if vector else None,
+                                  "value": orjson.loads(value_json), "created": created}
+        logger.info(f"Loaded {len(rows)} cached NL translations")
+
+    def _persist(self, statements):
+        if not self.db_path:
+            return
+        try:
+            conn = self._connect()
+            for sql, args in statements:
+                conn.execute(sql, args)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.warning(f"NL cache persistence failed: {e}")
+
+    def _vector(self, normalized):
+        if not self.similarity:
+            return None
+        try:
+            vec = self.embed(normalized) if callable(self.embed) else self.embed.embed_query(normalized)
+        except Exception as e:
+            logger.warning(f"Prompt embedding failed: {e}")
+            return None
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+
+    def _key(self, scope, normalized):
+        return hashlib.sha1(f"{scope}\n{normalized}".encode()).hexdigest()
+
+    def _invalidate_index(self, index_pattern, schema_fp):
+        """Drops entries built against an older mapping of index_pattern (caller holds the lock)."""
+        if self._scope_fps.get(index_pattern) == schema_fp:
+            return []
+        self._scope_fps[index_pattern] = schema_fp
+        stale = [k for k, e in self._entries.items() if e["idx"] == index_pattern and e["fp"] != schema_fp]
+        for k in stale:
+            del self._entries[k]
+        if stale:
+            self.stats["invalidations"] += len(stale)
+            logger.info(f"Mapping of {index_pattern} changed; dropped {len(stale)} cached NL translations")
+        return [("DELETE FROM nl_cache WHERE idx = ? AND schema_fp != ?", (index_pattern, schema_fp))] if stale else []
+
+    def get(self, prompt, index_pattern, schema_fp, role=None, max_lookback_days=None):
+        """Returns (value, match) with match "exact" or "similar", or (None, None)."""
+        scope = scope_key(index_pattern, schema_fp, role, max_lookback_days)
+        normalized = normalize_prompt(prompt)
+        key = self._key(scope, normalized)
+        now = time.time()
+        with self._lock:
+            self._load()
+            writes = self._invalidate_index(index_pattern, schema_fp)
+            hit, match = self._entries.get(key), "exact"
+            if hit is not None and now - hit["created"] > self.ttl:
+                self._entries.pop(key)
+                writes.append(("DELETE FROM nl_cache WHERE key = ?", (key,)))
+                hit = None
+            if hit is None:
+                vec = self._vector(normalized)
+                if vec is not None:
+                    hit, key = self._nearest(scope, normalized, vec, now)
+                    match = "similar"
+            if hit is None:
+                self.stats["misses"] += 1
+            else:
+                self._entries.move_to_end(key)
+                self.stats[f"{match}_hits"] += 1
+                writes.append(("UPDATE nl_cache SET last_used_ts = ? WHERE key = ?", (now, key)))
+        self._persist(writes)
+        if hit is None:
+            return None, None
+        return orjson.loads(orjson.dumps(hit["value"])), match
+
+    def _nearest(self, scope, normalized, vec, now):
+        required = must_match(normalized)
+        best, best_key, best_sim = None, None, self.similarity
+        for k, e in self._entries.items():
+            if e["scope"] != scope or e["vector"] is None or now - e["created"] > self.ttl:
+                continue
+            if e["vector"].shape != vec.shape or must_match(e["prompt"]) != required:
+                continue
+            sim = float(np.dot(e["vector"], vec))
+            if sim >= best_sim:
+                best, best_key, best_sim = e, k, sim
+        return best, best_key
+
+    def set(self, prompt, index_pattern, schema_fp, value, role=None, max_lookback_days=None):
+        scope = scope_key(index_pattern, schema_fp, role, max_lookback_days)
+        normalized = normalize_prompt(prompt)
+        key = self._key(scope, normalized)
+        value = {k: value.get(k) for k in CACHED_FIELDS}
+        vec = self._vector(normalized)
+        now = time.time()
+        with self._lock:
+            self._load()
+            writes = self._invalidate_index(index_pattern, schema_fp)
+            self._entries[key] = {"scope": scope, "idx": index_pattern, "fp": schema_fp, "prompt": normalized,
+                                  "vector": vec, "value": value, "created": int(now)}
+            self._entries.move_to_end(key)
+            self.stats["stores"] += 1
+            writes.append((
+                "INSERT OR REPLACE INTO nl_cache (key, scope, idx, schema_fp, prompt, vector, value_json, created_ts, last_used_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, scope, index_pattern, schema_fp, normalized, vec.tobytes() if vec is not None else None, orjson.dumps(value).decode(), int(now), now),
+            ))
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+                writes.append(("DELETE FROM nl_cache WHERE key = ?", (oldest,)))
+        self._persist(writes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scope_fps.clear()
+        self._persist([("DELETE FROM nl_cache", ())])
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        hits = stats["exact_hits"] + stats["similar_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+        # Every hit is one LLM translation round trip not made
+        stats["llm_calls_saved"] = hits
+        return stats
+
+# Shared instance used by agent_logic
+translation_cache = NLCache()
@@ -41,3 +41,29 @@ Your response MUST be a JSON object with the following structure:
 
 def get_system_prompt(schema_str):
     return SYSTEM_PROMPT_TEMPLATE.format(schema=schema_str)
+
+NARRATIVE_PROMPT_TEMPLATE = """You are a Lead SOC Analyst. The question below was answered by a predefined hunt query; write only the narrative.
+
+Question: {question}
+Query run: {query}
+Total hits: {total_hits}
+Sample hits: {sample}
+
+Return ONLY a JSON object: {{"analysis": "<2-3 sentences on what these results show and why they matter>", "story": "<attack chain as steps separated by '->', or null>", "remediation": "<specific, actionable recommendation>"}}"""
+
+def get_narrative_prompt(question, query, total_hits, sample):
+    return NARRATIVE_PROMPT_TEMPLATE.format(question=question, query=query, total_hits=total_hits, sample=sample)
+
+INVESTIGATION_PROMPT_TEMPLATE = """You are a Lead SOC Analyst. A high-severity hunt returned results, and related activity was pivoted for the entities involved.
+
+Question: {question}
+Initial analysis: {analysis}
+Total hits: {total_hits}
+Related activity per entity (events, first -> last seen, max rule level, spread, top rules):
+{pivots}
+
+Look for lateral movement, repeated sources and users, and attack chains. Return ONLY a JSON object:
+{{"analysis": "<updated 2-3 sentence analysis>", "story": "<attack chain as steps separated by '->', or null>", "mitre": [{{"id": "...", "name": "...", "description": "..."}}], "remediation": "<specific, actionable recommendation>", "severity": "low" | "medium" | "high" | "critical"}}"""
+
+def get_investigation_prompt(question, analysis, total_hits, pivots):
+    return INVESTIGATION_PROMPT_TEMPLATE.format(question=question, analysis=analysis, total_hits=total_hits, pivots=pivots)
@@ -0,0 +1,120 @@
+import os
+import re
+import time
+import orjson
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Relative date math ("now-24h") is pinned to this many seconds when building keys
+DATE_GRANULARITY_SECONDS = int(os.getenv("QUERY_CACHE_DATE_GRANULARITY", "60"))
+# TTL per query class, in seconds
+CLASS_TTLS = {
+    "aggregation": int(os.getenv("QUERY_CACHE_TTL_AGGREGATION", "60")),
+    "count": int(os.getenv("QUERY_CACHE_TTL_COUNT", "30")),
+    "search": int(os.getenv("QUERY_CACHE_TTL_SEARCH", "15")),
+}
+
+DATE_MATH_RE = re.compile(r"^now([-+]\d+[yMwdhHms])*(/[yMwdhHms])?$")
+
+def _pin_date_math(obj, bucket):
+    if isinstance(obj, dict):
+        return {k: _pin_date_math(v, bucket) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_pin_date_math(v, bucket) for v in obj]
+    if isinstance(obj, str) and DATE_MATH_RE.match(obj):
+        return f"{obj}@{bucket}"
+    return obj
+
+def canonical_key(kind, index_pattern, dsl, granularity=None, now=None):
+    """
+    Cache key for a DSL: sorted keys, compact separators, and relative date math
+    tagged with the current time bucket so "now-24h" keys roll over every granularity.
+    """
+    granularity = granularity or DATE_GRANULARITY_SECONDS
+    bucket = int((now if now is not None else time.time()) // granularity)
+    pinned = _pin_date_math(dsl, bucket)
+    return f"{kind}|{index_pattern}|" + orjson.dumps(pinned, option=orjson.OPT_SORT_KEYS).decode()
+
+def query_class(kind, dsl):
+    if kind == "aggregation" or dsl.get("aggs") or dsl.get("aggregations"):
+        return "aggregation"
+    if dsl.get("size") == 0:
+        return "count"
+    return "search"
+
+class QueryCache:
+    """
+    Thread-safe LRU of serialized results, bounded by entry count and total bytes.
+    Values are stored as orjson bytes so every hit hands the caller a private copy.
+    """
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttls=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = dict(ttls or CLASS_TTLS)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            expires_at, payload = entry
+            if time.time() > expires_at:
+                self._drop(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+        return orjson.loads(payload)
+
+    def set(self, key, value, qclass="search"):
+        ttl = self.ttls.get(qclass, 0)
+        if ttl <= 0:
+            return
+        payload = orjson.dumps(value)
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time() + ttl, payload)
+            self._bytes += size
+            self.stats["stores"] += 1
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.stats["evictions"] += 1
+
+    def _drop(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+# Shared instance used by elastic_connector
+result_cache = QueryCache()
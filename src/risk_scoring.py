@@ -0,0 +1,188 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import elastic_connector
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+RISK_DB_PATH = os.getenv("RISK_DB_PATH", os.getenv("AUDIT_DB_PATH", "audit.db"))
+RISK_WINDOW = os.getenv("RISK_WINDOW", "now-24h")
+RISK_PAGE_SIZE = int(os.getenv("RISK_PAGE_SIZE", "1000"))
+# Persisted scores older than this are recomputed in the background
+RISK_REFRESH_SECONDS = int(os.getenv("RISK_REFRESH_SECONDS", "300"))
+
+# Entity type -> field scored per distinct value
+ENTITY_FIELDS = {
+    "agent": "agent.name",
+    "srcip": "data.srcip",
+}
+SORTABLE_COLUMNS = ("score", "alerts", "max_level", "entity")
+
+# Score = sum of rule levels; alert count and peak level are kept alongside for sorting
+SCORE_AGGS = {
+    "score": {"sum": {"field": "rule.level"}},
+    "max_level": {"max": {"field": "rule.level"}},
+}
+
+def init_db():
+    conn = sqlite3.connect(RISK_DB_PATH)
+    cur = conn.cursor()
+    # Scores used to be kept per entity type only; they are recomputed anyway, so drop the old tables
+    cols = [r[1] for r in cur.execute("PRAGMA table_info(risk_scores)").fetchall()]
+    if cols and "idx" not in cols:
+        cur.execute("DROP TABLE risk_scores")
+        cur.execute("DROP TABLE IF EXISTS risk_runs")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS risk_scores (entity_type TEXT, idx TEXT, entity TEXT, score REAL, alerts INTEGER, max_level INTEGER, run_ts INTEGER, PRIMARY KEY (entity_type, idx, entity))"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_risk_scores_score ON risk_scores (entity_type, idx, score DESC)")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS risk_runs (entity_type TEXT, idx TEXT, run_ts INTEGER, time_window TEXT, entities INTEGER, duration_ms INTEGER, PRIMARY KEY (entity_type, idx))"
+    )
+    conn.commit()
+    conn.close()
+
+def _query(window):
+    return {"query": {"range": {"@timestamp": {"gte": window}}}}
+
+def _rows(entity_type, index_pattern, buckets, run_ts):
+    for b in buckets:
+        max_level = b.get("max_level", {}).get("value")
+        yield (
+            entity_type,
+            index_pattern,
+            str(b["key"]["entity"]),
+            float(b.get("score", {}).get("value") or 0),
+            int(b.get("doc_count", 0)),
+            int(max_level) if max_level is not None else 0,
+            run_ts,
+        )
+
+class _RunWriter:
+    """Upserts one page of buckets at a time, then drops entities the run did not see (for its index only)."""
+    def __init__(self, entity_type, index_pattern):
+        self.entity_type = entity_type
+        self.index_pattern = index_pattern
+        self.run_ts = time.time_ns()
+        self.entities = 0
+        # Pages may be written from worker threads (async path), one at a time
+        self.conn = sqlite3.connect(RISK_DB_PATH, check_same_thread=False)
+
+    def write(self, buckets):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO risk_scores (entity_type, idx, entity, score, alerts, max_level, run_ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            _rows(self.entity_type, self.index_pattern, buckets, self.run_ts),
+        )
+        self.conn.commit()
+        self.entities += len(buckets)
+
+    def finish(self, window, started):
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        self.conn.execute("DELETE FROM risk_scores WHERE entity_type = ? AND idx = ? AND run_ts != ?", (self.entity_type, self.index_pattern, self.run_ts))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO risk_runs (entity_type, idx, run_ts, time_window, entities, duration_ms) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.entity_type, self.index_pattern, int(time.time()), window, self.entities, duration_ms),
+        )
+        self.conn.commit()
+        self.conn.close()
+        logger.info(f"Scored {self.entities} {self.entity_type} entities in {duration_ms}ms")
+        return {"entity_type": self.entity_type, "entities": self.entities, "duration_ms": duration_ms}
+
+    def abort(self):
+        self.conn.close()
+
+def compute_risk_scores(entity_type="agent", index_pattern="wazuh-alerts-*", window=RISK_WINDOW, page_size=RISK_PAGE_SIZE):
+    """
+    Scores every distinct value of the entity field by paging a composite aggregation.
+    Only one page of buckets is in memory at a time; results replace the previous run.
+    """
+    field = ENTITY_FIELDS[entity_type]
+    init_db()
+    started = time.perf_counter()
+    writer = _RunWriter(entity_type, index_pattern)
+    try:
+        for buckets in elastic_connector.iter_composite(
+            [{"entity": {"terms": {"field": field}}}], index_pattern,
+            query_dsl=_query(window), sub_aggs=SCORE_AGGS, page_size=page_size
+        ):
+            writer.write(buckets)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.finish(window, started)
+
+async def compute_risk_scores_async(entity_type="agent", index_pattern="wazuh-alerts-*", window=RISK_WINDOW, page_size=RISK_PAGE_SIZE):
+    field = ENTITY_FIELDS[entity_type]
+    await asyncio.to_thread(init_db)
+    started = time.perf_counter()
+    writer = _RunWriter(entity_type, index_pattern)
+    try:
+        async for buckets in elastic_connector.iter_composite_async(
+            [{"entity": {"terms": {"field": field}}}], index_pattern,
+            query_dsl=_query(window), sub_aggs=SCORE_AGGS, page_size=page_size
+        ):
+            await asyncio.to_thread(writer.write, buckets)
+    except BaseException:
+        writer.abort()
+        raise
+    return await asyncio.to_thread(writer.finish, window, started)
+
+def list_scores(entity_type="agent", sort="score", order="desc", limit=50, offset=0, index_pattern="wazuh-alerts-*"):
+    """Reads the scores persisted for index_pattern; sort must be one of SORTABLE_COLUMNS."""
+    if sort not in SORTABLE_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort}")
+    direction = "ASC" if str(order).lower() == "asc" else "DESC"
+    init_db()
+    conn = sqlite3.connect(RISK_DB_PATH)
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT entity, score, alerts, max_level FROM risk_scores WHERE entity_type = ? AND idx = ? ORDER BY {sort} {direction}, entity ASC LIMIT ? OFFSET ?",
+        (entity_type, index_pattern, int(limit), int(offset)),
+    )
+    rows = cur.fetchall()
+    cur.execute("SELECT COUNT(*) FROM risk_scores WHERE entity_type = ? AND idx = ?", (entity_type, index_pattern))
+    total = cur.fetchone()[0]
+    conn.close()
+    return {
+        "total": total,
+        "items": [{"entity": r[0], "score": r[1], "alerts": r[2], "max_level": r[3]} for r in rows],
+    }
+
+def last_run(entity_type="agent", index_pattern="wazuh-alerts-*"):
+    init_db()
+    conn = sqlite3.connect(RISK_DB_PATH)
+    cur = conn.cursor()
+    cur.execute("SELECT run_ts, idx, time_window, entities, duration_ms FROM risk_runs WHERE entity_type = ? AND idx = ?", (entity_type, index_pattern))
+    row = cur.fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {"run_ts": row[0], "index": row[1], "window": row[2], "entities": row[3], "duration_ms": row[4]}
+
+_refreshing = {}
+
+def _log_refresh_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Risk scoring refresh failed: {task.exception()}")
+
+async def ensure_fresh(entity_type="agent", index_pattern="wazuh-alerts-*"):
+    """
+    Starts a background recompute when the run persisted for index_pattern is missing or
+    stale. Waits for it only if there is nothing to serve yet.
+    """
+    run = await asyncio.to_thread(last_run, entity_type, index_pattern)
+    if run is not None and time.time() - run["run_ts"] <= RISK_REFRESH_SECONDS:
+        return run
+    key = (entity_type, index_pattern)
+    task = _refreshing.get(key)
+    if task is None or task.done():
+        task = asyncio.create_task(compute_risk_scores_async(entity_type, index_pattern))
+        task.add_done_callback(_log_refresh_failure)
+        _refreshing[key] = task
+    if run is None:
+        await asyncio.shield(task)
+        run = await asyncio.to_thread(last_run, entity_type, index_pattern)
+    return run
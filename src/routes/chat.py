@@ -1,8 +1,12 @@
 import os
-import json
 import time
+import asyncio
+import jwt
+import orjson
 import logging
 from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import agent_logic
 import schema_extractor
 import elastic_connector
@@ -11,24 +15,50 @@ from .auth import require_auth
 router = APIRouter(prefix="/api")
 logger = logging.getLogger(__name__)
 
-AGG_CACHE = {}
+# Fields needed to render an alert card
+ALERT_FIELDS = ["@timestamp", "rule.description", "rule.level", "agent.name"]
+CURSOR_TTL_SECONDS = int(os.getenv("CURSOR_TTL_SECONDS", "900"))
+# Largest result or page size each role may request
+MAX_RESULT_SIZE = {
+    "analyst": int(os.getenv("MAX_RESULT_SIZE_ANALYST", "1000")),
+    "admin": int(os.getenv("MAX_RESULT_SIZE_ADMIN", str(elastic_connector.PIT_PAGE_SIZE_MAX))),
+}
 
-def cache_get(key):
-    ttl = int(os.getenv("CACHE_TTL_SECONDS", "30"))
-    v = AGG_CACHE.get(key)
-    if not v:
-        return None
-    ts, data = v
-    if time.time() - ts > ttl:
-        return None
-    return data
+def _size(value, default, role):
+    """Requested result size clamped to the role's limit; 400 unless it is a positive integer."""
+    try:
+        size = int(default if value is None else value)
+    except (TypeError, ValueError):
+        size = 0
+    if size < 1:
+        raise HTTPException(status_code=400, detail="Size must be a positive integer")
+    return min(size, MAX_RESULT_SIZE.get(role, MAX_RESULT_SIZE["analyst"]))
 
-def cache_set(key, data):
-    AGG_CACHE[key] = (time.time(), data)
+def encode_cursor(uname, index, query, pit_id=None, search_after=None):
+    """Signed, stateless paging cursor so clients cannot swap in their own DSL."""
+    payload = {
+        "sub": uname,
+        "idx": index,
+        "q": query,
+        "pit": pit_id,
+        "sa": search_after,
+        "exp": int(time.time()) + CURSOR_TTL_SECONDS
+    }
+    jwt_secret = os.getenv("JWT_SECRET", "SIEM_DEFAULT_FALLBACK_SECRET_CHANGE_ME")
+    return jwt.encode(payload, jwt_secret, algorithm="HS256")
 
-@router.post("/chat")
-async def chat(request: Request):
-    logger.info("Chat endpoint reached")
+def decode_cursor(token, uname):
+    jwt_secret = os.getenv("JWT_SECRET", "SIEM_DEFAULT_FALLBACK_SECRET_CHANGE_ME")
+    try:
+        payload = jwt.decode(token, jwt_secret, algorithms=["HS256"], options={"require": ["exp"]})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid or expired cursor")
+    if payload.get("sub") != uname:
+        raise HTTPException(status_code=403, detail="Cursor belongs to another user")
+    return payload
+
+async def _chat_request(request: Request):
+    """Authenticates a chat call and checks its index against the role's allow-list."""
     try:
         uname, role = require_auth(request)
     except HTTPException as e:
@@ -57,50 +87,71 @@ async def chat(request: Request):
         logger.warning(f"Index {index} not allowed for role {role}. Allowed: {allowed_list}")
         raise HTTPException(status_code=403, detail="Index not allowed for role")
     
-    size = int(body.get("size", 100))
-    m = schema_extractor.get_index_mapping(index)
-    s = schema_extractor.simplify_mapping(m)
-    max_days = 7 if role == "analyst" else int(os.getenv("MAX_LOOKBACK_DAYS", "30"))
-    
-    try:
-        r = agent_logic.process_query(prompt, s, size_limit=size, index_pattern=index, user_name=uname, max_lookback_days=max_days)
-    except Exception as e:
-        logger.error(f"agent_logic.process_query raised exception: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
+    return {
+        "uname": uname,
+        "role": role,
+        "body": body,
+        "prompt": prompt,
+        "index": index,
+        "size": _size(body.get("size"), 100, role),
+        "max_days": 7 if role == "analyst" else int(os.getenv("MAX_LOOKBACK_DAYS", "30")),
+    }
 
-    if not isinstance(r, dict):
-        logger.error(f"agent_logic.process_query returned non-dict: {type(r)}")
-        raise HTTPException(status_code=500, detail="Internal processing error")
-    
-    if "error" in r:
-        logger.error(f"agent_logic.process_query error: {r['error']}")
-        raise HTTPException(status_code=500, detail=r["error"])
-    
-    agg_field = body.get("aggField")
+async def _schema(index):
+    m = await run_in_threadpool(schema_extractor.get_index_mapping, index)
+    return schema_extractor.simplify_mapping(m)
+
+async def _dashboard_aggs(index, agg_field=None):
     aggs = {}
     try:
+        # Repeated dashboard aggregations are served from the connector's result cache;
+        # issued together they are micro-batched into one _msearch
         histo = {"size": 0, "aggs": {"by_time": {"date_histogram": {"field": "@timestamp", "fixed_interval": "1h"}}}}
-        k1 = (index, "histo", json.dumps(histo))
-        hcache = cache_get(k1)
-        aggs = hcache if hcache else elastic_connector.execute_aggregation(json.dumps(histo), index_pattern=index)
-        if not hcache:
-            cache_set(k1, aggs)
-            
+        pending = [elastic_connector.execute_aggregation_async(histo, index_pattern=index)]
         if agg_field:
             terms = {"size": 0, "aggs": {"top_terms": {"terms": {"field": agg_field, "size": 10}}}}
-            k2 = (index, "terms", json.dumps(terms))
-            tcache = cache_get(k2)
-            taggs = tcache if tcache else elastic_connector.execute_aggregation(json.dumps(terms), index_pattern=index)
-            if not tcache:
-                cache_set(k2, taggs)
+            pending.append(elastic_connector.execute_aggregation_async(terms, index_pattern=index))
+        agg_results = await asyncio.gather(*pending)
+        aggs = agg_results[0]
+        for taggs in agg_results[1:]:
             aggs.update(taggs if isinstance(taggs, dict) else {})
     except Exception as e:
         logger.warning(f"Aggregation failed: {e}")
-        pass
-        
+    return aggs
+
+async def _timed(coro):
+    t0 = time.perf_counter()
+    value = await coro
+    return value, round((time.perf_counter() - t0) * 1000, 1)
+
+def _add_timings(r, schema_ms, aggs_ms, started):
+    """Route-level stages next to process_query's own; aggregations overlap everything else."""
+    timings = r.get("timings") or {}
+    timings.update({"schema_fetch_ms": schema_ms, "aggs_ms": aggs_ms, "request_ms": round((time.perf_counter() - started) * 1000, 1)})
+    r["timings"] = timings
+
+def _chat_payload(uname, index, r, aggs):
+    # Cursor over the full match set (PIT + search_after), fetched via /api/chat/page.
+    # Issued for every real result since /api/export needs it even when everything fit in one page.
+    cursor = None
+    results = r.get("results") or {}
+    if r.get("query_generated") and not results.get("is_mock"):
+        try:
+            cursor = encode_cursor(uname, index, r["query_generated"])
+        except Exception as e:
+            logger.warning(f"Could not create paging cursor: {e}")
+
     return {
         "queryGenerated": r.get("query_generated"), 
         "results": r.get("results"), 
+        "cursor": cursor,
+        "hasMore": bool(cursor) and results.get("total_hits", 0) > len(results.get("data", [])),
+        "costEstimate": r.get("cost_estimate"),
+        "promptTokens": r.get("prompt_tokens"),
+        "timings": r.get("timings"),
+        "intent": r.get("intent"),
+        "narrativeId": r.get("narrative_id"),
+        "pivot": r.get("pivot"),
         "aggregations": aggs,
         "analysis": r.get("analysis"),
         "story": r.get("story"),
@@ -108,6 +159,209 @@ async def chat(request: Request):
         "severity": r.get("severity")
     }
 
+# How often a running investigation checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+async def _until_disconnected(request, task):
+    """Cancels task once the client goes away; returns True if it did."""
+    while not task.done():
+        if await request.is_disconnected():
+            task.cancel()
+            return True
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    return False
+
+@router.post("/chat")
+async def chat(request: Request):
+    logger.info("Chat endpoint reached")
+    c = await _chat_request(request)
+    started = time.perf_counter()
+    # Nothing below waits on the LLM except the LLM itself: MITRE retrieval starts now, the
+    # dashboard aggregations run for the whole request, and the mapping is fetched meanwhile
+    rag_future = agent_logic.prefetch_rag(c["prompt"])
+    aggs_task = asyncio.ensure_future(_timed(_dashboard_aggs(c["index"], c["body"].get("aggField"))))
+    s, schema_ms = await _timed(_schema(c["index"]))
+    
+    # Runs on the event loop (no worker thread held while waiting on the LLM) and stops when the client leaves
+    task = asyncio.ensure_future(agent_logic.aprocess_query(c["prompt"], s, size_limit=c["size"], index_pattern=c["index"], user_name=c["uname"], max_lookback_days=c["max_days"], fields=c["body"].get("fields"), role=c["role"], session_id=c["body"].get("sessionId"), rag_future=rag_future))
+    watcher = asyncio.ensure_future(_until_disconnected(request, task))
+    try:
+        r = await task
+    except asyncio.CancelledError:
+        aggs_task.cancel()
+        if not (watcher.done() and not watcher.cancelled() and watcher.result()):
+            raise
+        logger.info(f"Chat client for {c['uname']} disconnected; investigation cancelled")
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except Exception as e:
+        aggs_task.cancel()
+        logger.error(f"agent_logic.process_query raised exception: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
+    finally:
+        watcher.cancel()
+
+    if not isinstance(r, dict):
+        logger.error(f"agent_logic.process_query returned non-dict: {type(r)}")
+        raise HTTPException(status_code=500, detail="Internal processing error")
+    
+    if "error" in r:
+        aggs_task.cancel()
+        logger.error(f"agent_logic.process_query error: {r['error']}")
+        raise HTTPException(status_code=500, detail=r["error"])
+    
+    aggs, aggs_ms = await aggs_task
+    _add_timings(r, schema_ms, aggs_ms, started)
+    # Returned directly so the hit list is serialized once by orjson, without a jsonable_encoder pass
+    return ORJSONResponse(_chat_payload(c["uname"], c["index"], r, aggs))
+
+def _frame(fmt, event, data):
+    if fmt == "ndjson":
+        return orjson.dumps({"event": event, "data": data}) + b"\n"
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Same as /api/chat, but streamed as it happens (SSE, or NDJSON with "format": "ndjson"):
+    "step" per reasoning step, "token" for analysis text, "query" once the DSL validates,
+    "results" when Elasticsearch answers, then "done" with the full /api/chat payload. Template
+    hits with a background narrative add a final "narrative" event once the LLM has written it.
+    """
+    c = await _chat_request(request)
+    fmt = "ndjson" if c["body"].get("format") == "ndjson" else "sse"
+    events = asyncio.Queue()
+
+    def on_event(kind, data):
+        events.put_nowait((kind, data))
+
+    async def generate():
+        yield _frame(fmt, "step", {"step": "Loading index schema", "type": "schema"})
+        started = time.perf_counter()
+        rag_future = agent_logic.prefetch_rag(c["prompt"])
+        # Dashboard aggregations do not depend on the LLM, so they run alongside it
+        aggs_task = asyncio.ensure_future(_timed(_dashboard_aggs(c["index"], c["body"].get("aggField"))))
+        task = None
+        try:
+            s, schema_ms = await _timed(_schema(c["index"]))
+            task = asyncio.ensure_future(agent_logic.aprocess_query(
+                c["prompt"], s, size_limit=c["size"], index_pattern=c["index"], user_name=c["uname"],
+                max_lookback_days=c["max_days"], fields=c["body"].get("fields"), role=c["role"], on_event=on_event,
+                session_id=c["body"].get("sessionId"), rag_future=rag_future
+            ))
+            task.add_done_callback(lambda _: events.put_nowait(None))
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                if await request.is_disconnected():
+                    logger.info(f"Chat stream client for {c['uname']} disconnected")
+                    return
+                yield _frame(fmt, item[0], item[1])
+            r = task.result()
+            if not isinstance(r, dict) or "error" in r:
+                yield _frame(fmt, "error", {"detail": r.get("error") if isinstance(r, dict) else "Internal processing error"})
+                return
+            aggs, aggs_ms = await aggs_task
+            _add_timings(r, schema_ms, aggs_ms, started)
+            yield _frame(fmt, "done", _chat_payload(c["uname"], c["index"], r, aggs))
+            if r.get("narrative_id"):
+                future = agent_logic.get_narrative(r["narrative_id"], c["uname"])
+                try:
+                    yield _frame(fmt, "narrative", await asyncio.wrap_future(future))
+                except Exception as e:
+                    logger.warning(f"Narrative for template hit failed: {e}")
+        except Exception as e:
+            logger.error(f"Chat stream failed: {e}", exc_info=True)
+            yield _frame(fmt, "error", {"detail": f"AI processing failed: {str(e)}"})
+        finally:
+            # A disconnected client cancels the investigation at its next await
+            if task is not None and not task.done():
+                task.cancel()
+            if not aggs_task.done():
+                aggs_task.cancel()
+
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "text/event-stream"
+    return StreamingResponse(generate(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/chat/narrative/{narrative_id}")
+async def chat_narrative(request: Request, narrative_id: str):
+    """LLM-written analysis for a template-answered /api/chat (its narrativeId), once ready."""
+    uname, _ = require_auth(request)
+    future = agent_logic.get_narrative(narrative_id, uname)
+    if future is None:
+        raise HTTPException(status_code=404, detail="Unknown narrative")
+    if not future.done():
+        return ORJSONResponse({"status": "pending"})
+    try:
+        return ORJSONResponse(dict(future.result(), status="done"))
+    except Exception as e:
+        return ORJSONResponse({"status": "failed", "detail": str(e)})
+
+@router.post("/chat/batch")
+async def chat_batch(request: Request):
+    """
+    Runs the prompts in body["prompts"] as one batch and streams each result as it finishes
+    (NDJSON, or SSE with "format": "sse"): a "result" event per distinct prompt carrying its
+    positions in the request and the /api/chat payload, then "done" with the batch totals.
+    "concurrency" may lower, but not raise, BATCH_CONCURRENCY.
+    """
+    c = await _chat_request(request)
+    prompts = c["body"].get("prompts")
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p.strip() for p in prompts):
+        raise HTTPException(status_code=400, detail="prompts must be a non-empty list of strings")
+    if len(prompts) > agent_logic.BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {agent_logic.BATCH_MAX_PROMPTS} prompts per batch")
+    fmt = "sse" if c["body"].get("format") == "sse" else "ndjson"
+    concurrency = max(1, min(int(c["body"].get("concurrency", agent_logic.BATCH_CONCURRENCY)), agent_logic.BATCH_CONCURRENCY))
+
+    async def generate():
+        started = time.perf_counter()
+        totals = {"prompts": len(prompts), "distinct": 0, "failed": 0}
+        batch = None
+        try:
+            s = await _schema(c["index"])
+            batch = agent_logic.process_queries_batch(
+                prompts, s, concurrency=concurrency, size_limit=c["size"], index_pattern=c["index"], user_name=c["uname"],
+                max_lookback_days=c["max_days"], fields=c["body"].get("fields"), role=c["role"]
+            )
+            async for item in batch:
+                if await request.is_disconnected():
+                    logger.info(f"Batch client for {c['uname']} disconnected")
+                    return
+                totals["distinct"] += 1
+                r = item["result"]
+                data = {"indexes": item["indexes"], "prompt": item["prompt"]}
+                if not isinstance(r, dict) or "error" in r:
+                    totals["failed"] += 1
+                    data["error"] = r.get("error") if isinstance(r, dict) else "Internal processing error"
+                else:
+                    data.update(_chat_payload(c["uname"], c["index"], r, None))
+                yield _frame(fmt, "result", data)
+            yield _frame(fmt, "done", dict(totals, request_ms=round((time.perf_counter() - started) * 1000, 1)))
+        except Exception as e:
+            logger.error(f"Chat batch failed: {e}", exc_info=True)
+            yield _frame(fmt, "error", {"detail": f"Batch processing failed: {str(e)}"})
+        finally:
+            if batch is not None:
+                # Cancels the investigations still running when the client goes away
+                await batch.aclose()
+
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "text/event-stream"
+    return StreamingResponse(generate(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/chat/page")
+async def chat_page(request: Request):
+    """Fetch the next page of a chat result set using the cursor from /api/chat"""
+    uname, role = require_auth(request)
+    body = await request.json()
+    c = decode_cursor(body.get("cursor", ""), uname)
+    page_size = _size(body.get("pageSize"), 1000, role)
+    page = await elastic_connector.search_page_async(c["q"], index_pattern=c["idx"], page_size=page_size, pit_id=c.get("pit"), search_after=c.get("sa"), fields=body.get("fields"))
+    if page.get("status") != "success":
+        raise HTTPException(status_code=502, detail=page.get("error", "Paged query failed"))
+    next_cursor = None if page["done"] else encode_cursor(uname, c["idx"], c["q"], page["pit_id"], page["search_after"])
+    return ORJSONResponse({"results": page["data"], "cursor": next_cursor})
+
 @router.get("/alerts/recent")
 async def get_recent_alerts(request: Request, index: str = "wazuh-alerts-*", min_level: int = 10):
     """Fetch recent high-severity alerts for proactive monitoring"""
@@ -126,7 +380,7 @@ async def get_recent_alerts(request: Request, index: str = "wazuh-alerts-*", min
             "sort": [{"@timestamp": {"order": "desc"}}]
         }
         
-        res = elastic_connector.execute_query(json.dumps(query), index_pattern=index)
+        res = await elastic_connector.execute_query_async(query, index_pattern=index, fields=ALERT_FIELDS)
         if res.get("status") != "success":
             return []
             
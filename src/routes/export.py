@@ -0,0 +1,58 @@
+import os
+import time
+import asyncio
+import logging
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import StreamingResponse
+import audit as audit_module
+import exporter
+from .auth import require_auth
+from .chat import decode_cursor
+
+router = APIRouter(prefix="/api")
+logger = logging.getLogger(__name__)
+
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "1000000"))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+@router.post("/export")
+async def export(request: Request):
+    """
+    Stream the full result set of a chat query as NDJSON or CSV (optionally gzip).
+    Takes the signed cursor from /api/chat, so only DSL the agent generated and validated can be exported.
+    """
+    uname, _ = require_auth(request)
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    c = decode_cursor(body.get("cursor", ""), uname)
+    fmt = str(body.get("format", "ndjson")).lower()
+    max_rows = min(int(body.get("maxRows", EXPORT_MAX_ROWS)), EXPORT_MAX_ROWS)
+    fields = body.get("fields")
+    try:
+        encoder, media_type, ext = exporter.make_encoder(fmt, gzip=bool(body.get("gzip", False)), columns=fields, flat=bool(body.get("flatten", False)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def generate():
+        started = time.perf_counter()
+        stats = {}
+        try:
+            async for data in exporter.stream_export(c["q"], c["idx"], encoder, chunk_size=EXPORT_CHUNK_SIZE, max_rows=max_rows,
+                                                     fields=fields, is_disconnected=request.is_disconnected, stats=stats):
+                yield data
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            state = "aborted" if stats.get("disconnected") else "completed"
+            logger.info(f"Export {state} for {uname}: {stats.get('rows', 0)} rows as {ext} in {duration_ms:.0f}ms")
+            try:
+                await asyncio.shield(asyncio.to_thread(audit_module.log_query, uname, c["idx"], stats.get("rows", 0), duration_ms, c["q"]))
+            except Exception as e:
+                logger.warning(f"Failed to audit export: {e}")
+
+    filename = f"export-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}.{ext}"
+    return StreamingResponse(generate(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Content-Type-Options": "nosniff",
+    })
@@ -1,6 +1,7 @@
 import os
 import json
 import time
+import asyncio
 import logging
 from fastapi import APIRouter, Request, HTTPException
 import audit as audit_module
@@ -87,8 +88,8 @@ async def builder(request: Request):
         }
     }
     
-    res = elastic_connector.execute_query(json.dumps(dsl), index_pattern=index)
-    return {"queryGenerated": json.dumps(dsl), "results": res.get("data", []), "status": res.get("status")}
+    res = await elastic_connector.execute_query_async(dsl, index_pattern=index)
+    return {"queryGenerated": dsl, "results": res.get("data", []), "status": res.get("status")}
 
 @router.post("/remediate")
 async def remediate(request: Request):
@@ -116,7 +117,7 @@ async def remediate(request: Request):
             # We continue so the user still gets a success message in demo mode
     
     # Mocking a webhook or orchestration call for demo
-    time.sleep(1) # Simulate network latency
+    await asyncio.sleep(1) # Simulate network latency
     
     return {
         "status": "success", 
@@ -1,7 +1,8 @@
-import json
+import asyncio
 import logging
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, HTTPException
 import elastic_connector
+import risk_scoring
 from .auth import require_auth
 
 router = APIRouter(prefix="/api")
@@ -14,7 +15,6 @@ async def get_stats(request: Request, index: str = "wazuh-alerts-*"):
     try:
         # Get total alerts in last 24h
         total_query = {"size": 0, "query": {"range": {"@timestamp": {"gte": "now-24h"}}}}
-        total_res = elastic_connector.execute_query(json.dumps(total_query), index_pattern=index)
         
         # Get high severity alerts (level > 10 in Wazuh terms)
         high_query = {
@@ -28,7 +28,6 @@ async def get_stats(request: Request, index: str = "wazuh-alerts-*"):
                 }
             }
         }
-        high_res = elastic_connector.execute_query(json.dumps(high_query), index_pattern=index)
         
         # Aggregations for charts and dynamic stats
         aggs_query = {
@@ -56,23 +55,15 @@ async def get_stats(request: Request, index: str = "wazuh-alerts-*"):
                         "field": "data.srcip",
                         "size": 1
                     }
-                },
-                "risk_scoring": {
-                    "terms": {
-                        "field": "agent.name",
-                        "size": 5
-                    },
-                    "aggs": {
-                        "score": {
-                            "sum": {
-                                "field": "rule.level"
-                            }
-                        }
-                    }
                 }
             }
         }
-        aggs_res = elastic_connector.execute_aggregation(json.dumps(aggs_query), index_pattern=index)
+        # The three searches are independent, so keep them in flight together
+        total_res, high_res, aggs_res = await asyncio.gather(
+            elastic_connector.execute_query_async(total_query, index_pattern=index),
+            elastic_connector.execute_query_async(high_query, index_pattern=index),
+            elastic_connector.execute_aggregation_async(aggs_query, index_pattern=index),
+        )
         
         total_count = total_res.get("total_hits", 0) if total_res.get("status") == "success" else 0
         high_count = high_res.get("total_hits", 0) if high_res.get("status") == "success" else 0
@@ -82,12 +73,19 @@ async def get_stats(request: Request, index: str = "wazuh-alerts-*"):
         top_attacker_buckets = aggs_res.get("top_attacker", {}).get("buckets", [])
         top_attacker = top_attacker_buckets[0].get("key", "N/A") if top_attacker_buckets else "N/A"
         
-        # Extract risk scoring
-        risk_buckets = aggs_res.get("risk_scoring", {}).get("buckets", [])
-        risk_data = [
-            {"entity": b.get("key"), "score": b.get("score", {}).get("value", 0)}
-            for b in risk_buckets
-        ]
+        # Risk scores cover every agent (composite paging) and are served from the persisted run
+        try:
+            await risk_scoring.ensure_fresh("agent", index)
+        except Exception as e:
+            logger.warning(f"Risk scoring refresh failed: {e}")
+        risk_data = (await asyncio.to_thread(risk_scoring.list_scores, "agent", "score", "desc", 5, 0, index))["items"]
+        if not risk_data:
+            # Nothing persisted yet (e.g. cluster unreachable); DEMO_MODE fallback aggs carry sample scores
+            risk_buckets = aggs_res.get("risk_scoring", {}).get("buckets", [])
+            risk_data = [
+                {"entity": b.get("key"), "score": b.get("score", {}).get("value", 0)}
+                for b in risk_buckets
+            ]
         
         return {
             "totalAlerts": total_count,
@@ -109,6 +107,22 @@ async def get_stats(request: Request, index: str = "wazuh-alerts-*"):
             "aggregations": {}
         }
 
+@router.get("/risk/{entity_type}")
+async def get_risk_scores(request: Request, entity_type: str, index: str = "wazuh-alerts-*", sort: str = "score",
+                          order: str = "desc", limit: int = 50, offset: int = 0):
+    """Full-cardinality risk scores for agents or source IPs, sortable and paged"""
+    require_auth(request)
+    if entity_type not in risk_scoring.ENTITY_FIELDS or sort not in risk_scoring.SORTABLE_COLUMNS:
+        raise HTTPException(status_code=400, detail="Unknown entity type or sort column")
+    try:
+        run = await risk_scoring.ensure_fresh(entity_type, index)
+    except Exception as e:
+        logger.error(f"Error refreshing risk scores: {e}")
+        run = await asyncio.to_thread(risk_scoring.last_run, entity_type, index)
+    page = await asyncio.to_thread(risk_scoring.list_scores, entity_type, sort, order, min(max(limit, 1), 1000), max(offset, 0), index)
+    page["lastRun"] = run
+    return page
+
 @router.get("/alerts/recent")
 async def get_recent_alerts(request: Request, index: str = "wazuh-alerts-*", min_level: int = 10):
     """Fetch recent high-severity alerts for proactive alerting"""
@@ -126,7 +140,7 @@ async def get_recent_alerts(request: Request, index: str = "wazuh-alerts-*", min
             },
             "sort": [{"@timestamp": {"order": "desc"}}]
         }
-        res = elastic_connector.execute_query(json.dumps(query), index_pattern=index)
+        res = await elastic_connector.execute_query_async(query, index_pattern=index, fields=["@timestamp", "rule.description", "rule.level", "agent.name"])
         
         if res.get("status") == "success":
             alerts = []
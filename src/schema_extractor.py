@@ -1,7 +1,12 @@
 import requests
 import json
 import os
+import re
 import logging
+from functools import lru_cache
+import numpy as np
+import validator
+from nl_cache import normalize_prompt, hashed_embedding
 
 # Configuration
 ELASTIC_URL = os.getenv("ELASTIC_URL", "https://localhost:9200")
@@ -10,16 +15,32 @@ ELASTIC_PASSWORD = os.getenv("ELASTIC_PASSWORD")
 VERIFY_SSL = os.getenv("VERIFY_SSL", "true").lower() == "true"
 REQUEST_TIMEOUT = int(os.getenv("ELASTIC_REQUEST_TIMEOUT", "20"))
 DEMO_MODE = os.getenv("DEMO_MODE", "true").lower() == "true"
+# Only the most relevant fields of large mappings are sent to the LLM
+SCHEMA_PRUNING = os.getenv("SCHEMA_PRUNING", "true").lower() == "true"
+SCHEMA_TOP_N = int(os.getenv("SCHEMA_TOP_N", "40"))
+ELASTIC_BACKEND = os.getenv("ELASTIC_BACKEND", "elasticsearch").lower()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hit fields the UI and agent_logic actually read; everything else in _source is dead weight
+DEFAULT_PROJECTION_FIELDS = [
+    "@timestamp", "id", "location",
+    "rule.id", "rule.level", "rule.description", "rule.groups", "rule.mitre.id",
+    "agent.id", "agent.name", "agent.ip",
+    "data.srcip", "data.dstip", "data.dstport", "data.srcuser", "data.dstuser",
+    "manager.name",
+]
+
 def get_index_mapping(index_pattern):
     """
     Fetches the mapping for a specific index or pattern.
     """
     url = f"{ELASTIC_URL}/{index_pattern}/_mapping"
     try:
+        if ELASTIC_BACKEND == "local":
+            import local_engine
+            return local_engine.get_engine().mapping(index_pattern)
         if not ELASTIC_USER or not ELASTIC_PASSWORD:
             raise ValueError("ELASTIC_USER/ELASTIC_PASSWORD environment variables are not set.")
         response = requests.get(
@@ -119,6 +140,98 @@ def field_analyzers(mapping_data):
         analyzers[index_name] = amap
     return analyzers
 
+def default_projection(simplified, query_dsl=None):
+    """
+    Default _source includes for a search: the display fields that exist in the
+    simplified mapping, plus every field the DSL itself references.
+    """
+    known = set()
+    for props in (simplified or {}).values():
+        known.update(props.keys())
+    fields = [f for f in DEFAULT_PROJECTION_FIELDS if not known or f in known]
+    for f in validator.referenced_fields(query_dsl):
+        if f not in fields:
+            fields.append(f)
+    return fields
+
+# Always sent, whatever the question: time bounds and the core Wazuh alert fields
+ALWAYS_KEEP_PREFIXES = ("@timestamp", "rule.", "agent.")
+# Question words -> field name tokens they usually refer to in Wazuh/ECS mappings
+FIELD_SYNONYMS = {
+    "ip": ["srcip", "dstip", "ip"],
+    "source": ["src", "srcip", "srcuser", "srcport", "source"],
+    "destination": ["dst", "dstip", "dstuser", "dstport", "destination"],
+    "port": ["srcport", "dstport", "port"],
+    "user": ["srcuser", "dstuser", "user", "username"],
+    "account": ["srcuser", "dstuser", "user", "username"],
+    "login": ["action", "logon", "srcuser", "dstuser", "outcome"],
+    "logon": ["action", "logon", "srcuser", "dstuser", "outcome"],
+    "failed": ["action", "outcome", "status"],
+    "rdp": ["dstport", "port", "logontype"],
+    "ssh": ["dstport", "port", "program_name", "sshd"],
+    "host": ["agent", "hostname", "host", "name"],
+    "file": ["syscheck", "path", "file", "md5", "sha1", "sha256"],
+    "hash": ["md5", "sha1", "sha256", "hash"],
+    "malware": ["syscheck", "virustotal", "sha256", "md5"],
+    "process": ["process", "image", "commandline", "parentimage"],
+    "command": ["commandline", "command", "process"],
+    "dns": ["query", "dns", "domain"],
+    "url": ["url", "uri", "domain"],
+    "country": ["geoip", "country_name", "country"],
+    "mitre": ["mitre", "technique", "tactic"],
+}
+FIELD_TOKEN_RE = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+
+def estimate_tokens(text):
+    """Rough LLM token count (~4 characters per token) used to report prompt savings."""
+    return (len(text) + 3) // 4
+
+@lru_cache(maxsize=65536)
+def _field_profile(field):
+    """Name tokens and name embedding of a field; mappings change rarely, so both are memoized."""
+    tokens = _field_tokens(field)
+    return tokens, hashed_embedding(" ".join(sorted(tokens)))
+
+def _field_tokens(field):
+    tokens = {t.lower() for part in re.split(r"[._@-]", field) for t in FIELD_TOKEN_RE.findall(part)}
+    tokens.update(p.lower() for p in field.split(".") if p)
+    # Numbers in a question are values (ports, counts), never field names
+    return {t for t in tokens if not t.isdigit()}
+
+def rank_fields(fields, question):
+    """
+    Fields ordered by relevance to question: lexical overlap of question words (and their
+    FIELD_SYNONYMS) with field name parts, plus hashed-embedding similarity of the names.
+    """
+    words = set(normalize_prompt(question).split())
+    expanded = set(words)
+    for w in words:
+        expanded.update(FIELD_SYNONYMS.get(w, []))
+    qvec = hashed_embedding(" ".join(sorted(words)))
+    scored = []
+    for pos, field in enumerate(fields):
+        tokens, fvec = _field_profile(field)
+        lexical = len(tokens & expanded) + sum(0.5 for w in words if len(w) > 3 and w not in tokens and any(w in t for t in tokens))
+        semantic = float(np.dot(qvec, fvec))
+        scored.append((-(2.0 * lexical + semantic), pos, field))
+    scored.sort()
+    return [f for _, _, f in scored]
+
+def prune_schema(simplified, question, top_n=None):
+    """
+    Copy of a simplified mapping with only the fields relevant to question: every
+    ALWAYS_KEEP_PREFIXES field plus the top_n best ranked others. The validator must
+    still be given the full mapping.
+    """
+    top_n = SCHEMA_TOP_N if top_n is None else top_n
+    pruned = {}
+    for index_name, props in (simplified or {}).items():
+        keep = [f for f in props if f.startswith(ALWAYS_KEEP_PREFIXES)]
+        others = [f for f in props if not f.startswith(ALWAYS_KEEP_PREFIXES)]
+        chosen = set(keep) | set(rank_fields(others, question)[:top_n])
+        pruned[index_name] = {f: t for f, t in props.items() if f in chosen}
+    return pruned
+
 def save_schema(schema, filename="schema.json"):
     with open(filename, "w") as f:
         json.dump(schema, f, indent=2)
@@ -0,0 +1,76 @@
+import copy
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls across threads: the first caller for a key
+    runs fn(), later callers block until it finishes and receive a copy of its result.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.stats["leaders"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+class AsyncSingleFlight:
+    """
+    asyncio flavour of SingleFlight. The shared call runs as its own task, so a
+    cancelled caller does not cancel the request other callers are waiting on.
+    """
+    def __init__(self):
+        self._calls = {}
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    async def do(self, key, fn):
+        loop = asyncio.get_running_loop()
+        k = (id(loop), key)
+        task = self._calls.get(k)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return copy.deepcopy(await asyncio.shield(task))
+        self.stats["leaders"] += 1
+        task = loop.create_task(fn())
+        self._calls[k] = task
+        task.add_done_callback(lambda t: self._finish(k, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, k, task):
+        self._calls.pop(k, None)
+        # Mark the exception as retrieved if every waiter went away
+        if not task.cancelled():
+            task.exception()
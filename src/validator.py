@@ -16,6 +16,38 @@ def field_types(schema):
             types[f] = t
     return types
 
+def referenced_fields(dsl):
+    """Field names a DSL touches in queries, aggregations and sorts, in first-seen order."""
+    found = []
+    def add(f):
+        if isinstance(f, str) and f not in found and not f.startswith("_"):
+            found.append(f)
+    def walk(obj):
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                if k in ("match", "term", "terms", "wildcard", "range", "prefix", "match_phrase") and isinstance(v, dict) and "field" not in v:
+                    for f in v.keys():
+                        add(f)
+                elif k == "field":
+                    add(v)
+                else:
+                    walk(v)
+        elif isinstance(obj, list):
+            for item in obj:
+                walk(item)
+    if not isinstance(dsl, dict):
+        return found
+    walk(dsl.get("query", {}))
+    walk(dsl.get("aggs", {}))
+    sort = dsl.get("sort")
+    for it in (sort if isinstance(sort, list) else [sort] if sort else []):
+        if isinstance(it, dict):
+            for f in it.keys():
+                add(f)
+        else:
+            add(it)
+    return found
+
 def has_time_range(dsl):
     q = dsl.get("query", {})
     s = json.dumps(q)
@@ -0,0 +1,39 @@
+import os, sys, io
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import numpy as np
+import orjson
+import alert_generator
+
+END_MS = 1_790_000_000_000
+
+def test_seeded_output_is_reproducible_and_streams_bulk():
+    def render():
+        buf = io.BytesIO()
+        n = alert_generator.AlertGenerator(seed=5, end_ms=END_MS).write_ndjson(buf, 2500, chunk_size=1000, bulk_index="synth")
+        return n, buf.getvalue()
+    n, body = render()
+    assert n == 2500 and render()[1] == body
+    lines = body.splitlines()
+    assert len(lines) == 5000
+    assert orjson.loads(lines[0]) == {"index": {"_index": "synth"}}
+    doc = orjson.loads(lines[1])
+    assert {"@timestamp", "rule", "agent", "manager"} <= doc.keys()
+
+def test_fast_serializer_matches_documents():
+    gen = alert_generator.AlertGenerator(seed=1, end_ms=END_MS)
+    chunk = gen.generate(3000)
+    assert gen.ndjson_lines(chunk, 7) == [orjson.dumps(d) + b"\n" for d in gen.documents(chunk, 7)]
+
+def test_distributions():
+    gen = alert_generator.AlertGenerator(seed=2, days=14, end_ms=END_MS)
+    chunk = gen.generate(200_000)
+    assert ((chunk["ts"] >= gen.start_ms) & (chunk["ts"] < END_MS)).all()
+    hours = np.bincount((chunk["ts"] // alert_generator.HOUR_MS) % 24, minlength=24)
+    assert hours[10] > 3 * hours[3]
+    # Zipfian sources: the busiest background IP dwarfs the median one
+    counts = np.bincount(chunk["src"][(chunk["src"] >= 0) & (chunk["scenario"] < 0)])
+    assert counts.max() > 50 * np.median(counts[counts > 0])
+    scenario_rows = (chunk["scenario"] >= 0).sum()
+    assert 0 < scenario_rows <= 0.02 * len(chunk["ts"])
+    brute = chunk["rule"] == alert_generator.RULE_INDEX["5712"]
+    assert brute.any() and (chunk["src"][brute & (chunk["scenario"] >= 0)] >= len(gen.source_ips)).all()
@@ -0,0 +1,30 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import pytest
+import circuit_breaker
+
+def test_opens_on_failure_rate_and_rejects_fast():
+    b = circuit_breaker.CircuitBreaker("t", window=10, min_calls=4, failure_rate=0.5, cooldown=60)
+    for ok in (True, False, False, True):
+        b.allow()
+        b.record(ok)
+    assert b.state == circuit_breaker.OPEN
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        b.allow()
+    assert b.snapshot()["rejected"] == 1
+
+def test_half_open_single_probe_then_close_or_reopen():
+    b = circuit_breaker.CircuitBreaker("t", window=10, min_calls=2, failure_rate=0.5, cooldown=0)
+    for _ in range(2):
+        b.allow()
+        b.record(False)
+    assert b.state == circuit_breaker.OPEN
+    b.allow()
+    assert b.state == circuit_breaker.HALF_OPEN
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        b.allow()
+    b.record(False)
+    assert b.state == circuit_breaker.OPEN
+    b.allow()
+    b.record(True)
+    assert b.state == circuit_breaker.CLOSED
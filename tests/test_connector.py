@@ -9,3 +9,128 @@ def test_msearch_disallowed_index():
         pytest.skip("connector deps not available")
     res = elastic_connector.execute_multi_query([{"query": {}}], index_pattern="bad-index", size_limit=10)
     assert res.get("status") == "error"
+
+def test_shared_client_is_reused(monkeypatch):
+    try:
+        elastic_connector = importlib.import_module('elastic_connector')
+    except Exception:
+        import pytest
+        pytest.skip("connector deps not available")
+    monkeypatch.setattr(elastic_connector, "ELASTIC_USER", "u")
+    monkeypatch.setattr(elastic_connector, "ELASTIC_PASSWORD", "p")
+    elastic_connector.close_client()
+    c1 = elastic_connector.get_client()
+    c2 = elastic_connector.get_client()
+    stats = elastic_connector.get_pool_stats()
+    elastic_connector.close_client()
+    assert c1 is c2
+    assert stats["client_reuses"] >= 1
+    assert elastic_connector.get_pool_stats()["clients_closed"] >= 1
+
+def test_async_msearch_disallowed_index():
+    try:
+        elastic_connector = importlib.import_module('elastic_connector')
+    except Exception:
+        import pytest
+        pytest.skip("connector deps not available")
+    import asyncio
+    res = asyncio.run(elastic_connector.execute_multi_query_async([{"query": {}}], index_pattern="bad-index", size_limit=10))
+    assert res.get("status") == "error"
+
+class _FakePitClient:
+    def __init__(self, n_docs):
+        self.docs = [{"_source": {"n": i}, "sort": [i, i]} for i in range(n_docs)]
+        self.closed = []
+
+    def open_point_in_time(self, index, keep_alive):
+        return {"id": "pit-1"}
+
+    def close_point_in_time(self, id):
+        self.closed.append(id)
+
+    def search(self, body, **kwargs):
+        start = body["search_after"][0] + 1 if body.get("search_after") else 0
+        return {"pit_id": "pit-1", "hits": {"hits": self.docs[start:start + body["size"]]}}
+
+def test_iter_query_pages_and_closes_pit(monkeypatch):
+    try:
+        elastic_connector = importlib.import_module('elastic_connector')
+    except Exception:
+        import pytest
+        pytest.skip("connector deps not available")
+    fake = _FakePitClient(25)
+    monkeypatch.setattr(elastic_connector, "get_client", lambda: fake)
+    chunks = list(elastic_connector.iter_query({"query": {"match_all": {}}}, chunk_size=10))
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    assert fake.closed == ["pit-1"]
+
+    # Stopping early still releases the point-in-time
+    fake = _FakePitClient(25)
+    monkeypatch.setattr(elastic_connector, "get_client", lambda: fake)
+    gen = elastic_connector.iter_query({"query": {"match_all": {}}}, chunk_size=10)
+    next(gen)
+    gen.close()
+    assert fake.closed == ["pit-1"]
+
+def test_concurrent_async_searches_share_one_msearch(monkeypatch):
+    try:
+        elastic_connector = importlib.import_module('elastic_connector')
+    except Exception:
+        import pytest
+        pytest.skip("connector deps not available")
+    import asyncio
+    calls = []
+
+    class FakeAsync:
+        async def msearch(self, body, **kwargs):
+            calls.append(len(body) // 2)
+            return {"responses": [{"status": 200, "hits": {"total": {"value": i}, "hits": []}} for i in range(len(body) // 2)]}
+
+    monkeypatch.setattr(elastic_connector, "get_async_client", lambda: FakeAsync())
+    monkeypatch.setattr(elastic_connector.query_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(elastic_connector, "BATCH_WINDOW_MS", 5)
+
+    async def main():
+        qs = [{"size": 0, "query": {"term": {"rule.id": str(n)}}} for n in range(3)]
+        return await asyncio.gather(*[elastic_connector.execute_query_async(q) for q in qs])
+    res = asyncio.run(main())
+    assert calls == [3]
+    assert [r["total_hits"] for r in res] == [0, 1, 2]
+
+def test_mock_fallback_reuses_one_generator():
+    try:
+        elastic_connector = importlib.import_module('elastic_connector')
+    except Exception:
+        import pytest
+        pytest.skip("connector deps not available")
+    first = elastic_connector.get_mock_data(size=5)
+    gen = elastic_connector._mock["gen"]
+    second = elastic_connector.get_mock_data(size=5)
+    assert elastic_connector._mock["gen"] is gen and first != second
+    assert elastic_connector.get_mock_data(size=3, seed=1) == elastic_connector.get_mock_data(size=3, seed=1)
+
+def test_async_client_from_a_finished_loop_is_closed(monkeypatch):
+    try:
+        elastic_connector = importlib.import_module('elastic_connector')
+    except Exception:
+        import pytest
+        pytest.skip("connector deps not available")
+    import asyncio
+    import local_engine
+    closed = []
+    class Client:
+        async def close(self):
+            closed.append(self)
+    monkeypatch.setattr(elastic_connector, "ELASTIC_BACKEND", "local")
+    monkeypatch.setattr(local_engine, "AsyncLocalElasticsearch", Client)
+    monkeypatch.setattr(elastic_connector, "_async_client", None)
+
+    async def use():
+        client = elastic_connector.get_async_client()
+        await asyncio.sleep(0)
+        return client
+    first = asyncio.run(use())
+    second = asyncio.run(use())
+    assert first is not second and closed == [first]
+    asyncio.run(elastic_connector.close_async_client())
+    assert closed == [first, second]
@@ -0,0 +1,37 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import conversation_memory
+
+def test_sessions_are_isolated_windowed_and_summarized():
+    store = conversation_memory.MemoryStore(db_path="", window=3, token_budget=10_000)
+    for i in range(10):
+        store.save("alice", "s1", f"question {i} about 10.0.0.{i}", f"Answer {i}. More detail follows.")
+    store.save("bob", None, "rdp logins", "None found.")
+    history = store.history("alice", "s1")
+    assert "question 9" in history and "question 7" in history
+    assert "- question 0 about 10.0.0.0 -> Answer 0." in history
+    assert "rdp" not in history
+    assert store.history("alice", "s2") == ""
+    assert store.snapshot()["summarizations"] == 7
+
+def test_token_budget_idle_eviction_and_persistence(tmp_path, monkeypatch):
+    db = str(tmp_path / "memory.db")
+    store = conversation_memory.MemoryStore(db_path=db, window=50, token_budget=200, idle_seconds=60)
+    for i in range(20):
+        store.save("alice", "s1", "x" * 200, "y" * 200)
+    assert conversation_memory.estimate_tokens(store.history("alice", "s1")) <= 200 + conversation_memory.MEMORY_SUMMARY_TOKENS
+    now = conversation_memory.time.time()
+    monkeypatch.setattr(conversation_memory.time, "time", lambda: now + 120)
+    assert store.snapshot()["sessions"] == 0
+    assert "Recent turns" in store.history("alice", "s1")
+    assert store.snapshot()["sessions_loaded"] == 1
+
+def test_follow_up_detection():
+    assert conversation_memory.is_follow_up("now show only those from agent 7")
+    assert not conversation_memory.is_follow_up("failed ssh logins in the last 24h")
+    assert conversation_memory.is_follow_up("run the same query for yesterday")
+    assert conversation_memory.is_follow_up("which of the previous results came from 10.0.0.5")
+    for standalone in ("alerts with rule level above 10", "is it normal to see ssh logins at night",
+                       "also show rdp connections", "more than 5 failed logins per user", "same user logging in from two countries",
+                       "alerts in the last 24 hours"):
+        assert not conversation_memory.is_follow_up(standalone), standalone
@@ -0,0 +1,52 @@
+import os, sys, sqlite3
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import orjson
+import pytest
+import local_engine
+import elastic_connector
+import cost_guard
+import audit
+
+LEADING_WILDCARD_30D = {
+    "size": 100,
+    "query": {"bool": {"must": [
+        {"wildcard": {"rule.description": "*failed*"}},
+        {"range": {"@timestamp": {"gte": "now-30d"}}}
+    ]}}
+}
+
+@pytest.fixture(autouse=True)
+def local_backend(monkeypatch):
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.generate_corpus(n_docs=100000, seed=11, days=30))
+    monkeypatch.setattr(elastic_connector, "_client", local_engine.LocalElasticsearch(engine, latency_ms=0))
+    monkeypatch.setattr(cost_guard, "_stats_cache", {})
+    # 100k docs x 20ns = 2ms for a plain filter over everything; leading wildcard weighs 26x that
+    monkeypatch.setattr(cost_guard, "ROLE_BUDGETS_MS", {"analyst": 10, "admin": 1000})
+
+def test_cheap_query_is_allowed():
+    dsl = {"query": {"bool": {"must": [{"term": {"rule.id": "5716"}}, {"range": {"@timestamp": {"gte": "now-24h"}}}]}}}
+    decision, out, est = cost_guard.check(dsl, role="analyst")
+    assert decision == cost_guard.ALLOW and out is dsl
+    assert 0 < est["candidate_docs"] < est["index_docs"] == 100000
+
+def test_expensive_query_is_narrowed_or_rejected(monkeypatch):
+    decision, out, est = cost_guard.check(LEADING_WILDCARD_30D, role="analyst")
+    assert decision == cost_guard.REWRITE
+    assert "leading_wildcard" in est["expensive_clauses"]
+    assert est["est_ms"] <= 10 < est["original_est_ms"]
+    assert cost_guard.window_seconds(out) < 30 * 86400
+    assert LEADING_WILDCARD_30D["query"]["bool"]["must"][1]["range"]["@timestamp"]["gte"] == "now-30d"
+
+    assert cost_guard.check(LEADING_WILDCARD_30D, role="admin")[0] == cost_guard.ALLOW
+    monkeypatch.setattr(cost_guard, "COST_REWRITE", False)
+    assert cost_guard.check(LEADING_WILDCARD_30D, role="analyst")[0] == cost_guard.REJECT
+
+def test_profile_sample_and_audit_row(monkeypatch, tmp_path):
+    est = cost_guard.estimate(LEADING_WILDCARD_30D, profile=True)
+    assert est["profiled"] and est["ns_per_doc"] > 0
+    monkeypatch.setattr(audit, "DB_PATH", str(tmp_path / "audit.db"))
+    audit.init_db()
+    audit.log_query("analyst1", "wazuh-alerts-*", 3, 12, LEADING_WILDCARD_30D, cost=est)
+    row = sqlite3.connect(audit.DB_PATH).execute("SELECT cost_json FROM queries").fetchone()
+    assert orjson.loads(row[0])["candidate_docs"] == est["candidate_docs"]
@@ -0,0 +1,40 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import validator
+import dsl_repair
+
+schema = {"wazuh-alerts-*": {"@timestamp": "date", "event.action": "keyword", "data.srcip": "keyword", "rule.description": "text", "destination.port": "integer"}}
+fields = validator.flatten_schema(schema)
+types = validator.field_types(schema)
+
+def _repair(dsl, max_days=7):
+    ok, errs = validator.validate_dsl(dsl, fields, types_map=types, max_days=max_days)
+    assert not ok
+    return dsl_repair.repair(dsl, errs, fields, types_map=types, max_days=max_days)
+
+def test_repairs_mechanical_errors_and_revalidates():
+    ok, dsl, errs, applied = _repair({"from": 0, "size": 5000, "query": {"match": {"event.action": {"query": "logon-failure"}}}})
+    assert ok and errs == []
+    assert set(applied) == {"top_level", "size", "operators", "time_range"}
+    assert dsl == {"size": 1000, "query": {"bool": {"must": [{"term": {"event.action": "logon-failure"}}, {"range": {"@timestamp": {"gte": "now-1d"}}}]}}}
+
+    ok, dsl, _, applied = _repair({"query": {"bool": {"must": [{"term": {"srcip": "10.0.0.5"}}], "filter": [{"range": {"@timestamp": {"gte": "now-30d", "lte": "now"}}}]}}})
+    assert ok and applied == ["field_names", "time_range"]
+    assert dsl["query"]["bool"] == {"must": [{"term": {"data.srcip": "10.0.0.5"}}, {"range": {"@timestamp": {"lte": "now", "gte": "now-7d"}}}]}
+
+def test_unrepairable_dsl_is_left_for_the_llm():
+    before = dsl_repair.get_stats()
+    original = {"query": {"bool": {"must": [{"term": {"user.email": "x"}}, {"range": {"@timestamp": {"gte": "now-1h"}}}]}}}
+    ok, dsl, errs, _ = _repair(original)
+    assert not ok and dsl is original and any("Unknown field" in e for e in errs)
+    stats = dsl_repair.get_stats()
+    assert stats["failed"] == before["failed"] + 1 and stats["llm_calls_avoided"] == before["repaired"]
+
+def test_fields_sharing_only_a_leaf_name_are_not_swapped():
+    with_agent = {"wazuh-alerts-*": dict(schema["wazuh-alerts-*"], **{"agent.name": "keyword"})}
+    f, t = validator.flatten_schema(with_agent), validator.field_types(with_agent)
+    dsl = {"query": {"bool": {"must": [{"term": {"user.name": "root"}}, {"range": {"@timestamp": {"gte": "now-1h"}}}]}}}
+    ok, errs = validator.validate_dsl(dsl, f, types_map=t, max_days=7)
+    ok, repaired, errs, applied = dsl_repair.repair(dsl, errs, f, types_map=t, max_days=7)
+    assert not ok and "field_names" not in applied
+    assert repaired["query"]["bool"]["must"][0] == {"term": {"user.name": "root"}}
@@ -0,0 +1,73 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import local_engine
+import elastic_connector
+import schema_extractor
+import entity_pivot
+
+def test_pivots_run_as_one_msearch_and_render_compactly(monkeypatch):
+    engine = local_engine.LocalEngine()
+    index = local_engine.generate_corpus(n_docs=5000, seed=7)
+    engine.add_index(index)
+    client = local_engine.LocalElasticsearch(engine, latency_ms=0)
+    monkeypatch.setattr(elastic_connector, "ELASTIC_BACKEND", "local")
+    monkeypatch.setattr(elastic_connector, "_client", client)
+    monkeypatch.setattr(elastic_connector.query_cache, "CACHE_ENABLED", False)
+    calls = []
+    msearch = client.msearch
+    monkeypatch.setattr(client, "msearch", lambda **kw: calls.append(kw) or msearch(**kw))
+
+    types = {f: c.type for f, c in index.columns.items()}
+    hits = elastic_connector.execute_query({"query": {"range": {"rule.level": {"gte": 10}}}}, size_limit=20)["data"]
+    calls.clear()
+    summary = entity_pivot.investigate(hits, types, window_hours=24 * 30)
+
+    assert len(calls) == 1 and summary["searches"] == 3
+    assert set(summary["entities"]) == {"srcip", "user", "agent"}
+    pivot = next(p for p in summary["pivots"] if p["kind"] == "srcip")
+    assert pivot["events"] > 0 and pivot["top_rules"] and "distinct_agent" in pivot
+    text = entity_pivot.render(summary)
+    assert text.count("\n") + 1 == len(summary["pivots"])
+    assert len(text) < len(str(hits))
+
+def test_aggregation_only_batches_filter_out_hits(monkeypatch):
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.generate_corpus(n_docs=500, seed=3))
+    client = local_engine.LocalElasticsearch(engine, latency_ms=0)
+    monkeypatch.setattr(elastic_connector, "ELASTIC_BACKEND", "local")
+    monkeypatch.setattr(elastic_connector, "_client", client)
+    calls = []
+    msearch = client.msearch
+    monkeypatch.setattr(client, "msearch", lambda **kw: calls.append(kw) or msearch(**kw))
+
+    with elastic_connector.batch() as b:
+        h = b.aggregation({"query": {"match_all": {}}, "aggs": {"agents": {"terms": {"field": "agent.name"}}}})
+    assert h.result()["agents"]["buckets"]
+    assert all(body.get("size") == 0 for body in calls[0]["body"][1::2])
+    assert not any(p.startswith("responses.hits.hits") for p in calls[0]["filter_path"])
+
+def test_projected_hits_keep_hash_and_ecs_entities(monkeypatch):
+    now = local_engine.now_ms()
+    types = {"@timestamp": "date", "rule.id": "keyword", "rule.level": "integer", "rule.description": "text", "agent.name": "keyword",
+             "user.name": "keyword", "source.ip": "keyword", "file.hash.sha256": "keyword", "process.command_line": "keyword"}
+    docs = [{"@timestamp": now - i * 60000, "rule": {"id": "554", "level": 12, "description": "File added"}, "agent": {"name": f"web-{i % 2}"},
+             "user": {"name": "svc"}, "source": {"ip": "10.0.0.9"}, "file": {"hash": {"sha256": "ab" * 32}}, "process": {"command_line": "x" * 200}}
+            for i in range(20)]
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.LocalIndex.from_documents("wazuh-alerts-ecs", docs, types))
+    monkeypatch.setattr(elastic_connector, "ELASTIC_BACKEND", "local")
+    monkeypatch.setattr(elastic_connector, "_client", local_engine.LocalElasticsearch(engine, latency_ms=0))
+    monkeypatch.setattr(elastic_connector.query_cache, "CACHE_ENABLED", False)
+
+    simplified = schema_extractor.simplify_mapping(engine.mapping("wazuh-alerts-*"))
+    dsl = {"query": {"bool": {"must": [{"terms": {"rule.level": [12]}}]}}}
+    display = schema_extractor.default_projection(simplified, dsl)
+    fields = entity_pivot.with_entity_fields(display, types)
+    assert "process.command_line" not in fields
+    hits = elastic_connector.execute_query(dsl, size_limit=20, fields=fields)["data"]
+    summary = entity_pivot.investigate(hits, types, window_hours=1)
+    assert set(summary["entities"]) == {"srcip", "user", "agent", "hash"}
+    assert summary["entities"]["hash"] == ["ab" * 32]
+    # The display projection alone strips them
+    bare = elastic_connector.execute_query(dsl, size_limit=20, fields=display)["data"]
+    assert set(entity_pivot.extract_entities(bare, types)) == {"agent"}
@@ -0,0 +1,52 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import csv
+import gzip
+import asyncio
+import orjson
+import local_engine
+import elastic_connector
+import exporter
+
+def _engine_client(monkeypatch, n_docs=2500):
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.generate_corpus(n_docs=n_docs, seed=5, days=1))
+    client = local_engine.AsyncLocalElasticsearch(engine, latency_ms=0)
+    monkeypatch.setattr(elastic_connector, "get_async_client", lambda: client)
+    return engine
+
+async def _collect(encoder, **kwargs):
+    out = []
+    async for data in exporter.stream_export({"query": {"match_all": {}}}, "wazuh-alerts-*", encoder, **kwargs):
+        out.append(data)
+    return b"".join(out)
+
+def test_csv_flattens_and_neutralizes_formulas():
+    enc = exporter.CsvEncoder()
+    data = enc.encode([{"rule": {"level": 5, "groups": ["a", "b"]}, "data": {"srcuser": "=cmd|' /C calc'!A0"}}])
+    data += enc.encode([{"rule": {"level": 7}, "extra": "dropped"}])
+    rows = list(csv.reader(data.decode().splitlines()))
+    assert rows[0] == ["rule.level", "rule.groups", "data.srcuser"]
+    assert rows[1] == ["5", "a;b", "'=cmd|' /C calc'!A0"]
+    assert rows[2] == ["7", "", ""]
+
+def test_gzip_ndjson_stream_round_trips_every_row(monkeypatch):
+    _engine_client(monkeypatch)
+    encoder, media_type, ext = exporter.make_encoder("ndjson", gzip=True)
+    assert (media_type, ext) == ("application/gzip", "ndjson.gz")
+    stats = {}
+    data = asyncio.run(_collect(encoder, chunk_size=300, max_rows=2000, stats=stats))
+    lines = gzip.decompress(data).splitlines()
+    assert len(lines) == stats["rows"] == 2000
+    assert "@timestamp" in orjson.loads(lines[0])
+
+def test_pit_closed_when_client_disconnects(monkeypatch):
+    engine = _engine_client(monkeypatch)
+    polls = []
+    async def is_disconnected():
+        polls.append(1)
+        return len(polls) > 1
+    stats = {}
+    asyncio.run(_collect(exporter.make_encoder("csv")[0], chunk_size=100, is_disconnected=is_disconnected, stats=stats))
+    assert stats == {"rows": 100, "disconnected": True}
+    assert not engine._pits
@@ -0,0 +1,54 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import validator
+import intent_templates
+
+ecs = {"wazuh-alerts-*": {"@timestamp": "date", "event.action": "keyword", "destination.port": "integer", "source.ip": "keyword", "rule.level": "integer"}}
+wazuh = {"wazuh-alerts-*": {"@timestamp": "date", "rule.groups": "keyword", "data.dstport": "integer", "data.srcip": "keyword", "data.dstip": "keyword", "data.srcuser": "keyword", "rule.level": "integer"}}
+
+def _valid(schema, dsl, max_days=7):
+    ok, errs = validator.validate_dsl(dsl, validator.flatten_schema(schema), types_map=validator.field_types(schema), max_days=max_days)
+    assert ok, errs
+
+def test_common_hunts_produce_valid_dsl_for_either_mapping():
+    for schema, field in ((ecs, "event.action"), (wazuh, "rule.groups")):
+        m = intent_templates.match("Show me failed logins from 10.0.0.5 in the last 3 days", validator.field_types(schema), 7)
+        assert m["template"] == "failed_logins"
+        must = m["response"]["query"]["query"]["bool"]["must"]
+        assert field in must[0]["term"]
+        assert {"range": {"@timestamp": {"gte": "now-3d"}}} in must
+        _valid(schema, m["response"]["query"])
+    rdp = intent_templates.match("Show me RDP connections in the last 24 hours", validator.field_types(wazuh), 7)
+    assert {"term": {"data.dstport": 3389}} in rdp["response"]["query"]["query"]["bool"]["must"]
+
+def test_window_is_capped_and_unexplained_qualifiers_fall_back_to_llm():
+    m = intent_templates.match("high severity alerts over the past 30 days", validator.field_types(ecs), 7)
+    _valid(ecs, m["response"]["query"])
+    assert {"range": {"@timestamp": {"gte": "now-7d"}}} in m["response"]["query"]["query"]["bool"]["must"]
+    assert intent_templates.match("failed logins from russia to domain controllers", validator.field_types(ecs), 7) is None
+    # A template whose fields the mapping lacks is not used
+    assert intent_templates.match("show /etc/shadow access", validator.field_types(ecs), 7) is None
+
+def test_ip_direction_picks_source_or_destination_field():
+    types = validator.field_types(wazuh)
+    for prompt in ("RDP connections to 10.0.0.5", "failed logins against 10.0.0.5 in the last 24 hours"):
+        m = intent_templates.match(prompt, types, 7)
+        must = m["response"]["query"]["query"]["bool"]["must"]
+        assert {"term": {"data.dstip": "10.0.0.5"}} in must and not any("data.srcip" in c.get("term", {}) for c in must)
+    m = intent_templates.match("failed logins from 10.0.0.5 in the last 24 hours", types, 7)
+    assert {"term": {"data.srcip": "10.0.0.5"}} in m["response"]["query"]["query"]["bool"]["must"]
+    # No direction word, or two IPs on one side: the LLM decides
+    assert intent_templates.match("failed logins 10.0.0.5 in the last 24 hours", types, 7) is None
+    assert intent_templates.match("RDP connections from 10.0.0.5 from 10.0.0.6", types, 7) is None
+
+def test_port_other_than_the_templates_goes_to_the_llm():
+    types = validator.field_types(wazuh)
+    assert intent_templates.match("ssh on port 2222", types, 7) is None
+    must = intent_templates.match("ssh on port 22", types, 7)["response"]["query"]["query"]["bool"]["must"]
+    assert [c for c in must if "data.dstport" in c.get("term", {})] == [{"term": {"data.dstport": 22}}]
+
+def test_sub_hour_spans_round_up():
+    m = intent_templates.match("high severity alerts in the last 90 minutes", validator.field_types(ecs), 7)
+    assert {"range": {"@timestamp": {"gte": "now-2h"}}} in m["response"]["query"]["query"]["bool"]["must"]
+    m = intent_templates.match("high severity alerts in the last 120 minutes", validator.field_types(ecs), 7)
+    assert {"range": {"@timestamp": {"gte": "now-2h"}}} in m["response"]["query"]["query"]["bool"]["must"]
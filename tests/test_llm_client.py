@@ -0,0 +1,54 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import time
+import asyncio
+import llm_client
+
+def test_probe_skips_broken_models_and_reuses_clients(monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_BACKEND", "fake")
+    monkeypatch.setattr(llm_client, "LLM_MODELS", ["retired-model", "good-model"])
+    monkeypatch.setattr(llm_client, "_clients", {})
+    monkeypatch.setattr(llm_client, "_active_model", None)
+    monkeypatch.setattr(llm_client, "_stats", {"clients_created": 0, "client_reuses": 0, "setup_ms_total": 0.0, "probes": 0, "last_probe": None, "probe_errors": {}})
+
+    class Retired(llm_client.FakeChatModel):
+        def invoke(self, messages, **kwargs):
+            raise RuntimeError("404 models/retired-model is not found")
+    build = llm_client._build
+    monkeypatch.setattr(llm_client, "_build", lambda name: Retired(name) if name == "retired-model" else build(name))
+
+    llm = llm_client.get_llm()
+    assert llm.model == "good-model"
+    assert all(llm_client.get_llm() is llm for _ in range(5))
+    stats = llm_client.get_stats()
+    assert stats["active_model"] == "good-model"
+    assert stats["clients_created"] == 2
+    assert stats["client_reuses"] == 6
+    assert "retired-model" in stats["probe_errors"]
+
+def test_fake_stream_reassembles_response():
+    llm = llm_client.FakeChatModel("fake", latency_ms=0, response='{"analysis": "streamed"}')
+    assert "".join(c.content for c in llm.stream([], chunk_chars=5)) == '{"analysis": "streamed"}'
+
+def test_fake_async_stream_matches_sync_stream():
+    llm = llm_client.FakeChatModel("fake", latency_ms=0, response='{"analysis": "streamed"}')
+    async def collect():
+        return "".join([c.content async for c in llm.astream([], chunk_chars=5)])
+    assert asyncio.run(collect()) == "".join(c.content for c in llm.stream([], chunk_chars=5))
+
+def test_start_does_not_wait_for_the_warm_up_probe(monkeypatch):
+    probed = []
+    monkeypatch.setattr(llm_client, "probe", lambda: probed.append(1) or time.sleep(0.5))
+    monkeypatch.setattr(llm_client, "LLM_PROBE_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(llm_client, "_reprobe_task", None)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        await llm_client.start()
+        started = loop.time() - t0
+        await llm_client._reprobe_task
+        await llm_client.stop()
+        return started
+    assert asyncio.run(run()) < 0.2
+    assert probed == [1]
@@ -0,0 +1,84 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import pytest
+import local_engine
+import elastic_connector
+
+DOCS = [
+    {"@timestamp": "2026-02-10T08:00:00Z", "rule": {"level": 5, "description": "sshd: authentication failed.", "groups": ["sshd", "authentication_failed"]}, "agent": {"name": "web-01"}, "data": {"srcip": "1.2.3.4"}},
+    {"@timestamp": "2026-02-10T08:30:00Z", "rule": {"level": 10, "description": "sshd: brute force trying to get access.", "groups": ["sshd", "authentication_failures"]}, "agent": {"name": "web-01"}, "data": {"srcip": "1.2.3.4"}},
+    {"@timestamp": "2026-02-10T09:15:00Z", "rule": {"level": 3, "description": "Windows logon success.", "groups": ["windows"]}, "agent": {"name": "dc-01"}},
+]
+TYPES = {"@timestamp": "date", "rule.level": "integer", "rule.description": "text", "rule.groups": "keyword", "agent.name": "keyword", "data.srcip": "keyword"}
+
+@pytest.fixture
+def client():
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.LocalIndex.from_documents("wazuh-alerts-test", DOCS, TYPES))
+    return local_engine.LocalElasticsearch(engine, latency_ms=0)
+
+def test_bool_query_sort_and_projection(client):
+    body = {
+        "size": 10,
+        "query": {"bool": {
+            "must": [{"match": {"rule.description": "sshd"}}, {"range": {"@timestamp": {"gte": "2026-02-10T08:00:00Z||/h", "lt": "2026-02-10T09:00:00Z"}}}],
+            "must_not": [{"term": {"rule.groups": "authentication_failed"}}]
+        }},
+        "sort": [{"rule.level": {"order": "desc"}}],
+        "_source": ["rule.level", "agent.*"]
+    }
+    resp = client.search(index="wazuh-alerts-*", body=body)
+    assert resp["hits"]["total"]["value"] == 1
+    hit = resp["hits"]["hits"][0]
+    assert hit["_source"] == {"rule": {"level": 10}, "agent": {"name": "web-01"}}
+    assert hit["sort"] == [10]
+
+def test_aggregations(client):
+    body = {"size": 0, "aggs": {
+        "per_hour": {"date_histogram": {"field": "@timestamp", "fixed_interval": "1h"}},
+        "agents": {"terms": {"field": "agent.name", "size": 1}, "aggs": {"risk": {"sum": {"field": "rule.level"}}}},
+        "groups": {"cardinality": {"field": "rule.groups"}},
+        "wild": {"filter": {"wildcard": {"agent.name": "dc-*"}}}
+    }}
+    aggs = client.search(index="wazuh-alerts-*", body=body)["aggregations"]
+    assert [b["doc_count"] for b in aggs["per_hour"]["buckets"]] == [2, 1]
+    assert aggs["agents"]["buckets"] == [{"key": "web-01", "doc_count": 2, "risk": {"value": 15.0}}]
+    assert aggs["agents"]["sum_other_doc_count"] == 1
+    assert aggs["groups"]["value"] == 4
+    assert aggs["wild"]["doc_count"] == 1
+
+def test_msearch_and_pit_paging(client):
+    resp = client.msearch(body=[{"index": "wazuh-alerts-*"}, {"size": 0}, {"index": "missing-*"}, {"size": 0}])["responses"]
+    assert resp[0]["status"] == 200 and resp[0]["hits"]["total"]["value"] == 3
+    assert resp[1]["status"] == 404
+
+    pit = client.open_point_in_time(index="wazuh-alerts-*")["id"]
+    body = {"size": 2, "pit": {"id": pit}, "sort": elastic_connector.PIT_SORT}
+    first = client.search(body=body)["hits"]["hits"]
+    second = client.search(body=dict(body, search_after=first[-1]["sort"]))["hits"]["hits"]
+    assert [h["_id"] for h in first + second] == ["local-0", "local-1", "local-2"]
+    assert client.close_point_in_time(id=pit)["succeeded"]
+
+def test_connector_runs_against_local_backend(monkeypatch):
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.generate_corpus(n_docs=5000, seed=7))
+    monkeypatch.setattr(elastic_connector, "ELASTIC_BACKEND", "local")
+    monkeypatch.setattr(elastic_connector, "_client", local_engine.LocalElasticsearch(engine, latency_ms=0))
+    monkeypatch.setattr(elastic_connector, "BATCH_WINDOW_MS", 0)
+    monkeypatch.setattr(elastic_connector.query_cache, "CACHE_ENABLED", False)
+    result = elastic_connector.execute_query({"query": {"range": {"rule.level": {"gte": 10}}}}, size_limit=20)
+    assert result["status"] == "success" and result["total_hits"] > 0
+    assert all(h["rule"]["level"] >= 10 for h in result["data"])
+    aggs = elastic_connector.execute_aggregation({"size": 0, "aggs": {"levels": {"terms": {"field": "rule.level"}}}})
+    assert sum(b["doc_count"] for b in aggs["levels"]["buckets"]) == 5000
+
+def test_composite_pages_with_after_key(client):
+    body = {"size": 0, "aggs": {"c": {"composite": {"size": 1, "sources": [{"agent": {"terms": {"field": "agent.name"}}}]},
+                                      "aggs": {"score": {"sum": {"field": "rule.level"}}}}}}
+    first = client.search(index="wazuh-alerts-*", body=body)["aggregations"]["c"]
+    assert first["buckets"] == [{"key": {"agent": "dc-01"}, "doc_count": 1, "score": {"value": 3.0}}]
+    body["aggs"]["c"]["composite"]["after"] = first["after_key"]
+    second = client.search(index="wazuh-alerts-*", body=body)["aggregations"]["c"]
+    assert second["buckets"] == [{"key": {"agent": "web-01"}, "doc_count": 2, "score": {"value": 15.0}}]
+    body["aggs"]["c"]["composite"]["after"] = second["after_key"]
+    assert client.search(index="wazuh-alerts-*", body=body)["aggregations"]["c"]["buckets"] == []
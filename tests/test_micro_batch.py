@@ -0,0 +1,51 @@
+import os, sys, asyncio, threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import micro_batch
+
+def _fake_msearch(calls):
+    def send(items):
+        calls.append(len(items))
+        out = []
+        for index, body in items:
+            if body.get("bad"):
+                out.append({"status": 400, "error": {"reason": "bad query"}})
+            else:
+                out.append({"status": 200, "hits": {"total": {"value": body["n"]}}})
+        return out
+    return send
+
+def test_explicit_batch_resolves_each_item():
+    calls = []
+    b = micro_batch.Batch(_fake_msearch(calls))
+    ok = b.add(micro_batch.BatchItem("idx", {"n": 1}, on_result=lambda r: r["hits"]["total"]["value"]))
+    bad = b.add(micro_batch.BatchItem("idx", {"bad": True}, on_error=lambda e: "fallback"))
+    b.flush()
+    assert calls == [2]
+    assert ok.result() == 1 and bad.result() == "fallback"
+
+def test_threads_share_one_msearch():
+    calls = []
+    batcher = micro_batch.MicroBatcher(_fake_msearch(calls), window_ms=50, max_batch=10)
+    out = {}
+    def run(n):
+        out[n] = batcher.submit("idx", {"n": n})["hits"]["total"]["value"]
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert out == {0: 0, 1: 1, 2: 2, 3: 3}
+    assert sum(calls) == 4 and len(calls) < 4
+
+def test_async_window_batches_gathered_searches():
+    calls = []
+    sync_send = _fake_msearch(calls)
+    async def send(items):
+        return sync_send(items)
+    batcher = micro_batch.AsyncMicroBatcher(send, window_ms=5, max_batch=10)
+    async def main():
+        return await asyncio.gather(*[batcher.submit("idx", {"n": n}) for n in range(3)], batcher.submit("idx", {"bad": True}), return_exceptions=True)
+    res = asyncio.run(main())
+    assert calls == [4]
+    assert [r["hits"]["total"]["value"] for r in res[:3]] == [0, 1, 2]
+    assert isinstance(res[3], micro_batch.BatchItemError) and res[3].status_code == 400
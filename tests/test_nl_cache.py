@@ -0,0 +1,45 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import nl_cache
+
+VALUE = {"query": {"query": {"range": {"@timestamp": {"gte": "now-24h"}}}}, "analysis": "Failed logins", "severity": "medium"}
+
+def test_normalized_and_near_duplicate_hits_respect_numbers(tmp_path):
+    c = nl_cache.NLCache(db_path=str(tmp_path / "nl.db"))
+    c.set("Show me failed logins in the last 24 hours", "wazuh-alerts-*", "fp1", VALUE, role="analyst", max_lookback_days=7)
+    assert c.get("failed logins last 24h", "wazuh-alerts-*", "fp1", role="analyst", max_lookback_days=7) == (dict(VALUE, **{k: None for k in nl_cache.CACHED_FIELDS if k not in VALUE}), "exact")
+    assert c.get("list failed login attempts over the past 24 hours", "wazuh-alerts-*", "fp1", role="analyst", max_lookback_days=7)[1] == "exact"
+    hit, match = c.get("logins that failed during the last 24 hours", "wazuh-alerts-*", "fp1", role="analyst", max_lookback_days=7)
+    assert match == "similar" and hit["analysis"] == "Failed logins"
+    assert c.get("failed ssh logins last 24h", "wazuh-alerts-*", "fp1", role="analyst", max_lookback_days=7) == (None, None)
+    assert c.get("failed logins last 48 hours", "wazuh-alerts-*", "fp1", role="analyst", max_lookback_days=7) == (None, None)
+    assert c.get("failed logins last 24h", "wazuh-alerts-*", "fp1", role="admin", max_lookback_days=30) == (None, None)
+
+def test_persisted_lru_and_mapping_invalidation(tmp_path):
+    db = str(tmp_path / "nl.db")
+    c = nl_cache.NLCache(db_path=db, max_entries=2, similarity=0)
+    for prompt in ("rdp from external ips", "ssh brute force", "malware on agent 007"):
+        c.set(prompt, "wazuh-alerts-*", "fp1", VALUE)
+    reloaded = nl_cache.NLCache(db_path=db, similarity=0)
+    assert reloaded.get("rdp from external ips", "wazuh-alerts-*", "fp1")[0] is None
+    assert reloaded.get("ssh brute force", "wazuh-alerts-*", "fp1")[1] == "exact"
+    assert reloaded.get("ssh brute force", "wazuh-alerts-*", "fp2")[0] is None
+    assert reloaded.snapshot()["invalidations"] == 2
+    assert nl_cache.NLCache(db_path=db, similarity=0).snapshot()["entries"] == 0
+
+def test_direction_and_yesterday_stay_in_the_key(tmp_path):
+    for a, b in (("connections from 10.0.0.5 last 24 hours", "connections to 10.0.0.5 last 24 hours"),
+                 ("rdp logins from external ips", "rdp logins to external ips"),
+                 ("failed logins yesterday", "failed logins last 48 hours")):
+        assert nl_cache.normalize_prompt(a) != nl_cache.normalize_prompt(b)
+        c = nl_cache.NLCache(db_path=str(tmp_path / "nl.db"))
+        c.clear()
+        c.set(a, "wazuh-alerts-*", "fp1", VALUE)
+        assert c.get(b, "wazuh-alerts-*", "fp1") == (None, None)
+    assert nl_cache.normalize_prompt("I want to see failed logins") == nl_cache.normalize_prompt("failed logins")
+
+def test_near_duplicates_must_agree_on_free_form_values(tmp_path):
+    c = nl_cache.NLCache(db_path=str(tmp_path / "nl.db"))
+    c.set("failed ssh logins for user administrator on host dbserver", "wazuh-alerts-*", "fp1", VALUE)
+    assert c.get("failed ssh logins for user administrator on host webserver", "wazuh-alerts-*", "fp1") == (None, None)
+    assert c.get("failed ssh logins on host dbserver for user administrator", "wazuh-alerts-*", "fp1")[1] == "similar"
@@ -0,0 +1,54 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import query_cache
+
+def test_key_ignores_key_order_and_pins_date_math():
+    a = {"size": 0, "query": {"range": {"@timestamp": {"gte": "now-24h"}}}}
+    b = {"query": {"range": {"@timestamp": {"gte": "now-24h"}}}, "size": 0}
+    k1 = query_cache.canonical_key("query", "wazuh-alerts-*", a, granularity=60, now=120)
+    k2 = query_cache.canonical_key("query", "wazuh-alerts-*", b, granularity=60, now=150)
+    k3 = query_cache.canonical_key("query", "wazuh-alerts-*", a, granularity=60, now=200)
+    assert k1 == k2
+    assert k1 != k3
+
+def test_lru_eviction_by_entries_and_bytes():
+    c = query_cache.QueryCache(max_entries=2, max_bytes=10_000, ttls={"search": 60})
+    c.set("a", {"v": 1})
+    c.set("b", {"v": 2})
+    assert c.get("a") == {"v": 1}
+    c.set("c", {"v": 3})
+    assert c.get("b") is None
+    assert c.get("a") == {"v": 1}
+    small = query_cache.QueryCache(max_entries=100, max_bytes=30, ttls={"search": 60})
+    small.set("x", {"data": "0123456789"})
+    small.set("y", {"data": "0123456789"})
+    assert small.get("x") is None and small.get("y") is not None
+    assert small.snapshot()["evictions"] == 1
+
+def test_hits_are_private_copies_and_expire():
+    c = query_cache.QueryCache(ttls={"aggregation": 60, "search": 0})
+    c.set("k", {"buckets": [1]}, "aggregation")
+    c.get("k")["buckets"].append(2)
+    assert c.get("k") == {"buckets": [1]}
+    c.set("nocache", {"v": 1}, "search")
+    assert c.get("nocache") is None
+    c._entries["k"] = (0, c._entries["k"][1])
+    assert c.get("k") is None
+    assert c.snapshot()["expirations"] == 1
+
+def test_live_tail_queries_bypass_the_result_cache(monkeypatch):
+    import local_engine
+    import elastic_connector
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.generate_corpus(n_docs=500, seed=1))
+    monkeypatch.setattr(elastic_connector, "ELASTIC_BACKEND", "local")
+    monkeypatch.setattr(elastic_connector, "_client", local_engine.LocalElasticsearch(engine, latency_ms=0))
+    monkeypatch.setattr(elastic_connector, "BATCH_WINDOW_MS", 0)
+    monkeypatch.setattr(query_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(query_cache, "result_cache", query_cache.QueryCache())
+    tail = {"size": 5, "query": {"range": {"@timestamp": {"gte": "now-1m"}}}, "sort": [{"@timestamp": {"order": "desc"}}]}
+    for _ in range(2):
+        assert elastic_connector.execute_query(tail, cache=False)["status"] == "success"
+    assert query_cache.result_cache.snapshot()["stores"] == 0
+    elastic_connector.execute_query(tail)
+    assert query_cache.result_cache.snapshot()["stores"] == 1
@@ -0,0 +1,44 @@
+import os, sys, asyncio
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import local_engine
+import elastic_connector
+import risk_scoring
+
+def test_scores_every_entity_across_composite_pages(monkeypatch, tmp_path):
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.generate_corpus(n_docs=20000, seed=3, days=1))
+    monkeypatch.setattr(elastic_connector, "_client", local_engine.LocalElasticsearch(engine, latency_ms=0))
+    monkeypatch.setattr(risk_scoring, "RISK_DB_PATH", str(tmp_path / "risk.db"))
+
+    run = risk_scoring.compute_risk_scores("agent", page_size=7)
+    agents = elastic_connector.execute_aggregation({"size": 0, "aggs": {"n": {"cardinality": {"field": "agent.name"}}}})
+    assert run["entities"] == agents["n"]["value"] > 7
+
+    page = risk_scoring.list_scores("agent", sort="score", order="desc", limit=3)
+    assert page["total"] == run["entities"]
+    scores = [i["score"] for i in page["items"]]
+    assert scores == sorted(scores, reverse=True)
+    assert risk_scoring.last_run("agent")["entities"] == run["entities"]
+
+def test_refreshes_for_two_index_patterns_keep_separate_scores(monkeypatch, tmp_path):
+    engine = local_engine.LocalEngine()
+    engine.add_index(local_engine.generate_corpus(n_docs=2000, seed=3, days=1, name="wazuh-alerts-a"))
+    engine.add_index(local_engine.generate_corpus(n_docs=500, seed=4, days=1, name="wazuh-alerts-b"))
+    monkeypatch.setattr(risk_scoring, "RISK_DB_PATH", str(tmp_path / "risk.db"))
+    monkeypatch.setattr(risk_scoring, "_refreshing", {})
+    monkeypatch.setattr(elastic_connector, "ALLOWED_INDEXES", ["wazuh-alerts-a", "wazuh-alerts-b"])
+
+    async def both():
+        monkeypatch.setattr(elastic_connector, "_async_client", local_engine.AsyncLocalElasticsearch(engine, latency_ms=0))
+        monkeypatch.setattr(elastic_connector, "_async_client_loop", asyncio.get_running_loop())
+        return await asyncio.gather(risk_scoring.ensure_fresh("agent", "wazuh-alerts-a"), risk_scoring.ensure_fresh("agent", "wazuh-alerts-b"))
+    run_a, run_b = asyncio.run(both())
+    assert set(risk_scoring._refreshing) == {("agent", "wazuh-alerts-a"), ("agent", "wazuh-alerts-b")}
+    assert (run_a["index"], run_b["index"]) == ("wazuh-alerts-a", "wazuh-alerts-b")
+    # Neither refresh deleted the other's rows
+    for idx, run in (("wazuh-alerts-a", run_a), ("wazuh-alerts-b", run_b)):
+        page = risk_scoring.list_scores("agent", limit=1000, index_pattern=idx)
+        assert page["total"] == run["entities"] > 0
+        assert risk_scoring.last_run("agent", idx)["index"] == idx
+    alerts = lambda idx: sum(i["alerts"] for i in risk_scoring.list_scores("agent", limit=1000, index_pattern=idx)["items"])
+    assert alerts("wazuh-alerts-a") > 1500 > 500 >= alerts("wazuh-alerts-b") > 0
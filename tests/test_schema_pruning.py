@@ -0,0 +1,26 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import json
+import validator
+import schema_extractor
+
+def _wide_schema(n_noise=2000):
+    props = {"@timestamp": "date", "rule.level": "integer", "rule.description": "text", "agent.name": "keyword",
+             "data.srcip": "keyword", "data.dstport": "integer", "data.win.eventdata.targetUserName": "keyword",
+             "syscheck.sha256_after": "keyword"}
+    props.update({f"data.vendor{i}.metric_{i % 37}": "long" for i in range(n_noise)})
+    return {"wazuh-alerts-4.x-2026.10.17": props}
+
+def test_prune_keeps_core_and_relevant_fields_only():
+    full = _wide_schema()
+    pruned = schema_extractor.prune_schema(full, "Failed logins from source IP 10.0.0.5 to port 22", top_n=10)
+    fields = pruned["wazuh-alerts-4.x-2026.10.17"]
+    assert {"@timestamp", "rule.level", "rule.description", "agent.name", "data.srcip", "data.dstport"} <= set(fields)
+    assert len(fields) == 4 + 10
+    hash_fields = schema_extractor.prune_schema(full, "files with a known malware hash", top_n=3)["wazuh-alerts-4.x-2026.10.17"]
+    assert "syscheck.sha256_after" in hash_fields
+    before = schema_extractor.estimate_tokens(json.dumps(full))
+    after = schema_extractor.estimate_tokens(json.dumps(pruned))
+    assert after * 50 < before
+    # Validation still sees every field
+    assert "data.vendor7.metric_7" in validator.flatten_schema(full)
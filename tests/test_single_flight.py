@@ -0,0 +1,39 @@
+import os, sys, time, asyncio, threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+import single_flight
+
+def test_sync_calls_share_one_execution():
+    sf = single_flight.SingleFlight()
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"hits": [1]}
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(sf.do("k", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{"hits": [1]}] * 5
+    assert sf.stats["coalesced"] == 4
+
+def test_async_calls_share_one_execution_and_errors():
+    sf = single_flight.AsyncSingleFlight()
+    calls = []
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"total": 3}
+    async def boom():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("down")
+    async def main():
+        res = await asyncio.gather(*[sf.do("k", slow) for _ in range(10)])
+        errs = await asyncio.gather(*[sf.do("e", boom) for _ in range(3)], return_exceptions=True)
+        return res, errs
+    res, errs = asyncio.run(main())
+    assert len(calls) == 1 and res == [{"total": 3}] * 10
+    assert all(isinstance(e, RuntimeError) for e in errs)
+    assert sf.stats["coalesced"] == 11
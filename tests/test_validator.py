@@ -44,3 +44,11 @@ def test_nested_field_requires_nested():
     dsl = {"query": {"bool": {"must": [{"range": {"user": {"gte": 1}}}, {"range": {"@timestamp": {"gte": "now-1h"}}}]}}}
     ok, errs = validator.validate_dsl(dsl, fields3, types_map=types3, max_days=7)
     assert not ok and any("Nested" in e for e in errs)
+
+def test_referenced_fields_covers_query_aggs_and_sort():
+    dsl = {
+        "query": {"bool": {"must": [{"term": {"event.action": "x"}}, {"range": {"@timestamp": {"gte": "now-1h"}}}]}},
+        "aggs": {"by_user": {"terms": {"field": "user.name"}}},
+        "sort": [{"destination.port": {"order": "desc"}}]
+    }
+    assert validator.referenced_fields(dsl) == ["event.action", "@timestamp", "user.name", "destination.port"]